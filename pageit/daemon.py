@@ -0,0 +1,290 @@
+#!/usr/bin/python
+# coding: utf-8
+
+'''Long-running build server controlled over a local socket.
+
+A :py:class:`~pageit.daemon.Daemon` keeps a
+:py:class:`~pageit.render.Pageit` instance (along with its compiled
+templates, dependency cache, and loaded data) in memory and runs commands
+sent with :py:func:`~pageit.daemon.send` over a Unix domain socket.
+
+Requests and responses are single lines of JSON. The available commands are:
+
+- ``build``: render stale templates
+- ``clean``: delete generated output
+- ``status``: report information about the daemon
+- ``stop``: stop the daemon
+
+.. versionadded:: 0.3.0
+'''
+
+# Native
+from os import path as osp
+from SocketServer import StreamRequestHandler, UnixStreamServer
+import collections
+import json
+import logging
+import os
+import socket
+import threading
+import time
+
+# Package
+try:
+    from pageit import tools
+    from pageit.namespace import Namespace
+except ImportError:  # pragma: no cover
+    from . import tools
+    from .namespace import Namespace
+
+DEFAULT = Namespace(
+    log=logging.getLogger('com.metaist.pageit.daemon'),
+    timeout=0.5
+)
+
+MSG_PRE = '%-9s '
+MSG = Namespace(
+    START=MSG_PRE + 'listening on <%s>',
+    STOP=MSG_PRE + 'stopped',
+    COMMAND=MSG_PRE + 'received <%s>',
+    CONFIG=MSG_PRE + 'reloading <%s>',
+    ERROR=MSG_PRE + 'cannot run <%s>: %s'
+)
+
+
+def _plain(value):
+    '''Converts a value that JSON cannot encode into one that it can.'''
+    if isinstance(value, collections.Mapping):
+        return dict(value)
+    return repr(value)
+
+
+def send(path, command, **params):
+    '''Sends a command to a running daemon.
+
+    Args:
+        path (str): path to the daemon's socket
+        command (str): command to send
+        **params: additional request parameters
+
+    Returns:
+        dict: response from the daemon; if the daemon cannot be reached, the
+        response has ``ok`` set to False and an ``error`` message
+
+    Example:
+        >>> send('fake.sock', 'status')['ok']
+        False
+    '''
+    request = dict(params, command=command)
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(path)
+        client.sendall(json.dumps(request) + '\n')
+        return json.loads(client.makefile().readline())
+    except (IOError, OSError, ValueError) as ex:
+        return dict(ok=False, error=str(ex))
+    finally:
+        client.close()
+
+
+class Handler(StreamRequestHandler):
+    '''Reads one request and writes its response.'''
+
+    def handle(self):
+        '''Handle a request.
+
+        Errors (including those raised while rendering) are logged and sent
+        back as a response that is not ``ok``.
+        '''
+        daemon = self.server.daemon
+        command = None
+        try:
+            request = json.loads(self.rfile.readline())
+            command = request.get('command')
+            response = daemon.dispatch(request)
+        except Exception as ex:  # pylint: disable=W0703
+            daemon.log.exception(MSG.ERROR, daemon._context, command, ex)
+            response = dict(ok=False, command=command,
+                            error='%s: %s' % (ex.__class__.__name__, ex))
+        self.wfile.write(json.dumps(response, default=_plain) + '\n')
+
+
+class Daemon(object):
+    '''Runs commands for a renderer sent over a local socket.
+
+    Commands (and file changes passed to
+    :py:meth:`~pageit.daemon.Daemon.on_change`) are run one at a time. File
+    changes are queued on a :py:class:`~pageit.tools.BuildQueue` while the
+    daemon serves, so a burst of changes (including those that arrive during
+    a build) results in one build.
+
+    Args:
+        runner (pageit.render.Pageit): renderer to keep in memory
+        path (str): path to the socket
+        config (str, optional): YAML configuration file to reload when it
+            changes
+        env (str, optional): configuration section to load
+        log (logging.Logger, optional): logger to use
+    '''
+
+    _context = '[DAEMON]'
+
+    def __init__(self, runner, path, config=None, env=None, log=None):
+        '''Construct a daemon.'''
+        self.runner = runner
+        self.path = osp.abspath(path)
+        self.config = config
+        self.env = env
+        self.log = log or DEFAULT.log
+        self.lock = threading.RLock()
+        self.running = False
+        self.started = time.time()
+        self.builds = 0
+        self.queue = tools.BuildQueue(self.on_changes, log=self.log)
+        self._config_mtime = self.config_mtime()
+
+    def config_mtime(self):
+        '''Returns the modification time of the configuration file.
+
+        Returns:
+            float: modification time; None if there is no configuration file
+        '''
+        if self.config and osp.isfile(self.config):
+            return osp.getmtime(self.config)
+        return None
+
+    def reload(self):
+        '''Reloads the configuration file if it changed.
+
+        Returns:
+            Daemon: for method chaining
+        '''
+        mtime = self.config_mtime()
+        if mtime == self._config_mtime:
+            return self
+
+        from pageit.render import create_site
+        self.log.info(MSG.CONFIG, self._context, self.config)
+        self.runner.set_site(create_site(self.config, self.env, self.log))
+        self._config_mtime = mtime
+        return self
+
+    def dispatch(self, request):
+        '''Runs a command.
+
+        Args:
+            request (dict): request with a ``command`` key
+
+        Returns:
+            dict: response with an ``ok`` key
+        '''
+        command = request.get('command')
+        self.log.debug(MSG.COMMAND, self._context, command)
+        handler = getattr(self, 'do_' + str(command), None)
+        if not handler:
+            return dict(ok=False, error='unknown command: %s' % command)
+
+        start = time.time()
+        with self.lock:
+            response = handler()
+        response.update(ok=True, command=command,
+                        elapsed=round(time.time() - start, 3))
+        return response
+
+    def do_build(self):
+        '''Renders stale templates.
+
+        Returns:
+            dict: statistics about the build
+        '''
+        self.reload().runner.run()
+        self.builds += 1
+        return dict(stats=self.runner.stats)
+
+    def do_clean(self):
+        '''Deletes generated output.
+
+        Returns:
+            dict: statistics about the deleted files
+        '''
+        self.runner.clean()
+        return dict(stats=self.runner.stats)
+
+    def do_status(self):
+        '''Returns information about the daemon.
+
+        Returns:
+            dict: status information
+        '''
+        return dict(path=self.runner.path, out=self.runner.out,
+                    pid=os.getpid(), builds=self.builds,
+                    uptime=round(time.time() - self.started, 3),
+                    templates=len(self.runner.manifest),
+                    stats=self.runner.stats)
+
+    def do_stop(self):
+        '''Stops the daemon after the current request.
+
+        Returns:
+            dict: empty response
+        '''
+        self.running = False
+        return {}
+
+    def on_change(self, path=None):
+        '''Queue a change in the directory; it is built by
+        :py:meth:`~pageit.daemon.Daemon.on_changes` on the queue's thread.
+
+        Args:
+            path (str): path that changed
+
+        Returns:
+            Daemon: for method chaining
+        '''
+        if path != self.path:  # the socket
+            self.queue.put(path)
+        return self
+
+    def on_changes(self, paths):
+        '''Build a batch of changes (see
+        :py:meth:`~pageit.render.Pageit.on_changes`).
+
+        Args:
+            paths (list): paths that changed
+
+        Returns:
+            Daemon: for method chaining
+        '''
+        with self.lock:
+            if self.config and self.config in paths:
+                self.reload().runner.run()
+            else:
+                self.runner.on_changes(paths)
+        return self
+
+    def serve(self):
+        '''Accept commands until stopped or CTRL+C is pressed.
+
+        Returns:
+            Daemon: for method chaining
+        '''
+        if osp.exists(self.path):  # left over from a previous daemon
+            os.remove(self.path)
+
+        server = UnixStreamServer(self.path, Handler)
+        server.daemon = self
+        server.timeout = DEFAULT.timeout
+        self.running = True
+        self.queue.start()
+        self.log.info(MSG.START, self._context, self.path)
+        try:
+            while self.running:
+                server.handle_request()
+        except KeyboardInterrupt:
+            print ''  # clear a line in the terminal
+        finally:
+            self.queue.stop()
+            server.server_close()
+            os.remove(self.path)
+            self.log.info(MSG.STOP, self._context)
+        return self
@@ -0,0 +1,261 @@
+#!/usr/bin/python
+# coding: utf-8
+
+'''Lazily-loaded data files.
+
+A :py:class:`~pageit.data.DataNamespace` exposes the YAML and JSON files in a
+directory by name (``site.data.products`` reads ``data/products.yml``). Files
+are only parsed when a template first reads them and are then kept until they
+change on disk. Every read is recorded with :py:func:`~pageit.track.record`
+so that pages can be re-rendered when the data they used changes.
+
+.. versionadded:: 0.3.0
+'''
+
+# Native
+from os import path as osp
+import json
+import logging
+import threading
+
+# Package
+try:
+    from pageit import track
+    from pageit.namespace import DeepNamespace
+    from pageit.storage import DiskStorage
+except ImportError:  # pragma: no cover
+    from . import track
+    from .namespace import DeepNamespace
+    from .storage import DiskStorage
+
+LOG = logging.getLogger('com.metaist.pageit.data')
+
+# data file extensions in order of preference
+EXTS = ('.yml', '.yaml', '.json')
+
+
+def load_file(path, storage=None):
+    '''Parses a YAML or JSON data file.
+
+    Args:
+        path (str): path to the data file
+        storage (pageit.storage.DiskStorage, optional): storage from which
+            to read the file; default is the local disk
+
+    Returns:
+        parsed content; dictionaries are converted to
+        :py:class:`~pageit.namespace.DeepNamespace`
+
+    Example:
+        >>> load_file('test/example1/data/links.yml').home
+        '/index.html'
+    '''
+    text = (storage or DiskStorage()).read(path)
+    if path.endswith('.json'):
+        content = json.loads(text)
+    else:
+        import yaml
+        content = yaml.safe_load(text)
+
+    if isinstance(content, dict):
+        content = DeepNamespace(content)
+    return content
+
+
+class DataNamespace(object):
+    '''Namespace whose attributes are data files in a directory.
+
+    Subdirectories become nested :py:class:`~pageit.data.DataNamespace`
+    objects. Missing names are empty
+    :py:class:`~pageit.namespace.DeepNamespace` objects so that templates can
+    test for them with :py:func:`len`. Parsed files are cached under a lock,
+    so the namespace can be read by several render threads.
+
+    Args:
+        path (str): directory containing the data files
+        log (logging.Logger, optional): logger to use
+        storage (pageit.storage.DiskStorage, optional): storage from which
+            to read the data files (see :py:mod:`pageit.storage`); default is
+            the local disk
+
+    Examples:
+        >>> data = DataNamespace('test/example1/data')
+        >>> data.links.home
+        '/index.html'
+        >>> data['links'] is data.links  # memoized
+        True
+        >>> len(data.missing) == 0
+        True
+        >>> 'links' in data and 'missing' not in data
+        True
+    '''
+    # no __dict__ so that DeepNamespace does not convert this object
+    __slots__ = ('path', 'log', 'storage', '_cache', '_checked', '_lock')
+
+    def __init__(self, path, log=None, storage=None):
+        '''Construct a data namespace for a directory.'''
+        self.path = osp.abspath(path)
+        self.log = log or LOG
+        self.storage = storage or DiskStorage()
+        self._cache = {}  # name => (mtime, content)
+        self._checked = set()  # names checked during this build
+        self._lock = threading.RLock()  # guards the cache
+
+    def __getattr__(self, name):
+        '''Returns a data file by name (dot notation).
+
+        Args:
+            name (str): name of the data file without its extension
+
+        Returns:
+            parsed content of the data file
+
+        Raises:
+            AttributeError: if the name is private (starts with ``_``)
+        '''
+        if name.startswith('_'):  # not a data file; keep protocols working
+            raise AttributeError(name)
+        return self[name]
+
+    def __getitem__(self, name):
+        '''Returns a data file by name (array notation).
+
+        Args:
+            name (str): name of the data file without its extension
+
+        Returns:
+            parsed content of the data file
+        '''
+        path = self.find(name)
+        if path is None:
+            return DeepNamespace()
+
+        if self.storage.isdir(path):
+            with self._lock:
+                cached = self._cache.get(name)
+                if not cached:
+                    cached = self._cache[name] = (
+                        0, DataNamespace(path, self.log, self.storage))
+            return cached[1]
+
+        track.record('data', path)
+        with self._lock:
+            cached = self._cache.get(name)
+            if cached and name in self._checked:
+                return cached[1]
+
+            mtime = self.storage.getmtime(path)
+            if not cached or cached[0] != mtime:
+                self.log.debug('%-9s loading <%s>', '[DATA]', path)
+                cached = (mtime, load_file(path, self.storage))
+                self._cache[name] = cached
+
+            self._checked.add(name)
+        return cached[1]
+
+    def __contains__(self, name):
+        '''Returns True if there is a data file with this name.
+
+        Args:
+            name (str): name of the data file without its extension
+
+        Returns:
+            bool: True if the data file exists
+        '''
+        return self.find(name) is not None
+
+    def __iter__(self):
+        '''Returns an iterator over the names of available data files.'''
+        return iter(self.names())
+
+    def keys(self):
+        '''Returns the names of available data files (see
+        :py:meth:`~pageit.data.DataNamespace.names`).'''
+        return self.names()
+
+    def __len__(self):
+        '''Returns the number of available data files.'''
+        return len(self.names())
+
+    def __repr__(self):
+        '''Returns a string representation of the object.
+
+        Example:
+            >>> repr(DataNamespace('data'))[:14]
+            'DataNamespace('
+        '''
+        return '%s(%r)' % (self.__class__.__name__, self.path)
+
+    def find(self, name):
+        '''Returns the path to a data file or directory.
+
+        Args:
+            name (str): name of the data file without its extension
+
+        Returns:
+            str: path to the file or directory; None if it does not exist
+
+        Examples:
+            >>> DataNamespace('test/example1/data').find('fake') is None
+            True
+        '''
+        base = osp.join(self.path, name)
+        for ext in EXTS:
+            if self.storage.isfile(base + ext):
+                return base + ext
+        if self.storage.isdir(base):
+            return base
+        return None
+
+    def names(self):
+        '''Returns the names of available data files and directories.
+
+        The directory is recorded with :py:func:`~pageit.track.record` so
+        that pages that list it are re-rendered when files are added or
+        removed.
+
+        Returns:
+            list: sorted names
+
+        Examples:
+            >>> 'links' in DataNamespace('test/example1/data').names()
+            True
+            >>> DataNamespace('fake/path').names()
+            []
+        '''
+        if not self.storage.isdir(self.path):
+            return []
+
+        track.record('data', self.path)
+        names = set([])
+        for name in self.storage.listdir(self.path):
+            base, ext = osp.splitext(name)
+            if ext in EXTS or self.storage.isdir(osp.join(self.path, name)):
+                names.add(base if ext in EXTS else name)
+        return sorted(names)
+
+    def clear(self):
+        '''Forget all parsed files; they are parsed again on their next read.
+
+        Returns:
+            DataNamespace: for method chaining
+
+        .. versionadded:: 0.3.0
+        '''
+        with self._lock:
+            self._cache.clear()
+            self._checked.clear()
+        return self
+
+    def expire(self):
+        '''Start a new build: cached files are re-checked on their next read.
+
+        Returns:
+            DataNamespace: for method chaining
+        '''
+        with self._lock:
+            self._checked.clear()
+            for _, content in self._cache.values():
+                if isinstance(content, DataNamespace):
+                    content.expire()
+        return self
@@ -0,0 +1,342 @@
+#!/usr/bin/python
+# coding: utf-8
+
+'''Render several configuration environments in one pass.
+
+:py:class:`~pageit.envs.Environments` renders a tree once for each of several
+environments of the configuration file (e.g. ``staging`` and
+``production``), each into its own output directory named after the
+environment. The environments share the work that does not depend on
+``site``: the directory tree is walked once per pass, and dependencies,
+compiled templates, parsed data files, and cached fragments are shared.
+
+Each environment keeps its own build manifest, so a template is only stale in
+the environments whose outputs are out of date. When a template is stale in
+an environment but an earlier environment has up-to-date outputs that were
+rendered from the same values of every ``site`` key the template read, those
+outputs are copied instead of rendering the template again.
+
+.. versionadded:: 0.3.0
+'''
+
+# Native
+from os import path as osp
+import time
+
+# Package
+try:
+    from pageit.namespace import Namespace
+    from pageit.render import DEFAULT, MSG_PRE, Pageit, create_logger, \
+        create_site
+    from pageit.storage import DiskStorage
+except ImportError:  # pragma: no cover
+    from .namespace import Namespace
+    from .render import DEFAULT, MSG_PRE, Pageit, create_logger, create_site
+    from .storage import DiskStorage
+
+MSG = Namespace(
+    REUSE=MSG_PRE + 'copied <%s> from environment <%s>',
+    ENV=MSG_PRE + 'environment <%s>: rendered %s and copied %s of %s '
+                  'templates'
+)
+
+
+class EnvPageit(Pageit):
+    '''A :py:class:`~pageit.render.Pageit` for one of several environments.
+
+    Stale templates whose outputs can be copied from an earlier environment
+    (see :py:meth:`~pageit.envs.EnvPageit.reusable`) are not rendered.
+
+    Args:
+        env (str): name of the environment
+        *args: arguments for :py:class:`~pageit.render.Pageit`
+        **kwds: keyword arguments for :py:class:`~pageit.render.Pageit`
+
+    Attributes:
+        earlier (list): renderers of the environments rendered before this
+            one during each pass
+        fresh (set): templates whose outputs were up to date (or were
+            written) during the last run
+        walked (list): directories found by
+            :py:meth:`~pageit.render.Pageit.walk` to use instead of walking
+            the tree again; None to walk it
+    '''
+
+    def __init__(self, env, *args, **kwds):
+        '''Construct a renderer for an environment.'''
+        Pageit.__init__(self, *args, **kwds)
+        self.env = env
+        self.earlier = []
+        self.fresh = set([])
+        self.walked = None
+        self._reused = 0
+
+    def walk(self):
+        '''Generates the directories to process (see
+        :py:meth:`~pageit.render.Pageit.walk`), unless they were already
+        found during this pass.'''
+        if self.walked is not None:
+            return iter(self.walked)
+        return Pageit.walk(self)
+
+    def run(self):
+        '''Runs the renderer (see :py:meth:`~pageit.render.Pageit.run`).
+
+        The number of templates copied from an earlier environment is in
+        ``stats.reused``.
+
+        Returns:
+            EnvPageit: for method chaining
+        '''
+        self.fresh, self._reused = set([]), 0
+        Pageit.run(self)
+        self.stats.reused = self._reused
+        self.log.debug(MSG.ENV, '[ENV]', self.env,
+                       len(self.stats.stale) - self._reused, self._reused,
+                       self.stats.total)
+        return self
+
+    def stale(self, path):
+        '''Returns the reason a template needs to be rendered (see
+        :py:meth:`~pageit.render.Pageit.stale`).'''
+        reason = Pageit.stale(self, path)
+        if not reason:
+            self.fresh.add(osp.relpath(osp.abspath(path), self.path))
+        return reason
+
+    def reusable(self, name):
+        '''Returns an earlier environment whose outputs of a template can be
+        copied.
+
+        The outputs can be copied if the template was up to date (or was
+        written) in that environment during this pass, its outputs exist,
+        and every ``site`` key it read has the same value in both
+        environments. Data files and templates are the same for every
+        environment.
+
+        Args:
+            name (str): template path relative to the rendered directory
+
+        Returns:
+            tuple: renderer of the earlier environment and its manifest
+            entry for the template; ``(None, None)`` if there is none
+        '''
+        digests = self._digests or self.site_digests()
+        for runner in self.earlier:
+            entry = runner.manifest.get(name)
+            if name not in runner.fresh or not entry or entry.site is None:
+                continue
+
+            theirs = runner._digests or runner.site_digests()
+            if all(theirs.get(key) == value == digests.get(key)
+                   for key, value in entry.site.items()) and \
+                    all(runner.storage.isfile(osp.join(runner.out, output))
+                        for output in entry.outputs or []):
+                return runner, entry
+        return None, None
+
+    def mako(self, path, dest=None):
+        '''Render a mako template (see :py:meth:`~pageit.render.Pageit.mako`)
+        or copy its outputs from an earlier environment.
+
+        Args:
+            path (str): template path
+            dest (str, optional): output path; if not provided will be computed
+
+        Returns:
+            EnvPageit: for method chaining
+        '''
+        name = osp.relpath(path, self.path)
+        runner, entry = self.reusable(name) if dest is None else (None, None)
+        if runner is None:
+            before = self.manifest.get(name)
+            Pageit.mako(self, path, dest)
+            if self.manifest.get(name) is not before:  # written
+                self.fresh.add(name)
+            return self
+
+        _context = '[ENV]'
+        previous, dests = self.outputs(path), []
+        for output in entry.outputs:
+            dest = osp.join(self.out, output)
+            self.storage.write(dest, runner.storage.read(
+                osp.join(runner.out, output)))
+            with self._lock:
+                self._outputs.add(dest)
+                self._content[dest] = (entry.digests or {}).get(output)
+                self.written(output)
+            dests.append(dest)
+
+        for old in set(previous) - set(dests):
+            if self.storage.isfile(old):
+                self.storage.remove(old)
+
+        self.manifest.set(name, **dict((key, value)
+                                       for key, value in entry.items()
+                                       if key != 'template'))
+        with self._lock:
+            self.fresh.add(name)
+            self._reused += 1
+        self.log.info(MSG.REUSE, _context, name, runner.env)
+        return self
+
+
+class Environments(object):
+    '''Renders a tree once for each of several environments.
+
+    Each environment is rendered by an :py:class:`~pageit.envs.EnvPageit`
+    into a directory named after it in the output directory. The renderers
+    share the walk of the tree during each pass, their dependency cache,
+    template lookup, data files, and fragment cache.
+
+    Args:
+        envs (list): names of the environments to render, in order
+        path (str, optional): directory to render
+        out (str, optional): directory in which to create the output
+            directory of each environment; default is ``path``
+        config (str, optional): configuration file; default is
+            ``pageit.yml`` in ``path``
+        storage (pageit.storage.DiskStorage, optional): where files are read
+            from and written to (see :py:mod:`pageit.storage`)
+        log (logging.Logger, optional): system logger
+        **kwds: other keyword arguments for :py:class:`~pageit.render.Pageit`
+
+    Example:
+        >>> import shutil, tempfile
+        >>> tmp = tempfile.mkdtemp()
+        >>> envs = Environments(['default', 'test'], 'test/example1', tmp)
+        >>> stats = envs.run().stats
+        >>> sorted(stats.envs), stats.envs.test.reused > 0
+        (['default', 'test'], True)
+        >>> osp.isfile(osp.join(tmp, 'test', 'subdir', 'index.html'))
+        True
+        >>> shutil.rmtree(tmp)
+    '''
+
+    def __init__(self, envs, path=DEFAULT.path, out=None, config=None,
+                 storage=None, log=None, **kwds):
+        '''Construct the renderers.'''
+        self.path = osp.abspath(path)
+        self.out = osp.abspath(out or path)
+        self.log = log or create_logger()
+        self.storage = storage or DiskStorage()
+        self.config = config or osp.join(self.path, DEFAULT.config)
+        self.runners = []
+        self.stats = None  # statistics about the last run
+        self._tmpl = None  # template lookup shared by the renderers
+
+        for env in envs:
+            site = create_site(self.config, env, self.log, self.storage)
+            runner = EnvPageit(env, path=self.path,
+                               out=osp.join(self.out, env), site=site,
+                               config=self.config, storage=self.storage,
+                               log=self.log, **kwds)
+            runner.earlier = list(self.runners)
+            self.runners.append(runner)
+
+        lead, outs = self.runners[0], set(item.out for item in self.runners)
+        for runner in self.runners:
+            runner.excluded = outs  # not the outputs of other environments
+            runner._deps = lead._deps
+            runner.fragments = lead.fragments
+            if runner.site.get('data') is runner.data:  # not in config
+                runner.site.data = lead.data
+            runner.data = lead.data
+
+    @property
+    def watcher(self):
+        '''pageit.tools.watch: watcher to pause while rendering.'''
+        return self.runners[0].watcher
+
+    @watcher.setter
+    def watcher(self, watcher):
+        '''Sets the watcher of every renderer.'''
+        for runner in self.runners:
+            runner.watcher = watcher
+
+    def run(self):
+        '''Renders every environment.
+
+        The statistics of each environment are in ``stats.envs``; outputs
+        written in any environment are in ``stats.written`` (relative to the
+        output directory).
+
+        Returns:
+            Environments: for method chaining
+        '''
+        start = time.time()
+        walked = list(self.runners[0].walk())
+        for runner in self.runners:
+            if self._tmpl is not None:
+                runner.tmpl = self._tmpl
+            recycled = runner.recycled
+            runner.walked = walked
+            try:
+                runner.run()
+            finally:
+                runner.walked = None
+            if runner.recycled != recycled or self._tmpl is None:
+                self._tmpl = runner._tmpl
+
+        self.stats = Namespace(
+            envs=Namespace(dict((runner.env, runner.stats)
+                                for runner in self.runners)),
+            written=[osp.join(runner.env, name) for runner in self.runners
+                     for name in runner.stats.written],
+            reused=sum(runner.stats.reused for runner in self.runners),
+            elapsed=time.time() - start)
+        return self
+
+    def clean(self):
+        '''Deletes the outputs of every environment (see
+        :py:meth:`~pageit.render.Pageit.clean`).
+
+        Returns:
+            Environments: for method chaining
+        '''
+        for runner in self.runners:
+            runner.clean()
+        self.stats = Namespace(envs=Namespace(dict(
+            (runner.env, runner.stats) for runner in self.runners)))
+        return self
+
+    def merge(self):
+        '''Combines the shards of every environment (see
+        :py:meth:`~pageit.render.Pageit.merge`).
+
+        Returns:
+            Environments: for method chaining; ``stats.shards`` is 0 if a
+            shard of any environment is missing
+        '''
+        for runner in self.runners:
+            runner.merge()
+        self.stats = Namespace(
+            envs=Namespace(dict((runner.env, runner.stats)
+                                for runner in self.runners)),
+            shards=min(runner.stats.shards for runner in self.runners))
+        return self
+
+    def ignored(self, path):
+        '''Returns True if a change to this path does not need a run (see
+        :py:meth:`~pageit.render.Pageit.ignored`).'''
+        return any(runner.ignored(path) for runner in self.runners)
+
+    def on_change(self, path=None):
+        '''React to a change in the directory.
+
+        Returns:
+            Environments: for method chaining
+        '''
+        if self.ignored(path):
+            return self
+        return self.run()
+
+    def on_changes(self, paths):
+        '''React to several changes with at most one run.
+
+        Returns:
+            Environments: for method chaining
+        '''
+        if all(self.ignored(path) for path in paths):
+            return self
+        return self.run()
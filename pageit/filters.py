@@ -0,0 +1,284 @@
+#!/usr/bin/python
+# coding: utf-8
+
+'''Post-processing of rendered pages.
+
+A filter is a callable that takes the rendered text of a page and the
+``page`` namespace passed to its template and returns the new text. A
+:py:class:`~pageit.filters.Pipeline` runs a list of filters in order right
+after a template renders.
+
+The built-in filters are:
+
+- ``html``: collapse whitespace and remove comments in HTML pages
+- ``css``: minify stylesheets and inline ``<style>`` blocks
+- ``js``: remove indentation and blank lines from scripts and inline
+  ``<script>`` blocks
+
+Other filters are named by their import path (``package.module:function``).
+
+.. versionadded:: 0.3.0
+'''
+
+# Native
+import re
+
+# content of these elements is left alone by the ``html`` filter
+RE_PRESERVE = re.compile(r'<(pre|textarea|script|style)\b.*?</\1\s*>',
+                         re.IGNORECASE | re.DOTALL)
+RE_COMMENT = re.compile(r'<!--(?!\[if|<!|>).*?-->', re.DOTALL)
+RE_STYLE = re.compile(r'(<style\b[^>]*>)(.*?)(</style\s*>)',
+                      re.IGNORECASE | re.DOTALL)
+RE_SCRIPT = re.compile(r'(<script\b[^>]*>)(.*?)(</script\s*>)',
+                       re.IGNORECASE | re.DOTALL)
+# comments, strings, and url() values; only comments are removed
+RE_CSS_TOKEN = re.compile(r'''
+    (?P<comment>/\*.*?\*/)
+  | url\(\s*(?:"(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*'|[^)]*)\s*\)
+  | "(?:\\.|[^"\\\n])*"
+  | '(?:\\.|[^'\\\n])*'
+''', re.IGNORECASE | re.DOTALL | re.VERBOSE)
+RE_CSS_LITERAL = re.compile(r'\x00(\d+)\x00')
+RE_CSS_SPACE = re.compile(r'\s*([{};,>])\s*')
+
+HTML_EXTS = ('.html', '.htm')
+
+
+def _output(page):
+    '''Returns the output name of a page (or an empty string).'''
+    return (page and page.get('output')) or ''
+
+
+def _blocks(text, pattern, func):
+    '''Apply a function to the body of every element matched by a pattern.
+
+    Args:
+        text (unicode): HTML text
+        pattern (re.RegexObject): pattern with opening tag, body, and closing
+            tag groups
+        func (callable): function to apply to each body
+
+    Returns:
+        unicode: text with the bodies replaced
+    '''
+    return pattern.sub(lambda m: m.group(1) + func(m.group(2)) + m.group(3),
+                       text)
+
+
+def minify_css(text):
+    '''Returns a stylesheet without comments or unnecessary whitespace.
+
+    Strings and ``url()`` values are left alone.
+
+    Args:
+        text (unicode): CSS
+
+    Returns:
+        unicode: minified CSS
+
+    Examples:
+        >>> minify_css(u'a, b {\\n  color: red; /* note */\\n}\\n')
+        u'a,b{color: red}'
+        >>> minify_css(u'a:after { content: "x ; }  /* y */"; }')
+        u'a:after{content: "x ; }  /* y */"}'
+        >>> minify_css(u'a { background: url(a  b.png) }')
+        u'a{background: url(a  b.png)}'
+    '''
+    literals = []
+
+    def protect(match):
+        '''Replace a literal with a placeholder and drop comments.'''
+        if match.group('comment'):
+            return ''
+        literals.append(match.group(0))
+        return u'\x00%d\x00' % (len(literals) - 1)
+
+    text = RE_CSS_TOKEN.sub(protect, text)
+    text = RE_CSS_SPACE.sub(r'\1', ' '.join(text.split()))
+    text = text.replace(';}', '}').strip()
+    return RE_CSS_LITERAL.sub(lambda m: literals[int(m.group(1))], text)
+
+
+def minify_js(text):
+    '''Returns a script without indentation or blank lines.
+
+    Line breaks are kept so that scripts relying on automatic semicolon
+    insertion still work.
+
+    Args:
+        text (unicode): JavaScript
+
+    Returns:
+        unicode: minified JavaScript
+
+    Example:
+        >>> minify_js(u'\\n  var a = 1;\\n\\n  go(a);\\n')
+        u'var a = 1;\\ngo(a);'
+    '''
+    return '\n'.join(line.strip() for line in text.splitlines()
+                     if line.strip())
+
+
+def html(text, page=None):
+    '''Collapse whitespace and remove comments in an HTML page.
+
+    Runs of whitespace become a single space (or a single line break if they
+    contain one). ``<pre>``, ``<textarea>``, ``<script>``, and ``<style>``
+    elements and conditional comments are left alone. Pages that are not
+    HTML are unchanged.
+
+    Args:
+        text (unicode): rendered page
+        page (pageit.namespace.DeepNamespace, optional): page information
+
+    Returns:
+        unicode: filtered page
+
+    Examples:
+        >>> html(u'<p>\\n    Hi  <!-- x -->there\\n</p>\\n'
+        ...      u'<pre>  a\\n  b</pre>')
+        u'<p>\\nHi there\\n</p>\\n<pre>  a\\n  b</pre>'
+        >>> html(u'a  b', {'output': 'a.txt'})
+        u'a  b'
+    '''
+    if page and not _output(page).endswith(HTML_EXTS):
+        return text
+
+    def collapse(part):
+        '''Collapse whitespace outside of preserved elements.'''
+        part = RE_COMMENT.sub('', part)
+        return re.sub(r'\s+', lambda m: '\n' if '\n' in m.group(0) else ' ',
+                      part)
+
+    result, pos = [], 0
+    for match in RE_PRESERVE.finditer(text):
+        result.append(collapse(text[pos:match.start()]))
+        result.append(match.group(0))
+        pos = match.end()
+    result.append(collapse(text[pos:]))
+    return ''.join(result)
+
+
+def css(text, page=None):
+    '''Minify a stylesheet or the ``<style>`` blocks of an HTML page.
+
+    Args:
+        text (unicode): rendered page
+        page (pageit.namespace.DeepNamespace, optional): page information
+
+    Returns:
+        unicode: filtered page
+
+    Examples:
+        >>> css(u'<style>\\n a { color: red; }\\n</style>')
+        u'<style>a{color: red}</style>'
+        >>> css(u'a { color: red; }', {'output': 'site.css'})
+        u'a{color: red}'
+    '''
+    if _output(page).endswith('.css'):
+        return minify_css(text)
+    return _blocks(text, RE_STYLE, minify_css)
+
+
+def js(text, page=None):
+    '''Minify a script or the inline ``<script>`` blocks of an HTML page.
+
+    Args:
+        text (unicode): rendered page
+        page (pageit.namespace.DeepNamespace, optional): page information
+
+    Returns:
+        unicode: filtered page
+
+    Examples:
+        >>> js(u'<script>\\n  go();\\n</script>')
+        u'<script>go();</script>'
+        >>> js(u'  go();\\n', {'output': 'site.js'})
+        u'go();'
+    '''
+    if _output(page).endswith('.js'):
+        return minify_js(text)
+    return _blocks(text, RE_SCRIPT, minify_js)
+
+
+# built-in filters by name
+FILTERS = dict(html=html, css=css, js=js)
+
+
+def load(name):
+    '''Returns a filter by name.
+
+    Args:
+        name (str): name of a built-in filter or an import path of the form
+            ``package.module:function``
+
+    Returns:
+        callable: the filter
+
+    Raises:
+        ValueError: if the filter cannot be found
+
+    Examples:
+        >>> load('html') is html
+        True
+        >>> load('pageit.filters:css') is css
+        True
+        >>> load('fake')
+        Traceback (most recent call last):
+        ...
+        ValueError: unknown filter: fake
+    '''
+    if name in FILTERS:
+        return FILTERS[name]
+
+    module, _, attr = name.partition(':')
+    if not attr:
+        raise ValueError('unknown filter: %s' % name)
+    try:
+        return getattr(__import__(module, fromlist=[attr]), attr)
+    except (ImportError, AttributeError) as ex:
+        raise ValueError('cannot load filter %s: %s' % (name, ex))
+
+
+class Pipeline(object):
+    '''Filters to run, in order, on every rendered page.
+
+    Args:
+        filters (list, optional): filters or filter names (see
+            :py:func:`~pageit.filters.load`)
+
+    Example:
+        >>> pipeline = Pipeline(['html', 'css'])
+        >>> pipeline(u'<p>  Hi  </p><style> a { b: c; } </style>')
+        u'<p> Hi </p><style>a{b: c}</style>'
+        >>> pipeline.names
+        ['html', 'css']
+        >>> len(Pipeline()) == 0
+        True
+    '''
+
+    def __init__(self, filters=None):
+        '''Construct a pipeline.'''
+        self.filters = [load(item) if isinstance(item, basestring) else item
+                        for item in filters or []]
+        self.names = [item if isinstance(item, basestring) else
+                      '%s:%s' % (item.__module__, item.__name__)
+                      for item in filters or []]
+
+    def __len__(self):
+        '''Returns the number of filters.'''
+        return len(self.filters)
+
+    def __call__(self, text, page=None):
+        '''Run the filters on a page.
+
+        Args:
+            text (unicode): rendered page
+            page (pageit.namespace.DeepNamespace, optional): page information
+
+        Returns:
+            unicode: filtered page
+        '''
+        for func in self.filters:
+            text = func(text, page)
+        return text
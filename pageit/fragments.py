@@ -0,0 +1,351 @@
+#!/usr/bin/python
+# coding: utf-8
+
+'''Cache for fragments of templates shared between pages.
+
+Mark an expensive ``<%def>`` as cached to render it once per build instead
+of once per page::
+
+    <%def name="nav()" cached="True">
+      % for link in site.data.links:
+        ...
+      % endfor
+    </%def>
+
+Fragments are keyed by template and ``cache_key`` (by default, the name of
+the def); use an explicit key for fragments that vary by page, e.g.
+``cache_key="'nav:' + page.dirname"``. The ``site`` keys, data files, and
+templates a fragment reads are recorded when it renders; a cached fragment
+is used only while those values (and the template and its dependencies)
+are unchanged, and its reads are replayed so that pages using it keep their
+dependencies.
+
+Fragments are kept in an in-memory LRU and, optionally, in a directory so
+that they survive between builds.
+
+.. versionadded:: 0.3.0
+'''
+
+# Native
+from os import path as osp
+import collections
+import hashlib
+import json
+import logging
+import threading
+
+# Package
+try:
+    from pageit import tools, track
+    from pageit.namespace import Namespace
+except ImportError:  # pragma: no cover
+    from . import tools, track
+    from .namespace import Namespace
+
+DEFAULT = Namespace(
+    log=logging.getLogger('com.metaist.pageit.fragments'),
+    size=1000
+)
+
+MSG_PRE = '%-9s '
+MSG = Namespace(
+    MISS=MSG_PRE + 'rendering <%s>',
+    WRITE_ERR=MSG_PRE + 'cannot write <%s>: %s'
+)
+
+
+def _mtime(path, storage=None):
+    '''Returns the modification time of a file or directory; None if it does
+    not exist.'''
+    if storage is not None:
+        return storage.getmtime(path) if storage.isfile(path) or \
+            storage.isdir(path) else None
+    return osp.getmtime(path) if osp.exists(path) else None
+
+
+class FragmentCache(object):
+    '''Rendered fragments with the dependencies they were rendered from.
+
+    Args:
+        size (int, optional): maximum number of fragments kept in memory
+        path (str, optional): directory in which to keep fragments between
+            builds; by default, fragments are only kept in memory
+        log (logging.Logger, optional): logger to use
+        storage (pageit.storage.DiskStorage, optional): storage in which the
+            data files and templates that fragments read are checked for
+            changes (see :py:mod:`pageit.storage`); default is the local disk
+
+    Example:
+        >>> from pageit.namespace import DeepNamespace
+        >>> site = track.Tracked(DeepNamespace(title='Home'))
+        >>> cache = FragmentCache().begin(dict(title='abc'))
+        >>> render = lambda: site.title.upper()
+        >>> cache.get_or_create('nav', render)
+        'HOME'
+        >>> with track.recording() as rec:  # cached; reads are replayed
+        ...     cache.get_or_create('nav', lambda: 'FAKE')
+        'HOME'
+        >>> sorted(rec['site'])
+        ['title']
+        >>> cache.begin(dict(title='xyz')).get_or_create('nav', lambda: 'NEW')
+        'NEW'
+        >>> (cache.stats.hits, cache.stats.misses)
+        (0, 1)
+    '''
+
+    def __init__(self, size=DEFAULT.size, path=None, log=None, storage=None):
+        '''Construct an empty cache.'''
+        self.size = size
+        self.path = path
+        self.log = log or DEFAULT.log
+        self.storage = storage
+        self.entries = collections.OrderedDict()  # key => entry
+        self.lock = threading.RLock()
+        self.digests = {}  # site key => digest for the current build
+        self.version = None  # function that returns a template's version
+        self.checked = set()  # keys validated during the current build
+        self.stats = Namespace(hits=0, misses=0)
+
+    def __len__(self):
+        '''Returns the number of fragments in memory.'''
+        return len(self.entries)
+
+    def begin(self, digests, version=None):
+        '''Start a new build.
+
+        Args:
+            digests (dict): digests of the current ``site`` values keyed by
+                top-level key (see
+                :py:meth:`~pageit.render.Pageit.site_digests`)
+            version (callable, optional): function that takes a template URI
+                and returns a value that changes when the template or its
+                dependencies change
+
+        Returns:
+            FragmentCache: for method chaining
+        '''
+        with self.lock:
+            self.digests = digests or {}
+            self.version = version
+            self.checked.clear()
+            self.stats = Namespace(hits=0, misses=0)
+        return self
+
+    def clear(self):
+        '''Remove all fragments from memory.
+
+        Returns:
+            FragmentCache: for method chaining
+        '''
+        with self.lock:
+            self.entries.clear()
+            self.checked.clear()
+        return self
+
+    def file(self, key):
+        '''Returns the path at which a fragment is kept between builds.
+
+        Args:
+            key (str): fragment key
+
+        Returns:
+            str: path; None if fragments are only kept in memory
+        '''
+        if not self.path:
+            return None
+        return osp.join(self.path, hashlib.md5(key.encode('utf-8'))
+                        .hexdigest() + '.json')
+
+    def valid(self, key, entry, uri=None):
+        '''Returns True if a fragment's dependencies are unchanged.
+
+        Args:
+            key (str): fragment key
+            entry (Namespace): cached fragment
+            uri (str, optional): template the fragment belongs to
+
+        Returns:
+            bool: True if the fragment can be used
+        '''
+        if key in self.checked:
+            return True
+
+        version = self.version(uri) if self.version and uri else None
+        valid = (entry.version == version and
+                 all(self.digests.get(name) == digest
+                     for name, digest in entry.site.items()) and
+                 all(_mtime(path, self.storage) == mtime
+                     for path, mtime in entry.data.items()) and
+                 all(_mtime(path, self.storage) == mtime
+                     for path, mtime in (entry.templates or {}).items()))
+        if valid:
+            self.checked.add(key)
+        return valid
+
+    def load(self, key):
+        '''Returns a fragment kept between builds.
+
+        Args:
+            key (str): fragment key
+
+        Returns:
+            Namespace: cached fragment; None if there is none
+        '''
+        path = self.file(key)
+        if not path or not osp.isfile(path):
+            return None
+        try:
+            with open(path) as stream:
+                entry = Namespace(json.load(stream))
+        except ValueError:  # corrupt; render again
+            return None
+        return entry if entry.key == key else None
+
+    def store(self, key, entry):
+        '''Keep a fragment in memory (and on disk, if enabled).
+
+        Args:
+            key (str): fragment key
+            entry (Namespace): fragment to keep
+
+        Returns:
+            FragmentCache: for method chaining
+        '''
+        with self.lock:
+            self.entries.pop(key, None)  # most recently used
+            self.entries[key] = entry
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+        path = self.file(key)
+        if path:
+            try:
+                tools.makedirs(self.path)
+                with open(path, 'w') as stream:
+                    json.dump(dict(entry), stream)
+            except (IOError, OSError) as ex:
+                self.log.warning(MSG.WRITE_ERR, '[CACHE]', path, ex)
+        return self
+
+    def get_or_create(self, key, create, uri=None):
+        '''Returns a cached fragment or renders and caches it.
+
+        Args:
+            key (str): fragment key
+            create (callable): function that renders the fragment
+            uri (str, optional): template the fragment belongs to
+
+        Returns:
+            unicode: rendered fragment
+        '''
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                entry = self.load(key)
+
+            if entry is not None and self.valid(key, entry, uri):
+                self.stats.hits += 1
+                self.entries.pop(key, None)  # most recently used
+                self.entries[key] = entry
+                for name in entry.site:
+                    track.record('site', name)
+                for path in entry.data:
+                    track.record('data', path)
+                for path in entry.templates or {}:
+                    track.record('template', path)
+                return entry.value
+
+        self.log.debug(MSG.MISS, '[CACHE]', key)
+        version = self.version(uri) if self.version and uri else None
+        with track.recording() as accessed:
+            value = create()
+
+        with self.lock:
+            self.stats.misses += 1
+            self.checked.add(key)
+            self.store(key, Namespace(
+                key=key, value=value, version=version,
+                site=dict((name, self.digests.get(name))
+                          for name in accessed['site'] if name != 'data'),
+                data=dict((path, _mtime(path, self.storage))
+                          for path in accessed['data']),
+                templates=dict((path, _mtime(path, self.storage))
+                               for path in accessed['template'])
+            ))
+        return value
+
+    def set(self, key, value, uri=None):
+        '''Caches a value that was not rendered from a fragment.
+
+        The value has no recorded dependencies: it is kept until its
+        template (or the template's dependencies) changes or it is
+        invalidated.
+
+        Args:
+            key (str): fragment key
+            value: value to cache
+            uri (str, optional): template the value belongs to
+
+        Returns:
+            FragmentCache: for method chaining
+
+        Example:
+            >>> cache = FragmentCache().set('nav', u'Hi')
+            >>> cache.get_or_create('nav', lambda: u'FAKE')
+            u'Hi'
+        '''
+        version = self.version(uri) if self.version and uri else None
+        with self.lock:
+            self.checked.add(key)
+            self.store(key, Namespace(key=key, value=value, version=version,
+                                      site={}, data={}, templates={}))
+        return self
+
+
+class MakoCache(object):
+    '''Mako cache plugin (``cache_impl='pageit'``) backed by a
+    :py:class:`~pageit.fragments.FragmentCache`.
+
+    The fragment cache is passed in the template's cache arguments as
+    ``fragments`` (see :py:func:`~pageit.render.create_lookup`).
+
+    Args:
+        cache (mako.cache.Cache): cache of a single template
+    '''
+
+    pass_context = False
+
+    def __init__(self, cache):
+        '''Construct the plugin for a template.'''
+        self.cache = cache
+
+    def _key(self, key):
+        '''Returns a key that is unique across templates.'''
+        return u'%s:%s' % (self.cache.template.uri, key)
+
+    def get_or_create(self, key, creation_function, **kw):
+        '''Returns a cached fragment or renders and caches it.'''
+        fragments = kw.get('fragments')
+        if fragments is None:
+            return creation_function()
+        return fragments.get_or_create(self._key(key), creation_function,
+                                       self.cache.template.uri)
+
+    def set(self, key, value, **kw):
+        '''Caches a value (see :py:meth:`FragmentCache.set`).'''
+        fragments = kw.get('fragments')
+        if fragments is not None:
+            fragments.set(self._key(key), value, self.cache.template.uri)
+
+    def get(self, key, **kw):
+        '''Returns a fragment cached during this build.'''
+        fragments = kw.get('fragments')
+        entry = fragments and fragments.entries.get(self._key(key))
+        return entry.value if entry else None
+
+    def invalidate(self, key, **kw):
+        '''Removes a fragment from memory.'''
+        fragments = kw.get('fragments')
+        if fragments is not None:
+            with fragments.lock:
+                fragments.entries.pop(self._key(key), None)
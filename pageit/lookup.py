@@ -0,0 +1,120 @@
+#!/usr/bin/python
+# coding: utf-8
+
+'''Template lookup that records which templates are loaded.
+
+This module imports ``mako``; it is only imported when the first template is
+rendered (see :py:func:`~pageit.render.create_lookup`).
+
+.. versionadded:: 0.3.0
+'''
+
+# Native
+import os
+import posixpath
+import re
+import threading
+
+# 3rd Party
+from mako.exceptions import TopLevelLookupException
+from mako.lookup import TemplateLookup
+from mako.template import Template
+
+# Package
+try:
+    from pageit import track
+except ImportError:  # pragma: no cover
+    from . import track
+
+
+class TrackingLookup(TemplateLookup):
+    '''A :py:class:`mako.lookup.TemplateLookup` that records every template
+    it returns.
+
+    Templates are recorded with :py:func:`~pageit.track.record` (kind
+    ``template``) by their file name, including templates loaded with names
+    computed while rendering.
+
+    Lookups are serialized so that the lookup can be shared by rendering
+    threads even when ``collection_size`` is set (mako's LRU caches are not
+    safe to evict from several threads at once).
+
+    Args:
+        *args: arguments for :py:class:`mako.lookup.TemplateLookup`
+        storage (pageit.storage.MemoryStorage, optional): storage from which
+            to read templates (see :py:mod:`pageit.storage`); by default,
+            templates are read from the local disk by mako
+        **kwds: keyword arguments for :py:class:`mako.lookup.TemplateLookup`
+
+    Example:
+        >>> from pageit.namespace import DeepNamespace
+        >>> lookup = TrackingLookup(directories=['test/example1'])
+        >>> with track.recording() as rec:
+        ...     _ = lookup.get_template('index.html.mako').render(
+        ...         site=DeepNamespace(), page=DeepNamespace())
+        >>> sorted(str(path).split('/')[-1] for path in rec['template'])
+        ['base.html', 'child.html', 'index.html.mako']
+    '''
+
+    def __init__(self, *args, **kwds):
+        '''Construct the lookup.'''
+        self.storage = kwds.pop('storage', None)
+        TemplateLookup.__init__(self, *args, **kwds)
+        self._lock = threading.RLock()
+        self._mtimes = {}  # uri => modification time of a stored template
+
+    def adjust_uri(self, uri, relativeto):
+        '''Returns a URI adjusted relative to another template's URI.'''
+        with self._lock:
+            return TemplateLookup.adjust_uri(self, uri, relativeto)
+
+    def get_template(self, uri):
+        '''Returns a template, recording that it was loaded.
+
+        Args:
+            uri (str): template URI
+
+        Returns:
+            mako.template.Template: the template
+        '''
+        with self._lock:
+            if self.storage is None:
+                template = TemplateLookup.get_template(self, uri)
+            else:
+                template = self._get_stored(uri)
+        if template.filename:
+            track.record('template', template.filename)
+        return template
+
+    def _get_stored(self, uri):
+        '''Returns a template read from storage.
+
+        Templates are compiled again when their modification time changes.
+
+        Args:
+            uri (str): template URI
+
+        Returns:
+            mako.template.Template: the template
+
+        Raises:
+            mako.exceptions.TopLevelLookupException: if there is no template
+                with this URI
+        '''
+        name = re.sub(r'^/+', '', uri)
+        for directory in self.directories:
+            path = posixpath.normpath(posixpath.join(
+                directory.replace(os.sep, posixpath.sep), name))
+            if not self.storage.isfile(path):
+                continue
+
+            mtime = self.storage.getmtime(path)
+            template = self._collection.get(uri)
+            if template is None or self._mtimes.get(uri) != mtime:
+                template = Template(text=self.storage.read(path), uri=uri,
+                                    filename=path, lookup=self,
+                                    **self.template_args)
+                self._collection[uri] = template
+                self._mtimes[uri] = mtime
+            return template
+        raise TopLevelLookupException('Cant locate template for uri %r' % uri)
@@ -0,0 +1,314 @@
+#!/usr/bin/python
+# coding: utf-8
+
+'''Persistent record of what a build produced.
+
+The manifest is stored as JSON lines: one JSON object per rendered template.
+Paths are relative to the directory being rendered. Each entry lists the
+template's ``outputs`` with their content ``digests`` and ``sizes``, what the
+template read while rendering, and how long it took.
+
+What changed between two builds is computed with
+:py:func:`~pageit.manifest.diff` and written as a single JSON object (see
+:py:func:`~pageit.manifest.save_changes`) so that deploy scripts can upload
+only the outputs that changed.
+
+The manifests and change logs of a sharded build (see
+:py:meth:`~pageit.render.Pageit.merge`) are combined with
+:py:func:`~pageit.manifest.merge` and
+:py:func:`~pageit.manifest.merge_changes`.
+
+.. versionadded:: 0.3.0
+'''
+
+# Native
+import json
+import time
+
+# Package
+try:
+    from pageit.namespace import Namespace
+    from pageit.storage import DiskStorage
+except ImportError:  # pragma: no cover
+    from .namespace import Namespace
+    from .storage import DiskStorage
+
+
+class Manifest(object):
+    '''Build manifest keyed by template name.
+
+    Args:
+        path (str, optional): file in which to store the manifest; if not
+            provided, the manifest is only kept in memory
+        storage (pageit.storage.DiskStorage, optional): storage in which
+            the file is kept; default is the local disk
+
+    Example:
+        >>> manifest = Manifest()
+        >>> _ = manifest.set('index.html.mako', outputs=['index.html'])
+        >>> manifest.get('index.html.mako').outputs
+        ['index.html']
+        >>> manifest.get('fake.mako') is None
+        True
+        >>> _ = manifest.set('tags.html.mako', outputs=['a.html', 'b.html'])
+        >>> manifest.outputs()
+        ['a.html', 'b.html', 'index.html']
+    '''
+
+    def __init__(self, path=None, storage=None):
+        '''Construct an empty manifest.'''
+        self.path = path
+        self.storage = storage or DiskStorage()
+        self.pages = {}
+        self.dirty = False
+
+    def __contains__(self, name):
+        '''Returns True if the template is in the manifest.'''
+        return name in self.pages
+
+    def __iter__(self):
+        '''Returns an iterator over template names.'''
+        return iter(sorted(self.pages))
+
+    def __len__(self):
+        '''Returns the number of templates in the manifest.'''
+        return len(self.pages)
+
+    def get(self, name):
+        '''Returns the entry for a template.
+
+        Args:
+            name (str): template name
+
+        Returns:
+            Namespace: entry for the template; None if there is no entry
+        '''
+        return self.pages.get(name)
+
+    def set(self, name, **info):
+        '''Sets the entry for a template.
+
+        Args:
+            name (str): template name
+            **info: information about the template's output
+
+        Returns:
+            Manifest: for method chaining
+        '''
+        entry = Namespace(info, template=name)
+        if self.pages.get(name) != entry:
+            self.pages[name] = entry
+            self.dirty = True
+        return self
+
+    def remove(self, name):
+        '''Removes the entry for a template.
+
+        Args:
+            name (str): template name
+
+        Returns:
+            Manifest: for method chaining
+        '''
+        if self.pages.pop(name, None) is not None:
+            self.dirty = True
+        return self
+
+    def outputs(self):
+        '''Returns the outputs of all the templates.
+
+        Returns:
+            list: sorted output names
+        '''
+        return sorted(dest for entry in self.pages.values()
+                      for dest in entry.outputs or [])
+
+    def files(self):
+        '''Returns a fingerprint of each output.
+
+        Returns:
+            dict: content digest keyed by output name; None for outputs
+            without a recorded digest
+
+        Example:
+            >>> manifest = Manifest().set('a.mako', outputs=['a'],
+            ...                           digests={'a': 'abc'})
+            >>> manifest.files()
+            {'a': 'abc'}
+        '''
+        result = {}
+        for entry in self.pages.values():
+            digests = entry.digests or {}
+            for dest in entry.outputs or []:
+                result[dest] = digests.get(dest)
+        return result
+
+    def load(self):
+        '''Loads the manifest from disk, if present.
+
+        Returns:
+            Manifest: for method chaining
+
+        Example:
+            >>> len(Manifest('fake.jsonl').load()) == 0
+            True
+        '''
+        self.pages, self.dirty = {}, False
+        if not self.path or not self.storage.isfile(self.path):
+            return self
+
+        for line in self.storage.read(self.path).splitlines():
+            line = line.strip()
+            if not line:
+                continue
+            entry = Namespace(json.loads(line))
+            self.pages[entry.template] = entry
+        return self
+
+    def save(self):
+        '''Writes the manifest to disk if it changed.
+
+        An empty manifest is removed rather than written.
+
+        Returns:
+            Manifest: for method chaining
+        '''
+        if not self.path or not self.dirty:
+            return self
+
+        if not self.pages:
+            if self.storage.isfile(self.path):
+                self.storage.remove(self.path)
+        else:
+            self.storage.write(self.path, ''.join(
+                json.dumps(dict(self.pages[name]), sort_keys=True) + '\n'
+                for name in sorted(self.pages)))
+
+        self.dirty = False
+        return self
+
+
+def diff(before, after):
+    '''Returns the outputs that changed between two builds.
+
+    Args:
+        before (dict): output fingerprints before the build (see
+            :py:meth:`~pageit.manifest.Manifest.files`)
+        after (dict): output fingerprints after the build
+
+    Returns:
+        Namespace: sorted lists of ``added``, ``changed``, and ``removed``
+        output names
+
+    Example:
+        >>> changes = diff({'a': '1', 'b': '2', 'c': '3'},
+        ...                {'a': '1', 'b': '4', 'd': '5'})
+        >>> changes.added, changes.changed, changes.removed
+        (['d'], ['b'], ['c'])
+    '''
+    return Namespace(
+        added=sorted(set(after) - set(before)),
+        changed=sorted(name for name in set(after) & set(before)
+                       if after[name] != before[name]),
+        removed=sorted(set(before) - set(after))
+    )
+
+
+def save_changes(path, changes, storage=None, **info):
+    '''Writes the changes of a build to disk.
+
+    Args:
+        path (str): file to write
+        changes (Namespace): changed outputs (see
+            :py:func:`~pageit.manifest.diff`)
+        storage (pageit.storage.DiskStorage, optional): storage in which to
+            write the file; default is the local disk
+        **info: additional information to record (e.g. elapsed time)
+
+    Returns:
+        str: ``path``
+    '''
+    record = dict(changes, time=round(time.time(), 3), **info)
+    (storage or DiskStorage()).write(
+        path, json.dumps(record, sort_keys=True) + '\n')
+    return path
+
+
+def load_changes(path, storage=None):
+    '''Reads the changes of a build from disk.
+
+    Args:
+        path (str): file written by :py:func:`~pageit.manifest.save_changes`
+        storage (pageit.storage.DiskStorage, optional): storage from which to
+            read the file; default is the local disk
+
+    Returns:
+        Namespace: recorded changes
+    '''
+    return Namespace(json.loads((storage or DiskStorage()).read(path)))
+
+
+def merge(manifests, path=None):
+    '''Combines the manifests of builds of disjoint sets of templates.
+
+    Args:
+        manifests (list): manifests to combine
+        path (str, optional): file in which to store the combined manifest
+
+    Returns:
+        Manifest: combined manifest
+
+    Raises:
+        ValueError: if a template is in more than one manifest
+
+    Examples:
+        >>> first = Manifest().set('a.mako', outputs=['a'])
+        >>> second = Manifest().set('b.mako', outputs=['b'])
+        >>> merge([first, second]).outputs()
+        ['a', 'b']
+        >>> merge([first, first])
+        Traceback (most recent call last):
+        ...
+        ValueError: a.mako is in more than one manifest
+    '''
+    manifests = list(manifests)
+    result = Manifest(path, manifests and manifests[0].storage)
+    for manifest in manifests:
+        for name in manifest:
+            if name in result:
+                raise ValueError('%s is in more than one manifest' % name)
+            result.pages[name] = manifest.get(name)
+    result.dirty = True
+    return result
+
+
+def merge_changes(changes):
+    '''Combines the changes of builds of disjoint sets of templates.
+
+    An output that one build removed and another added (e.g. because its
+    template moved to another shard) is changed.
+
+    Args:
+        changes (list): changes of each build (see
+            :py:func:`~pageit.manifest.diff`)
+
+    Returns:
+        Namespace: sorted lists of ``added``, ``changed``, and ``removed``
+        output names
+
+    Example:
+        >>> merged = merge_changes([diff({'a': 1}, {'b': 2}),
+        ...                         diff({'b': 1, 'c': 2}, {'c': 3})])
+        >>> merged.added, merged.changed, merged.removed
+        ([], ['b', 'c'], ['a'])
+    '''
+    added, changed, removed = set(), set(), set()
+    for item in changes:
+        added.update(item.added or [])
+        changed.update(item.changed or [])
+        removed.update(item.removed or [])
+
+    moved = added & removed
+    return Namespace(added=sorted(added - moved),
+                     changed=sorted(changed | moved),
+                     removed=sorted(removed - moved))
@@ -4,47 +4,80 @@
 '''pageit generator'''
 
 # Native
+from contextlib import contextmanager
 from fnmatch import fnmatch
 from os import path as osp
 import codecs
+import collections
+import gc
+import hashlib
+import json
 import logging
 import os
 import re
 import sys
-
-# 3rd Party
-from argh import arg, expects_obj, ArghParser
-from mako.lookup import TemplateLookup
-import mako.exceptions
-import yaml
+import threading
+import time
 
 # Package
 if '__main__' == __name__:  # pragma: no cover
     sys.path.insert(0, '.')
 
 try:
-    from pageit import tools
+    from pageit import tools, track
+    from pageit.data import DataNamespace
+    from pageit.filters import Pipeline
+    from pageit.fragments import FragmentCache
+    from pageit.manifest import Manifest
+    from pageit import manifest as manifests
     from pageit.namespace import Namespace, DeepNamespace
+    from pageit.storage import DiskStorage, open_storage
     import pageit
 except ImportError:  # pragma: no cover
-    from . import tools
+    from . import tools, track
+    from .data import DataNamespace
+    from .filters import Pipeline
+    from .fragments import FragmentCache
+    from .manifest import Manifest
+    from . import manifest as manifests
     from .namespace import Namespace, DeepNamespace
+    from .storage import DiskStorage, open_storage
     import __init__ as pageit  # pylint: disable=W0403
 
 logging.basicConfig(format='%(levelname)-8s %(message)s')
 
-# regex for import line in a mako template
-RE_MAKO_IMPORT = re.compile(r'<%(include|inherit|namespace)\s+file="([^"]*)"')
+# prefix for outputs that are still being written
+TMP_PREFIX = '.pageit-'
+
+# regex for imports in a mako template that cannot be parsed
+RE_MAKO_IMPORT = re.compile(
+    r'<%(include|inherit|namespace)\b[^>]*?\bfile\s*=\s*(["\'])(.*?)\2',
+    re.DOTALL)
+
+# regex for the change log written by a shard
+RE_SHARD_CHANGES = re.compile(r'^\.pageit-changes-(\d+)-of-(\d+)\.json$')
+
+# regex for templates loaded by name in python code
+RE_GET_TEMPLATE = re.compile(r'get_template\(\s*u?(["\'])([^"\']+)\1')
 
 DEFAULT = Namespace(
     log=logging.getLogger('com.metaist.pageit.render'),
     path='.',
     tmp=None,
     config='pageit.yml',
+    data='data',
+    manifest='.pageit.jsonl',
+    changes='.pageit-changes.json',
+    shard_manifest='.pageit-shard-%s-of-%s.jsonl',
+    shard_changes='.pageit-changes-%s-of-%s.json',
+    socket='.pageit.sock',
     env='default',
     ext='.mako',
     port=80,
-    verbosity=1
+    verbosity=1,
+    jobs=1,
+    batch=100,
+    headroom=1.25  # memory growth over a recycled process before recycling
 )
 
 MSG_PRE = tools.MSG_PRE
@@ -59,14 +92,35 @@ MSG = tools.MSG + Namespace(
     IGNORE_MTIME=MSG_PRE + 'Ignoring modification times.',
 
     NO_CHANGE=MSG_PRE + 'no change in <%s>',
+    STALE=MSG_PRE + 'stale <%s>: %s',
+    REPORT=MSG_PRE + '%s of %s templates stale; estimated time %.2fs '
+                     '(%s without timings)',
+    STATS=MSG_PRE + 'rendered %s of %s templates in %.2fs',
+    CHANGES=MSG_PRE + '%s added, %s changed, %s removed outputs',
+    RECYCLE=MSG_PRE + 'reset compiled templates and caches after %s '
+                      'renders (%.1f MB in use)',
+    SCHEDULE=MSG_PRE + '%s templates on %s workers, longest first; '
+                       'estimated %.2fs',
+    SHARD=MSG_PRE + 'shard %s of %s: %s of %s templates (estimated %.2fs)',
+    MERGED=MSG_PRE + 'merged %s shards: %s templates',
+    MERGE_ERR=MSG_PRE + 'cannot merge shards: %s',
     DELETE=MSG_PRE + 'deleted <%s>',
+    LINK=MSG_PRE + 'linked <%s>',
+    LINKED=MSG_PRE + 'linked %s static files',
+    GZIP=MSG_PRE + 'compressed %s of %s outputs of <%s>',
+    FILTER=MSG_PRE + 'saved %s bytes in <%s>',
+    CLEANED=MSG_PRE + 'deleted %s files and %s empty directories',
     DELETE_ERR=MSG_PRE + 'cannot delete %s',
     RENDER=MSG_PRE + 'rendered <%s>',
     RENDER_ERR=MSG_PRE + 'cannot render %s',
+    SAME_ERR=MSG_PRE + 'cannot render <%s>: same error as <%s>',
+    ERRORS=MSG_PRE + '%s errors in %s pages',
+    ERROR=MSG_PRE + '%s pages: %s',
     WRITE=MSG_PRE + 'wrote <%s>',
     WRITE_ERR=MSG_PRE + 'cannot write to %s',
 
     NO_ENV=MSG_PRE + 'missing environment <%s> in <%s>',
+    ENV_ERR=MSG_PRE + 'cannot render several environments with %s',
     LOAD_ENV=MSG_PRE + 'loading environment <%s> in <%s>'
 )
 
@@ -103,21 +157,88 @@ class Pageit(object):
                 constructed via the :py:attr:`~pageit.render.Pageit.watcher`
                 attribute.
 
-        tmpl (mako.lookup.TemplateLookup, optioanl): mako template lookup
-            object
+        tmpl (mako.lookup.TemplateLookup, optional): mako template lookup
+            object; by default, one is created (and ``mako`` is imported) the
+            first time a template is rendered
 
         site (pageit.namespace.DeepNamespace, optional):
             :py:class:`~pageit.namespace.DeepNamespace` passed to mako
             templates during rendering
 
+        data (str, optional): directory (relative to ``path``) containing
+            data files exposed as ``site.data``; default is ``data``
+
+        stream (bool, optional): if True, write outputs to disk while they
+            render instead of holding them in memory; default is False
+
+        jobs (int, optional): number of parallel workers (threads used to
+            render stale templates, longest first); default is 1. Threads
+            share one Python interpreter lock, so they only speed up file
+            reads and writes (and compression), not the rendering itself.
+
+        out (str, optional): directory in which to write outputs; the rendered
+            directory's tree is mirrored and files that are not templates are
+            linked (or copied) into it. By default, outputs are written next
+            to their templates.
+
+        tmp (str, optional): directory in which to store generated ``mako``
+            modules when creating the template lookup
+
+        gzip (bool, optional): if True, write a gzip-compressed copy
+            (``.gz``) next to each output whose content changed; default is
+            False
+
+        filters (list, optional): filters (or names of filters) to run on
+            each rendered page before it is written; see
+            :py:mod:`pageit.filters`
+
+        fragments (str, optional): directory in which to keep cached template
+            fragments between builds; by default, they are only kept in
+            memory (see :py:mod:`pageit.fragments`)
+
+        max_templates (int, optional): maximum number of compiled templates
+            kept by the template lookup (least recently used are dropped);
+            by default, all templates are kept
+
+        recycle (int, optional): reset compiled templates and render
+            caches after this many renders (see
+            :py:meth:`~pageit.render.Pageit.recycle`)
+
+        memory (float, optional): reset compiled templates and render
+            caches whenever this process uses more than this many megabytes
+
+        storage (pageit.storage.DiskStorage, optional): where templates,
+            data files, and the configuration file are read from and outputs
+            are written to (see :py:mod:`pageit.storage`), e.g. a zip or tar
+            archive; default is the local disk. Changes are saved (see
+            :py:meth:`~pageit.storage.ArchiveStorage.flush`) at the end of
+            each run. Streaming output and compressed copies need the local
+            disk and are ignored otherwise.
+
+        shard (tuple, optional): ``(index, count)`` of the shard to build;
+            only this shard's templates and static files are built and its
+            manifest is kept separately until the shards are merged (see
+            :py:meth:`~pageit.render.Pageit.merge`)
+
+        config (str, optional): configuration file, which is read if
+            ``site`` is not given and is never copied to the output
+            directory; default is ``pageit.yml`` in ``path``
+
         log (logging.Logger, optional): system logger
 
     .. versionchanged:: 0.2.1
        Added the ``site`` parameter.
+
+    .. versionchanged:: 0.3.0
+       Added the ``data``, ``stream``, ``jobs``, ``out``, ``tmp``, ``gzip``,
+       ``filters``, ``fragments``, ``max_templates``, ``recycle``,
+       ``memory``, ``storage``, ``shard``, and ``config`` parameters and
+       the build manifest.
     '''
 
     _dry = ''
-    _outputs = []  # files that are known to be outputs
+    _digests = None  # digests of site values for the current run
+    stats = None  # statistics about the last run
 
     # pylint: disable=R0913
     def __init__(self,
@@ -129,23 +250,122 @@ class Pageit(object):
                  watcher=None,
                  tmpl=None,
                  site=None,
+                 data=DEFAULT.data,
+                 stream=False,
+                 jobs=DEFAULT.jobs,
+                 out=None,
+                 tmp=DEFAULT.tmp,
+                 gzip=False,
+                 filters=None,
+                 fragments=None,
+                 max_templates=None,
+                 recycle=None,
+                 memory=None,
+                 storage=None,
+                 shard=None,
+                 config=None,
                  log=None):
         '''Construct a renderer.'''
         self.path = osp.abspath(path)
+        self.out = osp.abspath(out) if out else self.path
+        self.excluded = set([self.out])  # directories that are not walked
         self.watcher = watcher
-        self.tmpl = tmpl or create_lookup(self.path)
-        self.site = site or create_config(osp.join(self.path, DEFAULT.config))
+        self._tmpl = tmpl
         self.log = log or create_logger()
+        self.storage = storage or DiskStorage()
+        self.data = DataNamespace(osp.join(self.path, data), self.log,
+                                  self.storage)
+        self.manifest = Manifest(osp.join(self.out, DEFAULT.manifest),
+                                 self.storage).load()
+        self.shard = shard
+        self._shards = {}  # name => shard index for the current run
+        self._changes = osp.join(self.out, DEFAULT.changes)
+        if shard:
+            self.history = self.manifest  # timings of the last merged build
+            self.manifest = Manifest(osp.join(
+                self.out, DEFAULT.shard_manifest % shard), self.storage).load()
+            if not self.storage.isfile(self.manifest.path):  # last merge
+                self.manifest.pages = dict(self.history.pages)
+                self.manifest.dirty = True
+            self._changes = osp.join(self.out, DEFAULT.shard_changes % shard)
+        self.config = osp.abspath(config or
+                                  osp.join(self.path, DEFAULT.config))
+        self.set_site(site or create_config(self.config,
+                                            storage=self.storage))
+        self._deps = {}  # path => (mtime, immediate dependencies)
+        self._imports = {}  # content digest => names of imported templates
+        self._content = {}  # output path => digest of its last content
+        self.pipeline = Pipeline(filters)
+        self._errors = {}  # cause => error page and pages that failed
+        self._lock = threading.RLock()  # guards shared state while rendering
+        self._outputs = set([])  # outputs written during the last run
+        self._lookup = tmpl is None  # True if the lookup is created here
+        self._renders = 0  # renders since caches were last released
+        self._idle = threading.Condition(self._lock)  # renders finished
+        self._active = 0  # renders in progress
+        self._due = False  # True if caches are released when renders finish
+        self._ceiling = None  # MB in use above which caches are released
+        self.recycled = 0  # number of times caches were released
+        self.fragments = FragmentCache(
+            path=osp.abspath(fragments) if fragments else None, log=self.log,
+            storage=self.storage)
         self.args = Namespace(
             ext=ext,
             noerr=noerr,
             dry_run=dry_run,
-            ignore_mtime=ignore_mtime
+            ignore_mtime=ignore_mtime,
+            stream=stream and self.storage.local,
+            jobs=max(1, int(jobs or 1)),
+            tmp=tmp,
+            gzip=gzip and self.storage.local,
+            max_templates=max_templates,
+            recycle=recycle,
+            memory=memory
         )
 
         if dry_run:
             self._dry = MSG.DRY
 
+    @property
+    def tmpl(self):
+        '''mako.lookup.TemplateLookup: template lookup; created when first
+        needed.
+
+        .. versionchanged:: 0.3.0
+           Created lazily.
+        '''
+        with self._lock:
+            if self._tmpl is None:
+                self._tmpl = create_lookup(
+                    self.path, self.args.tmp, self.fragments,
+                    self.args.max_templates,
+                    None if self.storage.local else self.storage)
+            return self._tmpl
+
+    @tmpl.setter
+    def tmpl(self, tmpl):
+        '''Sets the template lookup.'''
+        self._tmpl = tmpl
+
+    def set_site(self, site):
+        '''Sets the ``site`` namespace passed to templates.
+
+        ``site.data`` is set to this renderer's data files unless ``site``
+        already has a ``data`` key.
+
+        Args:
+            site (pageit.namespace.DeepNamespace): site information
+
+        Returns:
+            Pageit: for method chaining
+
+        .. versionadded:: 0.3.0
+        '''
+        self.site = site
+        if 'data' not in self.site:
+            self.site.data = self.data
+        return self
+
     def list(self):
         '''Generates list of files to render / clean.
 
@@ -156,44 +376,168 @@ class Pageit(object):
             str: next file to process
         '''
         pattern = '*' + self.args.ext
-        for relpath, dirs, files in os.walk(self.path):
-            src = osp.join(self.path, relpath)
-            for i, name in enumerate(dirs):
-                if fnmatch(name, pattern):
-                    del dirs[i]  # don't visit that directory
-
+        for src, files in self.walk():
             for name in files:
                 if fnmatch(name, pattern):  # do list this file
                     yield osp.join(src, name)
 
+    def static(self):
+        '''Generates list of files to pass through to the output directory.
+
+        Files that are not templates are static unless they are hidden
+        (their name or a parent directory's name starts with ``.``), in the
+        data directory, the configuration file, or where a template would
+        write its output when rendered in place (e.g. left over from a build
+        without ``out``).
+
+        Yields:
+            str: next static file
+
+        .. versionadded:: 0.3.0
+        '''
+        pattern = '*' + self.args.ext
+        data = self.data.path + os.sep
+        outputs = set(strip_ext(path, self.args.ext) for path in self.list())
+        for src, files in self.walk():
+            parts = osp.relpath(src, self.path).split(os.sep)
+            if (src + os.sep).startswith(data) or \
+                    any(part.startswith('.') for part in parts if '.' != part):
+                continue  # hidden or data directory
+
+            for name in files:
+                path = osp.join(src, name)
+                if name.startswith('.') or fnmatch(name, pattern) or \
+                   path == self.config or path in outputs:
+                    continue
+                yield path
+
+    def walk(self):
+        '''Generates the directories to process.
+
+        Directories that end with the template extension and the
+        ``excluded`` directories (by default, the output directory) are not
+        visited.
+
+        Yields:
+            tuple: path of the directory and the names of its files
+
+        .. versionadded:: 0.3.0
+        '''
+        pattern = '*' + self.args.ext
+        for src, dirs, files in self.storage.walk(self.path):
+            dirs[:] = [name for name in dirs
+                       if not fnmatch(name, pattern) and  # layouts
+                       osp.join(src, name) not in self.excluded]  # outputs
+            yield src, files
+
     def clean(self):
         '''Deletes pageit output files.
 
-        Note:
-            This function only deletes files for which there is a corresponding
-            template. If the template was moved or deleted, the output will
-            not be touched.
+        The outputs to delete are taken from the build manifest, so outputs of
+        templates that were moved or deleted are removed too. If there is no
+        manifest, the outputs of the templates found by
+        :py:meth:`~pageit.render.Pageit.list` are deleted instead.
+
+        Files are deleted in batches; if ``jobs`` is greater than 1, the
+        batches are deleted by a pool of threads. Directories left empty are
+        removed.
 
         Returns:
             Pageit: for method chaining
+
+        .. versionchanged:: 0.3.0
+           Delete the outputs listed in the build manifest in parallel.
         '''
         _context = '[CLEAN]'
         self.log.debug(MSG.START, _context)
-        for path in self.list():
-            dest = strip_ext(path, self.args.ext)
-            if not osp.isfile(dest):  # no output
+
+        if len(self.manifest):
+            dests = [osp.join(self.out, dest)
+                     for dest in self.manifest.outputs()]
+        else:
+            dests = [dest for path in self.list()
+                     for dest in self.outputs(path)]
+
+        size = DEFAULT.batch
+        batches = [dests[i:i + size] for i in range(0, len(dests), size)]
+        deleted = []
+        for batch in threaded_map(self.clean_batch, batches, self.args.jobs):
+            deleted.extend(batch)
+
+        pruned = 0
+        if not self.args.dry_run:
+            pruned = self.prune(osp.dirname(dest) for dest in deleted)
+            for name in list(self.manifest):
+                self.manifest.remove(name)
+            self.manifest.save()
+            if self.storage.isfile(self._changes):
+                self.storage.remove(self._changes)
+            self.storage.flush()
+
+        self.stats = Namespace(deleted=len(deleted), pruned=pruned,
+                               missing=len(dests) - len(deleted))
+        self.log.info(MSG.CLEANED + self._dry, _context, len(deleted), pruned)
+        self.log.debug(MSG.DONE, _context)
+        return self
+
+    def clean_batch(self, dests):
+        '''Deletes a batch of output files.
+
+        Args:
+            dests (list): paths of the outputs to delete
+
+        Returns:
+            list: paths that were deleted (or would have been deleted during a
+            dry run)
+
+        .. versionadded:: 0.3.0
+        '''
+        _context = '[CLEAN]'
+        deleted = []
+        for dest in dests:
+            if not self.storage.isfile(dest):  # no output
                 continue
 
-            name = osp.relpath(dest, self.path)
             try:
                 if not self.args.dry_run:
-                    os.remove(dest)
-                self.log.info(MSG.DELETE + self._dry, _context, name)
+                    self.storage.remove(dest)
+                deleted.append(dest)
+                self.log.debug(MSG.DELETE + self._dry, _context,
+                               osp.relpath(dest, self.out))
             except OSError:  # pragma: no cover
-                self.log.error(MSG.DELTE_ERR, _context, dest)
+                self.log.error(MSG.DELETE_ERR, _context, dest)
+        return deleted
 
-        self.log.debug(MSG.DONE, _context)
-        return self
+    def prune(self, dirs):
+        '''Removes empty directories below the rendered directory.
+
+        Parents of removed directories are removed as well if they become
+        empty.
+
+        Args:
+            dirs (iterable): paths of directories that may be empty
+
+        Returns:
+            int: number of directories removed
+
+        Examples:
+            >>> Pageit('test/example1').prune(['test/example1/fake'])
+            0
+
+        .. versionadded:: 0.3.0
+        '''
+        count = 0
+        # deepest first so that parents are emptied before they are checked
+        for path in sorted(set(osp.abspath(path) for path in dirs),
+                           key=len, reverse=True):
+            while path.startswith(self.out + os.sep) and \
+                    self.storage.isdir(path):
+                if self.storage.listdir(path):
+                    break
+                self.storage.rmdir(path)
+                count += 1
+                path = osp.dirname(path)
+        return count
 
     def on_change(self, path=None):
         '''React to a change in the directory.
@@ -214,14 +558,70 @@ class Pageit(object):
             >>> _ is runner
             True
         '''
-        if path in self._outputs:
+        if self.ignored(path):
             return self
+        return self.run()
 
+    def on_changes(self, paths):
+        '''React to several changes with at most one run (see
+        :py:class:`~pageit.tools.BuildQueue`).
+
+        Args:
+            paths (list): paths that changed
+
+        Returns:
+            Pageit: for method chaining
+
+        .. versionadded:: 0.3.0
+        '''
+        if all(self.ignored(path) for path in paths):
+            return self
         return self.run()
 
+    def ignored(self, path):
+        '''Returns True if a change to this path does not need a run.
+
+        Changes to outputs, the manifest, and anything in the output directory
+        are produced by the renderer itself.
+
+        Args:
+            path (str): path that changed
+
+        Returns:
+            bool: True if the change should be ignored
+
+        Examples:
+            >>> runner = Pageit('test/example1')
+            >>> runner.ignored(runner.manifest.path)
+            True
+            >>> runner.ignored('test/example1/index.html.mako')
+            False
+
+        .. versionadded:: 0.3.0
+        '''
+        if path in self._outputs or path == self.manifest.path:
+            return True
+        elif path and osp.basename(path).startswith(TMP_PREFIX):
+            return True  # output being streamed
+        elif path and self.out != self.path and \
+                osp.abspath(path).startswith(self.out + os.sep):
+            return True  # in the output directory
+        elif path and self.fragments.path and \
+                osp.abspath(path).startswith(self.fragments.path + os.sep):
+            return True  # cached fragment
+        return False
+
     def run(self):
         '''Runs the renderer.
 
+        Only templates that are :py:meth:`~pageit.render.Pageit.stale` are
+        rendered, longest first (see
+        :py:meth:`~pageit.render.Pageit.render_all`); the plan and which
+        worker rendered each template are in ``stats.schedule``. During a dry
+        run, nothing is rendered; instead, the stale templates and an
+        estimated build time are reported (see
+        :py:meth:`~pageit.render.Pageit.report`).
+
         Returns:
             Pageit: for method chaining
 
@@ -247,218 +647,1514 @@ class Pageit(object):
         if self.args.ignore_mtime:
             self.log.debug(MSG.IGNORE_MTIME, _context)
 
+        self.data.expire()
+        self._digests = self.site_digests()
+        self.fragments.begin(self._digests, self.fragment_version)
+        self._errors = {}
+        self._outputs, self._content, self._imports = set([]), {}, {}
+        self.load_deps()
+        self.stats = Namespace(total=0, stale=[], written=[], compressed=0,
+                               saved={}, elapsed=0.0)
+        if self.shard:
+            self.stats.shard = self.partition()
+        before = self.manifest.files()
+        start = time.time()
+        stale = []
         for path in self.list():
             name = osp.relpath(path, self.path)
-            dest = strip_ext(path, self.args.ext)
-
-            do_render = True
-            if not self.args.ignore_mtime:
-                if osp.isfile(dest):  # need to compute modification times
-                    output_changed = int(osp.getmtime(dest))
-                    template_changed = self.mako_mtime(path)
-                    self.log.debug(MSG_PRE + 'output: %s', '[MTIME]',
-                                   output_changed)
-                    self.log.debug(MSG_PRE + 'template: %s', '[MTIME]',
-                                   template_changed)
-                    do_render = (template_changed > output_changed)
-                    if not do_render:
-                        self.log.debug(MSG.NO_CHANGE, _context, name)
-
-            if do_render:
-                self.mako(path, dest)
+            if not self.in_shard(name):
+                continue
+            self.stats.total += 1
+
+            reason = self.stale(path)
+            if not reason:
+                self.log.debug(MSG.NO_CHANGE, _context, name)
+                continue
+
+            self.log.debug(MSG.STALE, _context, name, reason)
+            self.stats.stale.append(Namespace(name=name, reason=reason,
+                                              estimate=self.estimate(name)))
+            stale.append(path)
+
+        self.stats.schedule = self.render_all(stale)
+        self.passthrough()
+        self.stats.fragments = self.fragments.stats
+        self.stats.errors = self.report_errors()
+        self.stats.memory = self.memory()
+        self.stats.elapsed = time.time() - start
+        if self.args.dry_run:
+            self.report()
+        else:
+            self.manifest.save()
+            self.log.debug(MSG.STATS, '[STATS]', len(self.stats.stale),
+                           self.stats.total, self.stats.elapsed)
+            self.changes(before)
+            self.storage.flush()
 
         self.log.debug(MSG.DONE, _context)
         return self
 
-    def mako(self, path, dest=None):
-        '''Render a mako template.
+    def render_all(self, paths):
+        '''Renders templates, longest first.
 
-        .. _special-mako-vars:
+        Templates are ordered by how long they took to render during the
+        previous build (see :py:func:`~pageit.render.schedule`). If ``jobs``
+        is greater than 1, a pool of threads takes the templates one at a
+        time in that order, so slow pages start first and quick ones fill in
+        around them instead of leaving a slow page running alone at the end.
+        The threads run in one process, so rendering itself is not done in
+        parallel; only the time spent reading and writing files overlaps.
+        Nothing is rendered during a dry run.
 
-        This function injects two :py:class:`~pageit.namespace.DeepNamespace`
-        variables into the ``mako`` template:
+        Args:
+            paths (list): paths of the templates to render
 
-        - ``site``: environment information passed into the constructor
-        - ``page``: information about the current template
+        Returns:
+            Namespace: the plan from :py:func:`~pageit.render.schedule`
+            with the number of ``jobs`` and the templates each worker
+            actually rendered (``workers``)
 
-          - ``path``: relative path of this template
-          - ``output``: relative path to the output of the template
-          - ``dirname``: name of the directory containing the template
-          - ``basedir``: relative path back to the root directory
+        Example:
+            >>> plan = Pageit('test/example1', dry_run=True).render_all([])
+            >>> plan.order, plan.workers
+            ([], [])
+
+        .. versionadded:: 0.3.0
+        '''
+        paths = dict((osp.relpath(path, self.path), path) for path in paths)
+        plan = schedule(paths, self.args.jobs,
+                        dict((name, self.estimate(name)) for name in paths))
+        plan.jobs = self.args.jobs
+        self.log.debug(MSG.SCHEDULE, '[RENDER]', len(plan.order), plan.jobs,
+                       plan.estimate)
+
+        workers = collections.defaultdict(list)  # thread => names
+
+        def work(name):
+            '''Render a template and record which worker rendered it.'''
+            workers[threading.current_thread().name].append(name)
+            try:
+                with self.rendering():
+                    self.mako(paths[name])
+            finally:
+                self.rendered()
+
+        if not self.args.dry_run:
+            threaded_map(work, plan.order, self.args.jobs, chunksize=1)
+        plan.workers = [workers[key] for key in sorted(workers)]
+        return plan
+
+    def render_batch(self, items, jobs=None):
+        '''Renders templates in memory and returns their content.
+
+        Nothing is written, logged (except at the debug level), or recorded
+        in the build manifest, so this can be used to preview pages (e.g.
+        from a CMS) while other builds use the same renderer.
 
         Args:
-            path (str): template path
-            dest (str, optional): output path; if not provided will be computed
+            items (list): template names (relative to the rendered directory)
+                or dictionaries with a ``template`` name and optional ``site``
+                and ``page`` values; these replace the top-level keys of this
+                renderer's ``site`` and of the template's ``page`` for this
+                call only
+            jobs (int, optional): number of threads; default is ``jobs``
 
         Returns:
-            Pageit: for method chaining
+            list: results in the same order as ``items`` (see
+            :py:meth:`~pageit.render.Pageit.render_item`)
 
-        .. versionchanged:: 0.2.2
-           Added more template information (output, dirname, basedir).
+        Example:
+            >>> runner = Pageit('test/example1')
+            >>> results = runner.render_batch(['index.html.mako', dict(
+            ...     template='subdir/test-page.html.mako',
+            ...     site=dict(base_url='//example.com/'))])
+            >>> [result.pages[0].output for result in results]
+            ['index.html', 'subdir/test-page.html']
+            >>> results[0].error is None
+            True
+            >>> results[0].content.startswith('<base>')
+            True
+            >>> results[0].deps.site
+            ['base_url']
+
+        .. versionadded:: 0.3.0
         '''
-        _context = '[MAKO]'
-        name = osp.relpath(path, self.path)
-        self.log.debug(MSG.T_RENDER, _context, name)
+        return threaded_map(self.render_item, items, jobs or self.args.jobs,
+                            chunksize=1)
 
-        dest = dest or strip_ext(path, self.args.ext)
-        tmpl = self.tmpl.get_template(name)
-        content, has_errors = '', False
-        page = DeepNamespace(
-            path=name,
-            output=osp.relpath(dest, self.path),
-            dirname=osp.dirname(name),
-            basedir=osp.relpath(self.path, osp.dirname(path))
-        )
-        try:
-            if not self.args.dry_run:
-                content = tmpl.render_unicode(site=self.site, page=page)
-            self.log.info(MSG.RENDER + self._dry, _context, name)
-        except mako.exceptions.MakoException as ex:
-            has_errors = True
-            self.log.error(MSG.RENDER_ERR, _context, path)
-            self.log.error(ex)
-            if not self.args.dry_run and not self.args.noerr:
-                content = mako.exceptions.html_error_template().render()
+    def render_item(self, item):
+        '''Renders a template in memory.
+
+        Rendered pages are passed through the ``filters`` pipeline. Errors
+        (including errors raised by Python code in the template) are returned
+        rather than raised.
+
+        Args:
+            item (str|dict): template name or dictionary with a ``template``
+                name and optional ``site`` and ``page`` overrides (see
+                :py:meth:`~pageit.render.Pageit.render_batch`)
 
-        if not (self.args.noerr and has_errors):
+        Returns:
+            Namespace: the ``template`` name; its ``pages``, each with its
+            ``output`` name, ``content`` (UTF-8 bytes), and ``error``; the
+            ``content`` of the first page; the ``site`` keys, ``data`` files,
+            and ``templates`` it read (``deps``); the first ``error`` (see
+            :py:func:`~pageit.render.error_cause`); and the seconds it took
+            (``elapsed``)
+
+        Example:
+            >>> result = Pageit('test/example1').render_item('fake.mako')
+            >>> result.pages, result.error.split(':')[0]
+            ([], 'TopLevelLookupException')
+
+        .. versionadded:: 0.3.0
+        '''
+        if isinstance(item, basestring):
+            item = dict(template=item)
+        name = item['template']
+        path = osp.join(self.path, name)
+        site = self.site
+        if item.get('site'):
+            site = DeepNamespace(self.site, item['site'])
+
+        self.log.debug(MSG.T_RENDER, '[BATCH]', name)
+        result = Namespace(template=name, pages=[], content=None, error=None)
+        start = time.time()
+        with self.rendering(), track.recording() as accessed:
             try:
-                if not self.args.dry_run:
-                    with codecs.open(dest, encoding='utf-8', mode='w') as out:
-                        out.write(content)
-                if dest not in self._outputs:
-                    self._outputs.append(dest)
-                self.log.debug(MSG.WRITE + self._dry, _context,
-                               osp.relpath(dest, self.path))
-            except OSError as ex:  # pragma: no cover
-                self.log.error(MSG.WRITE_ERR, _context, dest, ex)
+                tmpl = self.tmpl.get_template(name)
+                pages = self.mako_pages(tmpl, path, site=site)
+            except Exception as ex:  # pylint: disable=W0703
+                result.error, pages = error_cause(ex), []
+
+            for _, page in pages:
+                if item.get('page'):
+                    page = DeepNamespace(page, item['page'])
+                output = Namespace(output=page.output, content=None,
+                                   error=None)
+                try:
+                    content = tmpl.render_unicode(site=track.Tracked(site),
+                                                  page=page)
+                    if self.pipeline:
+                        content = self.pipeline(content, page)
+                    output.content = content.encode('utf-8')
+                except Exception as ex:  # pylint: disable=W0703
+                    output.error = error_cause(ex)
+                    result.error = result.error or output.error
+                result.pages.append(output)
+
+        if result.pages:
+            result.content = result.pages[0].content
+        result.deps = Namespace(
+            site=sorted(key for key in accessed['site'] if key != 'data'),
+            data=sorted(osp.relpath(dep, self.path)
+                        for dep in accessed['data']),
+            templates=sorted(osp.relpath(dep, self.path)
+                             for dep in accessed['template'] if dep != path))
+        result.elapsed = round(time.time() - start, 3)
+        return result
 
-        self.log.debug(MSG.DONE, _context)
-        return self
+    @contextmanager
+    def rendering(self):
+        '''Marks a render in progress so that caches are not reset during it.
 
-    def mako_deps(self, path):
-        '''Returns set of immediate dependency paths for a mako template.
+        A render waits while a reset is due (see
+        :py:meth:`~pageit.render.Pageit.rendered`); the last render to finish
+        performs it.
 
-        Note:
-            This function does not recursively compute dependencies.
+        .. versionadded:: 0.3.0
+        '''
+        with self._idle:
+            while self._due:
+                self._idle.wait()
+            self._active += 1
+        try:
+            yield
+        finally:
+            with self._idle:
+                self._active -= 1
+                if self._due and not self._active:
+                    self._reset()
+
+    def rendered(self):
+        '''Counts a render and resets the render caches if a limit was
+        reached.
+
+        The caches are reset (see :py:meth:`~pageit.render.Pageit.recycle`)
+        after ``recycle`` renders or when this process uses more than
+        ``memory`` megabytes, once no template is rendering; until then, no
+        new render starts.
+
+        If a reset does not bring the process below ``memory`` megabytes,
+        the caches are not reset again until it uses
+        :py:data:`DEFAULT.headroom <pageit.render.DEFAULT>` times as much as
+        it did right after the reset.
 
-        Args:
-            path (str): path to a mako template
+        Returns:
+            bool: True if the caches were reset
+
+        .. versionadded:: 0.3.0
+        '''
+        with self._idle:
+            self._renders += 1
+            limit, budget = self.args.recycle, self.args.memory
+            if limit and self._renders >= limit:
+                self._due = True
+            elif budget and not self._due and \
+                    (tools.memory_usage() or 0) > (self._ceiling or budget):
+                self._due = True
+
+            if not self._due or self._active:
+                return False
+            self._reset()
+        return True
+
+    def _reset(self):
+        '''Resets the render caches that are due and lets renders resume.'''
+        with self._idle:
+            self.recycle()
+            if self.args.memory:
+                used = tools.memory_usage() or 0
+                self._ceiling = max(self.args.memory, used * DEFAULT.headroom)
+            self._due = False
+            self._idle.notify_all()
+
+    def recycle(self):
+        '''Resets compiled templates and render caches.
+
+        The template lookup (unless one was given to the constructor), parsed
+        dependencies, parsed data files, and fragments kept in memory are
+        dropped under the renderer's lock; they are created again as they are
+        needed. Fragments kept on disk are not removed.
+
+        Render workers are threads of this process, so this bounds how much
+        the caches grow (e.g. in long ``--watch`` or ``--daemon`` sessions);
+        memory that is freed is reused by the process but is not necessarily
+        returned to the operating system. Call it only when no template is
+        rendering (see :py:meth:`~pageit.render.Pageit.rendering`).
 
         Returns:
-            set: paths of dependencies
+            Pageit: for method chaining
 
-        Examples:
-            >>> Pageit().mako_deps('fake.mako')
-            set([])
+        Example:
+            >>> runner = Pageit('test/example1')
+            >>> runner.recycle().recycled
+            1
+
+        .. versionadded:: 0.3.0
         '''
-        paths = set([])
-        if not osp.isfile(path):
-            return paths
+        with self._lock:
+            if self._lookup:
+                self._tmpl = None
+            self._deps.clear()  # may be shared (see pageit.envs)
+            self._imports.clear()
+            self.data.clear()
+            self.fragments.clear()
+            self.recycled += 1
+            gc.collect()
+            self.log.debug(MSG.RECYCLE, '[MEMORY]', self._renders,
+                           tools.memory_usage() or 0)
+            self._renders = 0
+        return self
 
-        for line in open(path):
-            groups = RE_MAKO_IMPORT.search(line)  # look for imports
-            if groups:
-                dep = groups.group(2)
-                if '/' == dep[0]:  # relative to TemplateLookup.directories
-                    dep = osp.normpath(osp.join(self.path, dep.lstrip('/')))
-                else:  # relative to template directory
-                    dep = osp.normpath(osp.join(osp.dirname(path), dep))
+    def memory(self):
+        '''Returns how much memory the renderer is using.
 
-                paths.add(dep)
+        Returns:
+            Namespace: megabytes used by this process (``used``; None if it
+            cannot be measured), the number of compiled ``templates`` and
+            ``fragments`` in memory, and the number of times memory was
+            ``recycled``
 
-        return paths
+        Example:
+            >>> Pageit('test/example1').memory().templates
+            0
 
-    def mako_mtime(self, path, levels=5):
-        '''Returns the modification time of a mako template.
+        .. versionadded:: 0.3.0
+        '''
+        used = tools.memory_usage()
+        return Namespace(
+            used=used and round(used, 1),
+            templates=len(getattr(self._tmpl, '_collection', ())),
+            fragments=len(self.fragments),
+            recycled=self.recycled
+        )
 
-        Note:
-            This function considers a limited portion of the template's
-            inheritance tree to determine the latest modification time.
+    def changes(self, before):
+        '''Records which outputs changed during this run.
+
+        The changes are kept in ``stats.changes`` and written next to the
+        manifest (``.pageit-changes.json`` in the output directory, or
+        ``.pageit-changes-K-of-N.json`` when building a shard).
 
         Args:
-            path (str): template path
-            levels (int): number of inheritance levels to traverse (default: 5)
+            before (dict): output fingerprints before this run (see
+                :py:meth:`~pageit.manifest.Manifest.files`)
 
         Returns:
-            int: latest modification time; 0 if the file does not exist
-
-        Examples:
-            >>> Pageit().mako_mtime('fake.mako')
-            0
+            Namespace: sorted lists of ``added``, ``changed``, and
+            ``removed`` output names
 
-            >>> import os.path as osp
-            >>> path1 = osp.abspath('test/example1')
-            >>> path2 = osp.join(path1, 'subdir/test-page.html.mako')
-            >>> Pageit(path1).mako_mtime(path2) > 0
-            True
+        .. versionadded:: 0.3.0
         '''
-        _context = '[MTIME]'
-        name = osp.relpath(path, self.path)
-        self.log.debug(MSG.T_MTIME, _context, name)
+        changes = manifests.diff(before, self.manifest.files())
+        if self.stats is not None:
+            self.stats.changes = changes
+        if self.storage.isdir(self.out):
+            manifests.save_changes(self._changes, changes, self.storage)
+        self.log.debug(MSG.CHANGES, '[CHANGES]', len(changes.added),
+                       len(changes.changed), len(changes.removed))
+        return changes
+
+    def partition(self):
+        '''Assigns templates and static files to shards.
+
+        Templates are balanced across shards by how long they took to render
+        during the last merged build (see
+        :py:func:`~pageit.render.assign_shards`); static files are assigned by
+        name. Every shard computes the same assignment, so each template is
+        built by exactly one shard. Entries for templates that belong to
+        other shards are dropped from this shard's manifest (their outputs
+        are left alone).
 
-        if not osp.isfile(path):
-            return 0
+        Returns:
+            Namespace: this shard's ``index`` and ``count``, the number of
+            ``templates`` it builds out of the ``total``, and their estimated
+            render time in seconds (``estimate``)
 
-        deps, next_deps, done, mtimes = set([path]), set([]), [], []
-        for _ in range(levels + 1):
-            for dep in deps:
-                if not osp.isfile(dep):
-                    continue
+        .. versionadded:: 0.3.0
+        '''
+        index, count = self.shard
+        names = [osp.relpath(path, self.path) for path in self.list()]
+        costs = dict((name, self.history.get(name).elapsed)
+                     for name in names if name in self.history)
+        self._shards = assign_shards(names, count, costs)
+
+        for name in list(self.manifest):
+            if not self.in_shard(name):
+                self.manifest.remove(name)
+
+        mine = [name for name in names if self._shards[name] == index]
+        known = [costs[name] for name in names if costs.get(name) is not None]
+        average = (sum(known) / len(known)) if known else 0.0
+        estimate = sum(average if costs.get(name) is None else costs[name]
+                       for name in mine)
+        self.log.info(MSG.SHARD, '[SHARD]', index, count, len(mine),
+                      len(names), estimate)
+        return Namespace(index=index, count=count, templates=len(mine),
+                         total=len(names), estimate=estimate)
+
+    def in_shard(self, name):
+        '''Returns True if this renderer builds a template or static file.
 
-                next_deps = next_deps.union(self.mako_deps(dep))
-                mtimes.append(int(osp.getmtime(dep)))
-                done.append(dep)
+        Args:
+            name (str): path relative to the rendered directory
 
-            if not next_deps:
-                break
+        Returns:
+            bool: True if there is no shard or the name belongs to it
 
-            deps, next_deps = next_deps, set([])
+        Examples:
+            >>> Pageit('test/example1').in_shard('index.html.mako')
+            True
+            >>> [Pageit('test/example1', shard=(k, 2)).in_shard('a.css')
+            ...  for k in (1, 2)].count(True)
+            1
 
-        self.log.debug(MSG.T_MTIME_END, _context, len(mtimes) - 1,
-                       ', '.join([osp.relpath(dep, self.path)
-                                  for dep in done[1:]]))
-        return max(mtimes)
+        .. versionadded:: 0.3.0
+        '''
+        if not self.shard:
+            return True
+        index, count = self.shard
+        shard = self._shards.get(name) or stable_shard(name, count)
+        return shard == index
+
+    def merge(self):
+        '''Combines the manifests and change logs written by shards.
+
+        Every shard of a build must have finished: a shard writes its
+        manifest (``.pageit-shard-K-of-N.jsonl`` in the output directory) and,
+        when it finishes, its change log (``.pageit-changes-K-of-N.json``).
+        The combined manifest replaces the build manifest, the change logs
+        are combined into ``.pageit-changes.json``, and the shard files are
+        removed.
 
+        Returns:
+            Pageit: for method chaining
 
-def create_logger(verbosity=DEFAULT.verbosity, log=None):
-    '''Constructs a logger.
+        .. versionadded:: 0.3.0
+        '''
+        _context = '[MERGE]'
+        found = {}  # count => {index: path}
+        if self.storage.isdir(self.out):
+            for name in self.storage.listdir(self.out):
+                match = RE_SHARD_CHANGES.match(name)
+                if match:
+                    index, count = int(match.group(1)), int(match.group(2))
+                    found.setdefault(count, {})[index] = \
+                        osp.join(self.out, name)
+
+        self.stats = Namespace(shards=0, templates=0)
+        if len(found) != 1:
+            self.log.error(MSG.MERGE_ERR, _context,
+                           'no shards found' if not found else
+                           'different shard counts %s' % sorted(found))
+            return self
 
-    Args:
-        verbosity (int): level of verbosity
-        log (logging.Logger): an existing logger to modify
+        count, paths = found.items()[0]
+        missing = sorted(set(range(1, count + 1)) - set(paths))
+        if missing:
+            self.log.error(MSG.MERGE_ERR, _context,
+                           'missing shards %s of %s' % (missing, count))
+            return self
 
-    Returns:
-        logging.Logger: logger configured based on verbosity.
+        shards = [Manifest(osp.join(self.out, DEFAULT.shard_manifest % (
+            index, count)), self.storage).load()
+                  for index in range(1, count + 1)]
+        try:
+            merged = manifests.merge(shards, osp.join(self.out,
+                                                      DEFAULT.manifest))
+        except ValueError as ex:
+            self.log.error(MSG.MERGE_ERR, _context, ex)
+            return self
 
-    Example:
-        >>> log = create_logger()
-        >>> log.getEffectiveLevel() == logging.INFO
-        True
+        if self.args.dry_run:
+            self.log.info(MSG.MERGED + self._dry, _context, count, len(merged))
+            return self
 
-        >>> log = create_logger(0, log)
-        >>> log.getEffectiveLevel() == logging.NOTSET
-        True
+        merged.save()
+        changes = manifests.merge_changes(
+            manifests.load_changes(path, self.storage)
+            for path in paths.values())
+        manifests.save_changes(osp.join(self.out, DEFAULT.changes), changes,
+                               self.storage, shards=count)
+        for path in paths.values() + [shard.path for shard in shards]:
+            if self.storage.isfile(path):
+                self.storage.remove(path)
+
+        if not self.shard:
+            self.manifest = merged
+        self.storage.flush()
+        self.stats = Namespace(shards=count, templates=len(merged),
+                               changes=changes)
+        self.log.info(MSG.MERGED, _context, count, len(merged))
+        return self
 
-        >>> log = create_logger(2, log)
-        >>> log.getEffectiveLevel() == logging.DEBUG
-        True
-    '''
-    log = log or DEFAULT.log
-    if 0 == verbosity:
-        log.setLevel(logging.NOTSET)
-    elif 1 == verbosity:
-        log.setLevel(logging.INFO)
-    elif verbosity > 1:
-        log.setLevel(logging.DEBUG)
-    return log
+    def passthrough(self):
+        '''Links static files into the output directory.
 
+        This only applies when the output directory differs from the rendered
+        directory. Files are hard-linked when possible and copied otherwise;
+        files whose output is up to date are skipped. Outputs of static files
+        that were removed are deleted.
 
-def create_lookup(path=DEFAULT.path, tmp=None):
+        Returns:
+            Pageit: for method chaining
+
+        .. versionadded:: 0.3.0
+        '''
+        _context = '[STATIC]'
+        if self.out == self.path:
+            return self
+
+        seen, linked = set([]), 0
+        for path in self.static():
+            name = osp.relpath(path, self.path)
+            if not self.in_shard(name):
+                continue
+            dest = self.target(path)
+            seen.add(name)
+            if self.storage.outdated(path, dest):
+                if not self.args.dry_run:
+                    self.written(osp.relpath(self.storage.link(path, dest),
+                                             self.out))
+                linked += 1
+                self.log.debug(MSG.LINK + self._dry, _context, name)
+
+            if not self.args.dry_run:
+                size = self.storage.getsize(path)
+                self.manifest.set(name, outputs=[name], static=True,
+                                  digests={name: '%s:%s' % (
+                                      size, int(self.storage.getmtime(path)))},
+                                  sizes={name: size})
+
+        for name in list(self.manifest):
+            if not self.manifest.get(name).static or name in seen:
+                continue
+            removed = self.clean_batch(self.outputs(name))
+            if not self.args.dry_run:
+                self.prune(osp.dirname(dest) for dest in removed)
+                self.manifest.remove(name)
+
+        if self.stats is not None:
+            self.stats.linked = linked
+        self.log.debug(MSG.LINKED + self._dry, _context, linked)
+        return self
+
+    def written(self, name):
+        '''Records that an output was written during this run.
+
+        Written outputs are listed in ``stats.written`` (e.g. for
+        :py:class:`~pageit.tools.LiveReload`).
+
+        Args:
+            name (str): output path relative to the output directory
+
+        Returns:
+            Pageit: for method chaining
+
+        .. versionadded:: 0.3.0
+        '''
+        if self.stats is not None and 'written' in self.stats:
+            self.stats.written.append(name)
+        return self
+
+    def outputs(self, path):
+        '''Returns the output paths of a template.
+
+        Note:
+            Templates that generate several pages report the outputs of their
+            last render, as recorded in the build manifest.
+
+        Args:
+            path (str): template path
+
+        Returns:
+            list: absolute paths of the outputs
+
+        Example:
+            >>> runner = Pageit('test/example1')
+            >>> expected = osp.abspath('test/example1/index.html')
+            >>> runner.outputs('test/example1/index.html.mako') == [expected]
+            True
+        '''
+        path = osp.abspath(path)
+        entry = self.manifest.get(osp.relpath(path, self.path))
+        if entry and entry.outputs is not None:
+            return [osp.join(self.out, dest) for dest in entry.outputs]
+        return [self.target(strip_ext(path, self.args.ext))]
+
+    def target(self, path):
+        '''Returns where a path in the rendered directory is written.
+
+        Args:
+            path (str): path in the rendered directory
+
+        Returns:
+            str: corresponding path in the output directory
+
+        Example:
+            >>> runner = Pageit('test/example1', out='build/example1')
+            >>> expected = osp.abspath('build/example1/subdir/index.html')
+            >>> runner.target('test/example1/subdir/index.html') == expected
+            True
+
+        .. versionadded:: 0.3.0
+        '''
+        return osp.join(self.out, osp.relpath(osp.abspath(path), self.path))
+
+    def mako(self, path, dest=None):
+        '''Render a mako template.
+
+        .. _special-mako-vars:
+
+        This function injects two :py:class:`~pageit.namespace.DeepNamespace`
+        variables into the ``mako`` template:
+
+        - ``site``: environment information passed into the constructor
+        - ``page``: information about the current template
+
+          - ``path``: relative path of this template
+          - ``output``: relative path to the output of the template
+          - ``dirname``: name of the directory containing the template
+          - ``basedir``: relative path back to the root directory
+          - ``key``, ``index``, ``item``: current collection item (only for
+            templates that generate several pages)
+
+        A template may generate one page per item of a collection; see
+        :py:meth:`~pageit.render.Pageit.mako_pages`. Outputs generated by a
+        previous render that are no longer generated are removed. A
+        collection with no items has no outputs; when it rendered is kept in
+        the build manifest (``rendered``) so that it is not rendered again
+        until it (or what it read) changes.
+
+        If the ``stream`` option is set, the output is written to a temporary
+        file while the template renders (see
+        :py:meth:`~pageit.render.Pageit.mako_stream`) instead of being held
+        in memory.
+
+        ``site.data`` exposes the files in the data directory; each file is
+        parsed the first time it is read. The ``site`` keys, data files, and
+        templates (including those loaded by computed names) a template reads
+        are recorded in the build manifest so that it is re-rendered when
+        they change.
+
+        Rendered pages are passed through the ``filters`` pipeline (see
+        :py:mod:`pageit.filters`) before they are written. Pages whose
+        rendered content is the same as in the previous build skip the
+        filters and are not rewritten. Streamed pages are written while they
+        render and are not filtered.
+
+        If the ``gzip`` option is set, a compressed copy of each output is
+        written next to it (see :py:meth:`~pageit.render.Pageit.mako_gzip`).
+
+        Args:
+            path (str): template path
+            dest (str, optional): output path; if not provided will be computed
+
+        Returns:
+            Pageit: for method chaining
+
+        .. versionchanged:: 0.2.2
+           Added more template information (output, dirname, basedir).
+
+        .. versionchanged:: 0.3.0
+
+           - Record the ``site`` keys and data files read by the template.
+           - Added streaming output and collections.
+           - Errors with the same cause share one error page.
+           - Added the ``filters`` pipeline.
+           - Added compressed copies of the outputs.
+        '''
+        _context = '[MAKO]'
+        name = osp.relpath(path, self.path)
+        self.log.debug(MSG.T_RENDER, _context, name)
+
+        start = time.time()
+        previous = self.outputs(path)
+        tmpl = self.tmpl.get_template(name)
+        written = []
+        with track.recording() as accessed:
+            pages = self.mako_pages(tmpl, path, dest)
+            for page_dest, page in pages:
+                if self.mako_page(tmpl, page_dest, page):
+                    written.append(page_dest)
+
+        if not self.args.dry_run and (written or not pages):
+            dests = [page_dest for page_dest, _ in pages]
+            digests = dict((osp.relpath(dest, self.out),
+                            self._content.get(dest)) for dest in written)
+            if self.args.gzip:
+                entry = self.manifest.get(name)
+                self.mako_gzip(name, written, (entry and entry.digests) or {},
+                               digests)
+                dests += [dest + '.gz' for dest in dests]
+                digests.update((output + '.gz', digest)
+                               for output, digest in digests.items())
+
+            for old in set(previous) - set(dests):
+                if self.storage.isfile(old):
+                    self.storage.remove(old)
+                    self.log.info(MSG.DELETE, _context,
+                                  osp.relpath(old, self.out))
+
+            site_digests = self._digests or self.site_digests()
+            extra = {} if dests else dict(rendered=int(time.time()))
+            self.manifest.set(
+                name,
+                outputs=[osp.relpath(dest, self.out) for dest in dests],
+                digests=digests,
+                sizes=dict((osp.relpath(dest, self.out),
+                            self.storage.getsize(dest))
+                           for dest in dests if self.storage.isfile(dest)),
+                site=dict((key, site_digests.get(key))
+                          for key in accessed['site'] if key != 'data'),
+                data=sorted(osp.relpath(dep, self.path)
+                            for dep in accessed['data']),
+                templates=sorted(osp.relpath(dep, self.path)
+                                 for dep in accessed['template']
+                                 if dep != path),
+                deps=self.scanned_deps(path),
+                elapsed=round(time.time() - start, 3), **extra)
+
+        self.log.debug(MSG.DONE, _context)
+        return self
+
+    def mako_gzip(self, name, dests, previous, digests):
+        '''Write compressed copies of a template's outputs.
+
+        Outputs whose content has the same digest as in the previous build
+        (and whose compressed copy exists) are not compressed again; their
+        copies are only marked as up to date. The rest are compressed in the
+        calling thread, which is already one of the ``jobs`` render
+        workers.
+
+        Args:
+            name (str): template path relative to the rendered directory
+            dests (list): paths of the outputs that were written
+            previous (dict): content digests from the previous build keyed
+                by output name
+            digests (dict): content digests from this build keyed by output
+                name
+
+        Returns:
+            Pageit: for method chaining
+
+        .. versionadded:: 0.3.0
+        '''
+        todo = []
+        for dest in dests:
+            output = osp.relpath(dest, self.out)
+            changed = digests.get(output) != previous.get(output)
+            if changed or not digests.get(output) or \
+                    not osp.isfile(dest + '.gz'):
+                todo.append(dest)
+            else:  # same content; keep the copy
+                mtime = osp.getmtime(dest)
+                os.utime(dest + '.gz', (mtime, mtime))
+
+        for dest in todo:
+            tools.gzip_file(dest)
+        with self._lock:
+            if self.stats is not None and 'compressed' in self.stats:
+                self.stats.compressed += len(todo)
+        self.log.debug(MSG.GZIP, '[GZIP]', len(todo), len(dests), name)
+        return self
+
+    def mako_pages(self, tmpl, path, dest=None, site=None):
+        '''Returns the pages a mako template generates.
+
+        A template generates a single page unless it declares a collection
+        in a module-level block::
+
+            <%!
+                pageit_collection = 'data.tags'
+                pageit_output = 'tags/{key}.html'
+            %>
+
+        ``pageit_collection`` is a dotted path into ``site``; one page is
+        generated for each item of a list or each key of a dictionary.
+        ``pageit_output`` is formatted with the ``key``, ``index``, and
+        ``item`` of each page (default: ``{key}/`` followed by the name of the
+        template without its extension). Outputs are relative to the
+        template's directory unless they start with ``/``.
+
+        Args:
+            tmpl (mako.template.Template): compiled template
+            path (str): template path
+            dest (str, optional): output path of a single-page template
+            site (pageit.namespace.DeepNamespace, optional): ``site`` in which
+                to find the collection; default is this renderer's ``site``
+
+        Returns:
+            list: ``(dest, page)`` tuples
+
+        Example:
+            >>> runner = Pageit('test/example1')
+            >>> path = osp.abspath('test/example1/index.html.mako')
+            >>> tmpl = runner.tmpl.get_template('index.html.mako')
+            >>> [page.output for _, page in runner.mako_pages(tmpl, path)]
+            ['index.html']
+        '''
+        name = osp.relpath(path, self.path)
+        page = DeepNamespace(
+            path=name,
+            dirname=osp.dirname(name),
+            basedir=osp.relpath(self.path, osp.dirname(path))
+        )
+
+        collection = getattr(tmpl.module, 'pageit_collection', None)
+        if not collection:
+            dest = dest or self.target(strip_ext(path, self.args.ext))
+            return [(dest, DeepNamespace(page,
+                                         output=osp.relpath(dest, self.out)))]
+
+        pattern = getattr(tmpl.module, 'pageit_output', None) or \
+            '{key}/' + osp.basename(strip_ext(path, self.args.ext))
+
+        value = track.Tracked(self.site if site is None else site)
+        for key in collection.split('.'):
+            value = value[key] if value is not None else None
+
+        pages = []
+        for index, (key, item) in enumerate(collection_items(value)):
+            output = pattern.format(key=key, index=index, item=item)
+            if output.startswith('/'):  # relative to the root directory
+                dest = osp.join(self.path, output.lstrip('/'))
+            else:  # relative to the template directory
+                dest = osp.join(osp.dirname(path), output)
+            dest = self.target(osp.normpath(dest))
+            pages.append((dest, DeepNamespace(
+                page, output=osp.relpath(dest, self.out),
+                key=key, index=index, item=item)))
+        return pages
+
+    def mako_page(self, tmpl, dest, page):
+        '''Render a single page of a mako template.
+
+        Args:
+            tmpl (mako.template.Template): compiled template
+            dest (str): output path
+            page (pageit.namespace.DeepNamespace): information about the page
+
+        Returns:
+            bool: True if the output was written (or would have been written
+            during a dry run)
+        '''
+        from mako.exceptions import MakoException
+
+        _context = '[MAKO]'
+        name = page.output if 'index' in page else page.path
+        content, has_errors = '', False
+        tmp = None  # streamed output
+        if not self.args.dry_run:
+            self.storage.makedirs(osp.dirname(dest))
+
+        try:
+            data = dict(site=track.Tracked(self.site), page=page)
+            if self.args.dry_run:
+                pass  # nothing to render
+            elif self.args.stream:
+                tmp = self.mako_stream(tmpl, dest, **data)
+            else:
+                content = tmpl.render_unicode(**data)
+            self.log.info(MSG.RENDER + self._dry, _context, name)
+        except MakoException as ex:
+            has_errors = True
+            content = self.mako_error(ex, name)
+
+        if self.args.noerr and has_errors:
+            return False
+
+        digest, unchanged = None, False
+        if not self.args.dry_run:
+            digest = self.content_digest(content, tmp)
+            if self.pipeline and not has_errors and not tmp:
+                previous = self.manifest.get(page.path)
+                previous = ((previous and previous.digests) or {})
+                unchanged = (digest == previous.get(page.output) and
+                             self.storage.isfile(dest))
+                if not unchanged:
+                    content = self.mako_filter(content, page)
+
+        try:
+            if self.args.dry_run:
+                pass  # nothing to write
+            elif unchanged:  # output is already filtered
+                self.storage.touch(dest)
+            elif tmp:
+                if 'nt' == os.name and osp.isfile(dest):
+                    os.remove(dest)  # cannot rename over a file
+                os.rename(tmp, dest)
+            else:
+                self.storage.write(dest, content.encode('utf-8'))
+
+            self._outputs.add(dest)
+            if not self.args.dry_run:
+                self._content[dest] = digest
+                self.written(page.output)
+            self.log.debug(MSG.WRITE + self._dry, _context, page.output)
+        except OSError as ex:  # pragma: no cover
+            self.log.error(MSG.WRITE_ERR, _context, dest, ex)
+            return False
+        return True
+
+    def mako_error(self, ex, name):
+        '''Record a template error and return its error page.
+
+        Errors are grouped by cause (see :py:func:`error_cause`) so that a
+        broken layout or include is only reported, and its error page only
+        rendered, once per run; other pages with the same error get a copy of
+        that error page.
+
+        Args:
+            ex (mako.exceptions.MakoException): error raised while rendering
+            name (str): name of the page that failed
+
+        Returns:
+            str: content of the error page; empty if error pages are disabled
+            or during a dry run
+
+        .. versionadded:: 0.3.0
+        '''
+        _context = '[MAKO]'
+        cause = error_cause(ex)
+        with self._lock:
+            error = self._errors.get(cause)
+            if error is None:
+                self.log.error(MSG.RENDER_ERR, _context, name)
+                self.log.error(ex)
+                content = ''
+                if not self.args.dry_run and not self.args.noerr:
+                    from mako.exceptions import html_error_template
+                    content = html_error_template().render()
+                error = Namespace(cause=cause, pages=[], content=content)
+                self._errors[cause] = error
+            else:
+                self.log.debug(MSG.SAME_ERR, _context, name, error.pages[0])
+
+            error.pages.append(name)
+        return error.content
+
+    def report_errors(self):
+        '''Log a summary of the template errors in this run.
+
+        Returns:
+            list: errors with their ``cause`` and failed ``pages``
+
+        Example:
+            >>> Pageit('test/example1').report_errors()
+            []
+
+        .. versionadded:: 0.3.0
+        '''
+        _context = '[ERRORS]'
+        errors = [Namespace(cause=error.cause, pages=error.pages)
+                  for error in self._errors.values()]
+        if errors:
+            self.log.error(MSG.ERRORS, _context, len(errors),
+                           sum(len(error.pages) for error in errors))
+        for error in errors:
+            self.log.error(MSG.ERROR, _context, len(error.pages), error.cause)
+        return errors
+
+    def content_digest(self, content=None, path=None):
+        '''Returns a digest of a rendered page and the filters that will be
+        applied to it.
+
+        Pages with the same digest produce the same output. Streamed pages
+        are not filtered, so their digest is of the content alone.
+
+        Args:
+            content (unicode, optional): rendered content
+            path (str, optional): file to read the rendered content from
+                instead (e.g. a streamed output)
+
+        Returns:
+            str: hex digest
+
+        Example:
+            >>> plain = Pageit('test/example1')
+            >>> filtered = Pageit('test/example1', filters=['html'])
+            >>> plain.content_digest(u'a') != filtered.content_digest(u'a')
+            True
+
+        .. versionadded:: 0.3.0
+        '''
+        md5 = hashlib.md5()
+        if path:
+            with open(path, 'rb') as stream:
+                for chunk in iter(lambda: stream.read(1 << 16), b''):
+                    md5.update(chunk)
+        else:
+            md5.update(content.encode('utf-8'))
+
+        if self.pipeline and not path:
+            md5.update('|' + ','.join(self.pipeline.names))
+        return md5.hexdigest()
+
+    def mako_filter(self, content, page):
+        '''Run the post-processing filters on a rendered page.
+
+        Filters take the whole text of a page, so streamed pages (which are
+        never held in memory) are not filtered.
+
+        Args:
+            content (unicode): rendered content
+            page (pageit.namespace.DeepNamespace): information about the page
+
+        Returns:
+            unicode: filtered content
+
+        .. versionadded:: 0.3.0
+        '''
+        before = len(content.encode('utf-8'))
+        content = self.pipeline(content, page)
+        saved = before - len(content.encode('utf-8'))
+        if self.stats is not None and 'saved' in self.stats:
+            self.stats.saved[page.output] = saved
+        self.log.debug(MSG.FILTER, '[FILTER]', saved, page.output)
+        return content
+
+    def mako_stream(self, tmpl, dest, **data):
+        '''Render a mako template directly to a temporary file.
+
+        The output is written in chunks as the template renders, so pages
+        are never held in memory in their entirety. The temporary file is
+        created next to ``dest`` so that it can be renamed into place.
+
+        Args:
+            tmpl (mako.template.Template): template to render
+            dest (str): output path
+            **data: variables to pass to the template
+
+        Returns:
+            str: path to the temporary file
+
+        Raises:
+            mako.exceptions.MakoException: if the template cannot be rendered;
+                the temporary file is removed
+
+        Example:
+            >>> runner = Pageit('test/example1')
+            >>> tmpl = runner.tmpl.get_template('index.html.mako')
+            >>> dest = osp.abspath('test/example1/index.html')
+            >>> tmp = runner.mako_stream(tmpl, dest, site=runner.site,
+            ...                          page=DeepNamespace())
+            >>> '/index.html' in open(tmp).read()
+            True
+            >>> os.remove(tmp)
+        '''
+        from mako.runtime import Context
+        tmp = osp.join(osp.dirname(dest), TMP_PREFIX + osp.basename(dest))
+        try:
+            with codecs.open(tmp, encoding='utf-8', mode='w') as out:
+                context = Context(out, **data)
+                context._outputting_as_unicode = True  # pylint: disable=W0212
+                tmpl.render_context(context, **data)
+        except Exception:
+            os.remove(tmp)
+            raise
+        return tmp
+
+    def mako_deps(self, path):
+        '''Returns set of immediate dependency paths for a mako template.
+
+        Note:
+            This function does not recursively compute dependencies.
+            Results are cached until the template is modified and kept in
+            the build manifest between runs (see
+            :py:meth:`~pageit.render.Pageit.load_deps`), so mako is only
+            imported when a template has to be scanned again.
+
+        Args:
+            path (str): path to a mako template
+
+        Returns:
+            set: paths of dependencies
+
+        Examples:
+            >>> Pageit().mako_deps('fake.mako')
+            set([])
+
+        .. versionchanged:: 0.3.0
+           Cache dependencies by modification time and content. Find
+           dependencies using mako's parser (see :py:func:`mako_imports`).
+        '''
+        paths = set([])
+        if not self.storage.isfile(path):
+            return paths
+
+        mtime = self.storage.getmtime(path)
+        cached = self._deps.get(path)
+        if cached and cached[0] == mtime:
+            return set(cached[1])
+
+        text = self.storage.read(path)
+        key = hashlib.md5(text).hexdigest()
+        with self._lock:
+            if key not in self._imports:  # same content is only parsed once
+                self._imports[key] = mako_imports(
+                    text.decode('utf-8', 'replace'))
+            names = self._imports[key]
+
+        for dep in names:
+            if '/' == dep[0]:  # relative to TemplateLookup.directories
+                dep = osp.normpath(osp.join(self.path, dep.lstrip('/')))
+            else:  # relative to template directory
+                dep = osp.normpath(osp.join(osp.dirname(path), dep))
+            paths.add(dep)
+
+        with self._lock:
+            self._deps[path] = (mtime, paths)
+        return set(paths)
+
+    def scanned_deps(self, path):
+        '''Returns the cached dependencies of a mako template and the
+        templates it imports, to keep in the build manifest.
+
+        Args:
+            path (str): template path
+
+        Returns:
+            dict: ``[mtime, dependencies]`` keyed by template; paths are
+            relative to the rendered directory
+
+        .. versionadded:: 0.3.0
+        '''
+        result = {}
+        for dep in self.mako_mtimes(path):
+            cached = self._deps.get(dep)
+            if cached:
+                result[osp.relpath(dep, self.path)] = [
+                    cached[0], sorted(osp.relpath(item, self.path)
+                                      for item in cached[1])]
+        return result
+
+    def load_deps(self):
+        '''Fills the dependency cache from the build manifest.
+
+        Entries are only used while the template's modification time is
+        the same as when it was scanned (see
+        :py:meth:`~pageit.render.Pageit.mako_deps`).
+
+        Returns:
+            Pageit: for method chaining
+
+        Example:
+            >>> runner = Pageit('test/example1')
+            >>> _ = runner.manifest.set('a.mako', deps={'a.mako': [1, []]})
+            >>> runner.load_deps()._deps[osp.abspath('test/example1/a.mako')]
+            (1, set([]))
+
+        .. versionadded:: 0.3.0
+        '''
+        with self._lock:
+            for name in self.manifest:
+                deps = self.manifest.get(name).deps or {}
+                for dep, (mtime, paths) in deps.items():
+                    dep = osp.normpath(osp.join(self.path, dep))
+                    if dep not in self._deps:
+                        self._deps[dep] = (mtime, set(
+                            osp.normpath(osp.join(self.path, item))
+                            for item in paths))
+        return self
+
+    def site_digests(self):
+        '''Returns digests of the top-level ``site`` values.
+
+        Note:
+            ``site.data`` is skipped because data files are tracked
+            separately. Empty namespaces are treated as missing keys.
+
+        Returns:
+            dict: digest of each top-level value keyed by name
+
+        Example:
+            >>> runner = Pageit('test/example1')
+            >>> sorted(runner.site_digests())
+            ['base_url']
+        '''
+        result = {}
+        for key, val in self.site.items():
+            if isinstance(val, DataNamespace):
+                continue  # tracked separately
+            elif isinstance(val, Namespace) and not val:
+                continue  # same as a missing key
+            result[key] = track.digest(val)
+        return result
+
+    def site_changes(self, name):
+        '''Returns the ``site`` keys a template read that have since changed.
+
+        Note:
+            This function relies on the ``site`` keys recorded in the build
+            manifest during the template's last render.
+
+        Args:
+            name (str): template path relative to the rendered directory
+
+        Returns:
+            list: sorted names of the changed keys
+
+        Examples:
+            >>> Pageit().site_changes('fake.mako')
+            []
+        '''
+        entry = self.manifest.get(name)
+        if not entry or not entry.site:
+            return []
+
+        digests = self._digests or self.site_digests()
+        return sorted(key for key, val in entry.site.items()
+                      if digests.get(key) != val)
+
+    def data_mtime(self, name):
+        '''Returns the latest modification time of the data a template read.
+
+        Note:
+            This function relies on the data files recorded in the build
+            manifest during the template's last render.
+
+        Args:
+            name (str): template path relative to the rendered directory
+
+        Returns:
+            int: latest modification time; 0 if the template read no data.
+            If a data file was removed, returns :py:data:`sys.maxint` so that
+            the template is rendered again.
+
+        Examples:
+            >>> Pageit().data_mtime('fake.mako')
+            0
+        '''
+        return max([0] + self.data_mtimes(name).values())
+
+    def data_mtimes(self, name):
+        '''Returns the modification times of the data a template read.
+
+        Args:
+            name (str): template path relative to the rendered directory
+
+        Returns:
+            dict: modification time keyed by data file path; removed files
+            have a modification time of :py:data:`sys.maxint`. Data
+            directories that were listed are included; their modification
+            time changes when files are added or removed.
+
+        .. versionadded:: 0.3.0
+        '''
+        return self.recorded_mtimes(name, 'data')
+
+    def recorded_mtimes(self, name, kind):
+        '''Returns the modification times of files recorded in the manifest
+        while a template rendered.
+
+        Args:
+            name (str): template path relative to the rendered directory
+            kind (str): manifest key listing the files (``data`` or
+                ``templates``)
+
+        Returns:
+            dict: modification time keyed by file path; removed files have a
+            modification time of :py:data:`sys.maxint`
+
+        .. versionadded:: 0.3.0
+        '''
+        entry = self.manifest.get(name)
+        mtimes = {}
+        for dep in (entry and entry.get(kind)) or []:
+            dep = osp.join(self.path, dep)
+            if self.storage.isfile(dep) or self.storage.isdir(dep):
+                mtimes[dep] = int(self.storage.getmtime(dep))
+            else:
+                mtimes[dep] = sys.maxint
+        return mtimes
+
+    def mako_mtime(self, path, levels=5):
+        '''Returns the modification time of a mako template.
+
+        Note:
+            This function considers a limited portion of the template's
+            inheritance tree to determine the latest modification time.
+
+        Args:
+            path (str): template path
+            levels (int): number of inheritance levels to traverse (default: 5)
+
+        Returns:
+            int: latest modification time; 0 if the file does not exist
+
+        Examples:
+            >>> Pageit().mako_mtime('fake.mako')
+            0
+
+            >>> import os.path as osp
+            >>> path1 = osp.abspath('test/example1')
+            >>> path2 = osp.join(path1, 'subdir/test-page.html.mako')
+            >>> Pageit(path1).mako_mtime(path2) > 0
+            True
+        '''
+        return max([0] + self.mako_mtimes(path, levels).values())
+
+    def fragment_version(self, uri):
+        '''Returns the version of a template for the fragment cache.
+
+        Args:
+            uri (str): template URI (relative to the rendered directory)
+
+        Returns:
+            float: latest modification time of the template and its
+            dependencies; None if the template does not exist
+
+        Example:
+            >>> Pageit().fragment_version('/fake.mako') is None
+            True
+
+        .. versionadded:: 0.3.0
+        '''
+        mtimes = self.mako_mtimes(osp.join(self.path, uri.lstrip('/')))
+        return max(mtimes.values()) if mtimes else None
+
+    def mako_mtimes(self, path, levels=5):
+        '''Returns the modification times of a mako template and its
+        dependencies.
+
+        Args:
+            path (str): template path
+            levels (int): number of inheritance levels to traverse (default: 5)
+
+        Returns:
+            dict: modification time keyed by path; empty if the template does
+            not exist
+
+        Examples:
+            >>> Pageit().mako_mtimes('fake.mako')
+            {}
+
+        .. versionadded:: 0.3.0
+        '''
+        _context = '[MTIME]'
+        name = osp.relpath(path, self.path)
+        self.log.debug(MSG.T_MTIME, _context, name)
+
+        mtimes = {}
+        if not self.storage.isfile(path):
+            return mtimes
+
+        deps, next_deps = set([path]), set([])
+        for _ in range(levels + 1):
+            for dep in deps:
+                if dep in mtimes or not self.storage.isfile(dep):
+                    continue
+
+                next_deps = next_deps.union(self.mako_deps(dep))
+                mtimes[dep] = int(self.storage.getmtime(dep))
+
+            if not next_deps:
+                break
+
+            deps, next_deps = next_deps, set([])
+
+        self.log.debug(MSG.T_MTIME_END, _context, len(mtimes) - 1,
+                       ', '.join(sorted(osp.relpath(dep, self.path)
+                                        for dep in mtimes if dep != path)))
+        return mtimes
+
+    def stale(self, path):
+        '''Returns the reason a template needs to be rendered.
+
+        Args:
+            path (str): template path
+
+        Returns:
+            str: why the template is stale; None if its outputs are up to date
+
+        Examples:
+            >>> Pageit('test/example1').stale('test/example1/index.html.mako')
+            'missing output <index.html>'
+
+            >>> runner = Pageit('test/example1', ignore_mtime=True)
+            >>> runner.stale('test/example1/index.html.mako')
+            'ignoring modification times'
+
+        .. versionadded:: 0.3.0
+        '''
+        if self.args.ignore_mtime:
+            return 'ignoring modification times'
+
+        path = osp.abspath(path)
+        name = osp.relpath(path, self.path)
+        changed = self.site_changes(name)
+        if changed:
+            return 'site changed: ' + ', '.join(changed)
+
+        dests = self.outputs(path)
+        entry = self.manifest.get(name)
+        if not dests:  # empty collection; compare with when it rendered
+            if not entry or entry.rendered is None:
+                return 'no outputs'
+            output_changed = int(entry.rendered)
+        else:
+            for dest in dests:
+                if not self.storage.isfile(dest):
+                    return 'missing output <%s>' % osp.relpath(dest,
+                                                                self.out)
+
+            output_changed = min(int(self.storage.getmtime(dest))
+                                 for dest in dests)
+        self.log.debug(MSG_PRE + 'output: %s', '[MTIME]', output_changed)
+
+        mtimes = self.mako_mtimes(path)
+        if mtimes.get(path, 0) > output_changed:
+            return 'template changed'
+
+        for kind, deps in [('dependency', mtimes),
+                           ('loaded template',
+                            self.recorded_mtimes(name, 'templates')),
+                           ('data', self.data_mtimes(name))]:
+            for dep in sorted(deps):
+                if deps[dep] > output_changed:
+                    return '%s changed <%s>' % (kind,
+                                                osp.relpath(dep, self.path))
+        return None
+
+    def estimate(self, name):
+        '''Returns how long a template took to render during its last build.
+
+        Args:
+            name (str): template path relative to the rendered directory
+
+        Returns:
+            float: seconds; None if the template has no recorded timing
+
+        Examples:
+            >>> Pageit().estimate('fake.mako') is None
+            True
+
+        .. versionadded:: 0.3.0
+        '''
+        entry = self.manifest.get(name)
+        return entry and entry.elapsed
+
+    def report(self):
+        '''Logs the templates that are stale and the estimated build time.
+
+        Templates without a recorded timing are estimated using the average
+        of the recorded timings.
+
+        Returns:
+            Pageit: for method chaining
+        '''
+        _context = '[REPORT]'
+        stale = self.stats.stale
+        known = [item.estimate for item in stale if item.estimate is not None]
+        average = (sum(known) / len(known)) if known else 0.0
+
+        for item in stale:
+            self.log.info(MSG.STALE, _context, item.name, item.reason)
+
+        self.stats.estimate = sum(known) + average * (len(stale) - len(known))
+        self.log.info(MSG.REPORT, _context, len(stale), self.stats.total,
+                      self.stats.estimate, len(stale) - len(known))
+        return self
+
+
+def create_logger(verbosity=DEFAULT.verbosity, log=None):
+    '''Constructs a logger.
+
+    Args:
+        verbosity (int): level of verbosity
+        log (logging.Logger): an existing logger to modify
+
+    Returns:
+        logging.Logger: logger configured based on verbosity.
+
+    Example:
+        >>> log = create_logger()
+        >>> log.getEffectiveLevel() == logging.INFO
+        True
+
+        >>> log = create_logger(0, log)
+        >>> log.getEffectiveLevel() == logging.NOTSET
+        True
+
+        >>> log = create_logger(2, log)
+        >>> log.getEffectiveLevel() == logging.DEBUG
+        True
+    '''
+    log = log or DEFAULT.log
+    if 0 == verbosity:
+        log.setLevel(logging.NOTSET)
+    elif 1 == verbosity:
+        log.setLevel(logging.INFO)
+    elif verbosity > 1:
+        log.setLevel(logging.DEBUG)
+    return log
+
+
+def create_lookup(path=DEFAULT.path, tmp=None, fragments=None,
+                  max_templates=None, storage=None):
     '''Constructs a mako TemplateLookup object.
 
     Args:
         path (str): top-level path to search for mako templates
         tmp (str, optional): directory to store generated modules
+        fragments (pageit.fragments.FragmentCache, optional): cache for
+            ``<%def>`` blocks marked ``cached="True"``
+        max_templates (int, optional): maximum number of compiled templates
+            to keep; by default, all templates are kept
+        storage (pageit.storage.MemoryStorage, optional): storage from which
+            to read templates; by default, they are read from the local disk
 
     Returns:
         mako.lookup.TemplateLookup: object to use for searching for templates
@@ -466,16 +2162,37 @@ def create_lookup(path=DEFAULT.path, tmp=None):
     Example:
         >>> create_lookup() is not None
         True
+
+    .. versionchanged:: 0.3.0
+       Added the ``fragments``, ``max_templates``, and ``storage``
+       arguments. Templates loaded through the lookup are recorded (see
+       :py:class:`~pageit.lookup.TrackingLookup`).
     '''
-    return TemplateLookup(
+    try:
+        from pageit.lookup import TrackingLookup
+    except ImportError:  # pragma: no cover
+        from .lookup import TrackingLookup
+
+    cache = {}
+    if fragments is not None:
+        from mako.cache import register_plugin
+        register_plugin('pageit', 'pageit.fragments', 'MakoCache')
+        cache = dict(cache_impl='pageit',
+                     cache_args=dict(fragments=fragments))
+
+    return TrackingLookup(
         directories=[path],
         module_directory=tmp,
+        collection_size=max_templates or -1,
+        storage=storage,
         input_encoding='utf-8',
-        output_encoding='utf-8'
+        output_encoding='utf-8',
+        **cache
     )
 
 
-def create_config(path=DEFAULT.config, env=DEFAULT.env, log=None):
+def create_config(path=DEFAULT.config, env=DEFAULT.env, log=None,
+                  storage=None):
     '''Constructs a :py:class:`~pageit.namespace.DeepNamespace` for attributes
     to pass to mako templates.
 
@@ -487,6 +2204,8 @@ def create_config(path=DEFAULT.config, env=DEFAULT.env, log=None):
         path (str): YAML configuration file
         env (str, optional): section to load
         log (logging.Logger, optional): system logger
+        storage (pageit.storage.DiskStorage, optional): storage from which
+            to read the file; default is the local disk
 
     Returns:
         pageit.namespace.DeepNamespace:
@@ -505,15 +2224,20 @@ def create_config(path=DEFAULT.config, env=DEFAULT.env, log=None):
         True
 
     .. versionadded:: 0.2.1
+
+    .. versionchanged:: 0.3.0
+       Added the ``storage`` parameter.
     '''
     _context = '[CONFIG]'
     log = log or create_logger()
+    storage = storage or DiskStorage()
     result = DeepNamespace()
-    if not osp.isfile(path):
+    if not storage.isfile(path):
         log.warning(MSG.PATH_ERR, _context, path)
         return result
 
-    all_env = DeepNamespace(yaml.load(open(path)))
+    import yaml
+    all_env = DeepNamespace(yaml.load(storage.read(path)))
     if DEFAULT.env in all_env:
         log.debug(MSG.LOAD_ENV, _context, DEFAULT.env, path)
         result += all_env[DEFAULT.env]
@@ -528,6 +2252,349 @@ def create_config(path=DEFAULT.config, env=DEFAULT.env, log=None):
     return result
 
 
+def collection_items(value):
+    '''Returns the items of a collection as key/item pairs.
+
+    Args:
+        value (dict, list): collection
+
+    Returns:
+        list: ``(key, item)`` tuples; dictionaries are sorted by key and lists
+        are keyed by index
+
+    Examples:
+        >>> collection_items({'b': 2, 'a': 1})
+        [('a', 1), ('b', 2)]
+        >>> collection_items(['x', 'y'])
+        [(0, 'x'), (1, 'y')]
+        >>> collection_items(None)
+        []
+
+    .. versionadded:: 0.3.0
+    '''
+    if value is None:
+        return []
+    elif isinstance(value, collections.Mapping):
+        return sorted(value.items())
+    return list(enumerate(value))
+
+
+def mako_imports(text):
+    '''Returns the names of the templates a mako template imports.
+
+    Imports are found in ``<%include>``, ``<%inherit>``, and
+    ``<%namespace>`` tags and in ``get_template()`` calls with a literal
+    name. Names computed by expressions cannot be found. Templates that mako
+    cannot parse are scanned for tags instead.
+
+    Args:
+        text (unicode): template source
+
+    Returns:
+        list: sorted template names, as written in the template
+
+    Examples:
+        >>> mako_imports(u"""<%inherit file='base.html'/>
+        ... <%include
+        ...     file="/nav.html"/>
+        ... <%namespace name="n" file="${name}"/>
+        ... <% t = lookup.get_template("part.html") %>""")
+        [u'/nav.html', u'base.html', u'part.html']
+
+        >>> mako_imports(u"""% if x:
+        ... <%include file="a.html"/>""")  # cannot parse
+        [u'a.html']
+
+    .. versionadded:: 0.3.0
+    '''
+    from mako import parsetree
+    from mako.exceptions import MakoException
+    from mako.lexer import Lexer
+
+    try:
+        nodes = list(Lexer(text).parse().get_children())
+    except MakoException:
+        return sorted(set(match.group(3)
+                          for match in RE_MAKO_IMPORT.finditer(text)))
+
+    names, seen = set([]), set([])
+    while nodes:
+        node = nodes.pop()
+        if id(node) in seen:  # control lines list their children twice
+            continue
+        seen.add(id(node))
+        nodes.extend(node.get_children())
+        if isinstance(node, (parsetree.IncludeTag, parsetree.InheritTag,
+                             parsetree.NamespaceTag)):
+            names.add(node.attributes.get('file'))
+        elif isinstance(node, (parsetree.Code, parsetree.Expression)):
+            names.update(match.group(2)
+                         for match in RE_GET_TEMPLATE.finditer(node.text))
+    return sorted(name for name in names if name and '${' not in name)
+
+
+def error_cause(ex):
+    '''Returns what caused a template error.
+
+    Pages that fail because of the same broken template (e.g. a shared layout)
+    have the same cause.
+
+    Args:
+        ex (Exception): error raised while rendering
+
+    Returns:
+        str: type and message of the error
+
+    Example:
+        >>> error_cause(ValueError('bad value'))
+        'ValueError: bad value'
+
+    .. versionadded:: 0.3.0
+    '''
+    return '%s: %s' % (ex.__class__.__name__, ex)
+
+
+def threaded_map(func, items, jobs=DEFAULT.jobs, chunksize=None):
+    '''Applies a function to items using a pool of threads.
+
+    The threads share the interpreter lock, so this only saves time when
+    the function waits on I/O (e.g. deleting or writing files).
+
+    Args:
+        func (callable): function to apply
+        items (list): items to which to apply the function
+        jobs (int, optional): number of threads; if 1 (the default), the
+            function is applied in the current thread
+        chunksize (int, optional): number of items handed to a thread at a
+            time; use 1 to take items strictly in order
+
+    Returns:
+        list: results in the same order as ``items``
+
+    Examples:
+        >>> threaded_map(abs, [-1, 2, -3], jobs=2)
+        [1, 2, 3]
+
+    .. versionadded:: 0.3.0
+    '''
+    items = list(items)
+    if jobs <= 1 or len(items) <= 1:
+        return [func(item) for item in items]
+
+    from multiprocessing.pool import ThreadPool
+    pool = ThreadPool(min(jobs, len(items)))
+    try:
+        return pool.map(func, items, chunksize)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def stable_shard(name, count):
+    '''Returns the shard of a name that does not depend on other names.
+
+    Args:
+        name (str): path relative to the rendered directory
+        count (int): number of shards
+
+    Returns:
+        int: shard index from 1 to ``count``
+
+    Examples:
+        >>> stable_shard('index.html.mako', 1)
+        1
+        >>> stable_shard('a.css', 4) == stable_shard('a.css', 4)
+        True
+
+    .. versionadded:: 0.3.0
+    '''
+    if isinstance(name, unicode):
+        name = name.encode('utf-8')
+    digest = hashlib.md5(name.replace(os.sep, '/')).hexdigest()
+    return int(digest[:8], 16) % count + 1
+
+
+def assign_shards(names, count, costs=None):
+    '''Assigns templates to shards.
+
+    If any template has a recorded cost, templates are assigned from the
+    most to the least expensive, each to the shard with the lowest total
+    cost so far; templates without a cost count as the average cost. Ties
+    are broken by name and shard index, so the result only depends on the
+    arguments. Otherwise, templates are assigned by
+    :py:func:`~pageit.render.stable_shard`.
+
+    Args:
+        names (list): template names
+        count (int): number of shards
+        costs (dict, optional): cost (e.g. seconds) keyed by template name
+
+    Returns:
+        dict: shard index (from 1 to ``count``) keyed by template name
+
+    Examples:
+        >>> shards = assign_shards(['a', 'b', 'c', 'd'], 2,
+        ...                        dict(a=4.0, b=3.0, c=2.0, d=1.0))
+        >>> sorted(shards.items())
+        [('a', 1), ('b', 2), ('c', 2), ('d', 1)]
+        >>> assign_shards(['a', 'b'], 3) == assign_shards(['b', 'a'], 3)
+        True
+
+    .. versionadded:: 0.3.0
+    '''
+    costs = costs or {}
+    if all(costs.get(name) is None for name in names):
+        return dict((name, stable_shard(name, count)) for name in names)
+
+    lanes = schedule(names, count, costs).lanes
+    return dict((name, index + 1) for index, lane in enumerate(lanes)
+                for name in lane)
+
+
+def schedule(names, jobs=DEFAULT.jobs, costs=None):
+    '''Plans the order in which to render templates.
+
+    Templates are ordered from the most to the least expensive (by name when
+    costs are equal); templates without a cost count as the average cost.
+    The plan assigns each template in turn to the worker with the lowest
+    total cost so far (the one that will be free first), which is what a
+    pool of workers taking templates in this order does. Render threads
+    share one interpreter lock, so the ``estimate`` is only close to the
+    elapsed time when rendering mostly waits on I/O.
+
+    Args:
+        names (list): template names
+        jobs (int, optional): number of workers
+        costs (dict, optional): cost (e.g. seconds) keyed by template name
+
+    Returns:
+        Namespace: ``order`` in which to render the templates, the templates
+        planned for each worker (``lanes``), and the total cost of the
+        busiest worker (``estimate``)
+
+    Examples:
+        >>> plan = schedule(['a', 'b', 'c', 'd'], 2,
+        ...                 dict(a=1.0, b=4.0, c=2.0, d=3.0))
+        >>> plan.order
+        ['b', 'd', 'c', 'a']
+        >>> plan.lanes, plan.estimate
+        ([['b', 'a'], ['d', 'c']], 5.0)
+        >>> schedule(['a', 'b', 'c'], 2).lanes  # no costs
+        [['a', 'c'], ['b']]
+
+    .. versionadded:: 0.3.0
+    '''
+    jobs = max(1, jobs)
+    costs = dict((name, cost) for name, cost in (costs or {}).items()
+                 if cost is not None)
+    names = sorted(set(names))
+    known = [costs[name] for name in names if name in costs]
+    average = (sum(known) / len(known)) if known else 1.0
+    cost = lambda name: costs.get(name, average)
+
+    order = sorted(names, key=lambda name: (-cost(name), name))
+    lanes, loads = [[] for _ in range(jobs)], [0.0] * jobs
+    for name in order:
+        lane = min(range(jobs), key=lambda i: (loads[i], len(lanes[i]), i))
+        lanes[lane].append(name)
+        loads[lane] += cost(name)
+    return Namespace(order=order, lanes=lanes, estimate=max(loads))
+
+
+def parse_shard(value):
+    '''Parses a shard given as ``K/N`` (shard K of N).
+
+    Args:
+        value (str): shard
+
+    Returns:
+        tuple: shard index and count
+
+    Raises:
+        ValueError: if the shard is not of the form ``K/N`` with
+            ``1 <= K <= N``
+
+    Examples:
+        >>> parse_shard('2/4')
+        (2, 4)
+        >>> parse_shard('5/4')
+        Traceback (most recent call last):
+        ...
+        ValueError: shard must be K/N with 1 <= K <= N: 5/4
+    '''
+    try:
+        index, count = [int(part) for part in value.split('/')]
+    except ValueError:
+        index, count = 0, 0
+    if not 1 <= index <= count:
+        raise ValueError('shard must be K/N with 1 <= K <= N: %s' % value)
+    return index, count
+
+
+def parse_envs(value):
+    '''Parses a comma-separated list of configuration environments.
+
+    Args:
+        value (str): environments, e.g. ``staging,production``
+
+    Returns:
+        list: names of the environments in order, without duplicates
+
+    Raises:
+        ValueError: if there is no environment or a name is not a valid
+            directory name
+
+    Examples:
+        >>> parse_envs('staging, production,staging')
+        ['staging', 'production']
+        >>> parse_envs('a/b')
+        Traceback (most recent call last):
+        ...
+        ValueError: invalid environment: a/b
+
+    .. versionadded:: 0.3.0
+    '''
+    envs = []
+    for env in value.split(','):
+        env = env.strip()
+        if not env or env.startswith('.') or os.sep in env or '/' in env:
+            raise ValueError('invalid environment: %s' % (env or value))
+        if env not in envs:
+            envs.append(env)
+    return envs
+
+
+def create_site(path=DEFAULT.config, env=DEFAULT.env, log=None,
+                storage=None):
+    '''Constructs the ``site`` namespace passed to mako templates.
+
+    The namespace contains information about pageit (under ``_pageit``)
+    extended with the configuration loaded by
+    :py:func:`~pageit.render.create_config`.
+
+    Args:
+        path (str): YAML configuration file
+        env (str, optional): section to load
+        log (logging.Logger, optional): system logger
+        storage (pageit.storage.DiskStorage, optional): storage from which
+            to read the file; default is the local disk
+
+    Returns:
+        pageit.namespace.DeepNamespace: site information
+
+    Examples:
+        >>> site = create_site('test/example1/pageit.yml', 'test')
+        >>> site._pageit.version == pageit.__version__ and site.debug
+        True
+
+    .. versionadded:: 0.3.0
+    '''
+    site = DeepNamespace(_pageit=DeepNamespace(version=pageit.__version__))
+    if (storage or DiskStorage()).isfile(path):
+        site += create_config(path, env, log, storage)
+    return site
+
+
 def strip_ext(path, ext):
     '''Remove an extension from a path, if present.
 
@@ -549,22 +2616,79 @@ def strip_ext(path, ext):
     return path
 
 
-@expects_obj
-@arg('path', nargs='?', default=DEFAULT.path, help='path to process')
-@arg('-n', '--dry-run', default=False, help='simulate the process')
-@arg('-c', '--clean', default=False, help='remove generated files')
-@arg('-r', '--render', default=False,
-     help='render templates after --clean')
-@arg('-w', '--watch', default=False, help='watch for file modifications')
-@arg('-s', '--serve', metavar='PORT', nargs='?', const=DEFAULT.port,
-     help='run basic HTTP server; deafult port is ' + str(DEFAULT.port))
-@arg('-f', '--config', metavar='PATH', default=DEFAULT.config,
-     help='yaml config file')
-@arg('-e', '--env', metavar='ENV', default=DEFAULT.env, help='config section')
-@arg('--tmp', metavar='PATH', default=DEFAULT.tmp, help='mako template cache')
-@arg('--ignore-mtime', default=False, help='ignore file modification times')
-@arg('--noerr', default=False, help='do not generate HTML error output')
-@arg('--ext', default=DEFAULT.ext, help='mako file extention')
+def _arg(*names, **kwds):
+    '''Describes a command-line argument (see
+    :py:meth:`argparse.ArgumentParser.add_argument`).
+
+    Args:
+        *names: argument names
+        **kwds: argument options
+
+    Returns:
+        tuple: names and options
+    '''
+    return names, kwds
+
+
+# command-line arguments for render(); added to the parser by main(), which
+# is the only place argh is imported
+ARGS = [
+    _arg('path', nargs='?', default=DEFAULT.path, help='path to process'),
+    _arg('-n', '--dry-run', action='store_true', help='simulate the process'),
+    _arg('-c', '--clean', action='store_true', help='remove generated files'),
+    _arg('-r', '--render', action='store_true',
+         help='render templates after --clean'),
+    _arg('-w', '--watch', action='store_true',
+         help='watch for file modifications'),
+    _arg('-s', '--serve', metavar='PORT', nargs='?', const=DEFAULT.port,
+         help='run basic HTTP server; deafult port is ' + str(DEFAULT.port)),
+    _arg('--live', action='store_true',
+         help='reload served pages in the browser when they are rebuilt'),
+    _arg('-f', '--config', metavar='PATH', default=DEFAULT.config,
+         help='yaml config file'),
+    _arg('-e', '--env', metavar='ENV', type=parse_envs, default=DEFAULT.env,
+         help='config section; several (a,b) render into out/a and out/b'),
+    _arg('--data', metavar='PATH', default=DEFAULT.data,
+         help='data file directory'),
+    _arg('--tmp', metavar='PATH', default=DEFAULT.tmp,
+         help='mako template cache'),
+    _arg('--ignore-mtime', action='store_true',
+         help='ignore file modification times'),
+    _arg('--noerr', action='store_true',
+         help='do not generate HTML error output'),
+    _arg('--stream', action='store_true', help='write output while rendering'),
+    _arg('--gzip', action='store_true',
+         help='write a compressed copy (.gz) of each output'),
+    _arg('--fragments', metavar='PATH', default=None,
+         help='keep cached template fragments in this directory'),
+    _arg('--filter', metavar='NAME', action='append', dest='filters',
+         help='post-process rendered pages (html, css, js, or module:func); '
+              'may be repeated'),
+    _arg('-j', '--jobs', metavar='N', type=int, default=DEFAULT.jobs,
+         help='number of worker threads (helps with file I/O, not with '
+              'rendering)'),
+    _arg('-o', '--out', metavar='DIR', default=None,
+         help='output directory; default is next to the templates'),
+    _arg('--max-templates', metavar='N', type=int, default=None,
+         help='number of compiled templates to keep in memory'),
+    _arg('--recycle', metavar='N', type=int, default=None,
+         help='reset compiled templates and caches after N renders'),
+    _arg('--memory', metavar='MB', type=float, default=None,
+         help='reset compiled templates and caches above this many MB'),
+    _arg('--shard', metavar='K/N', type=parse_shard, default=None,
+         help='build only shard K of N of the templates'),
+    _arg('--merge', action='store_true',
+         help='combine the manifests of a sharded build'),
+    _arg('--daemon', action='store_true',
+         help='keep running and accept commands on a local socket'),
+    _arg('--send', metavar='CMD', choices=['build', 'clean', 'status', 'stop'],
+         help='send a command to a running daemon'),
+    _arg('--socket', metavar='PATH', default=None,
+         help='daemon socket; default is ' + DEFAULT.socket + ' in path'),
+    _arg('--ext', default=DEFAULT.ext, help='mako file extention')
+]
+
+
 def render(args):  # pragma: no cover
     '''Convenience method for :py:class:`~pageit.render.Pageit`.
 
@@ -573,38 +2697,93 @@ def render(args):  # pragma: no cover
 
     .. versionchanged:: 0.2.1
        Added configuration loading.
+
+    .. versionchanged:: 0.3.0
+       Added data file directory, streaming output, parallel workers,
+       output directory, build daemon, live reload, sharded builds,
+       rendering from (and into) archives, and several environments.
     '''
     args.path = osp.abspath(args.path)
     log = create_logger(args.verbosity)
-    site = DeepNamespace(_pageit=DeepNamespace(version=pageit.__version__))
-    tmpl = create_lookup(args.path, args.tmp)
-
+    socket_path = args.socket or osp.join(args.path, DEFAULT.socket)
+    if args.send:
+        from pageit import daemon
+        response = daemon.send(socket_path, args.send)
+        print json.dumps(response, indent=2, sort_keys=True)
+        sys.exit(0 if response.get('ok') else 1)
+
+    storage = open_storage(args.path, args.out)  # either may be an archive
     if not osp.isfile(args.config):  # adjust relative to path
         log.debug(MSG.PATH_ERR, '[CONFIG]', args.config)
         args.config = osp.join(args.path, args.config)
 
-    if osp.isfile(args.config):
-        site += create_config(args.config, args.env, log)
+    options = dict(path=args.path,
+                   ext=args.ext,
+                   dry_run=args.dry_run,
+                   noerr=args.noerr,
+                   ignore_mtime=args.ignore_mtime,
+                   stream=args.stream,
+                   jobs=args.jobs,
+                   out=args.out,
+                   gzip=args.gzip,
+                   filters=args.filters,
+                   fragments=args.fragments,
+                   max_templates=args.max_templates,
+                   recycle=args.recycle,
+                   memory=args.memory,
+                   shard=args.shard,
+                   config=args.config,
+                   storage=storage,
+                   tmp=args.tmp, data=args.data, log=log)
+    envs = args.env  # see parse_envs()
+    if len(envs) > 1:
+        if args.daemon:
+            log.error(MSG.ENV_ERR, '[CONFIG]', '--daemon')
+            sys.exit(1)
+        from pageit.envs import Environments
+        runner = Environments(envs, **options)
+    else:
+        site = create_site(args.config, envs[0], log, storage)
+        runner = Pageit(site=site, **options)
+
+    if args.merge:
+        runner.merge()
+        sys.exit(0 if runner.stats.shards else 1)
 
-    runner = Pageit(path=args.path,
-                    ext=args.ext,
-                    dry_run=args.dry_run,
-                    noerr=args.noerr,
-                    ignore_mtime=args.ignore_mtime,
-                    site=site, tmpl=tmpl, log=log)
     if args.clean:
         runner.clean()
 
-    if args.render or args.watch or not args.clean:
+    if args.render or args.watch or args.daemon or not args.clean:
         runner.run()  # run at least once
 
-    watch_path = (args.watch and args.path) or None
-    with tools.watch(watch_path, runner.on_change, log) as watcher:
+    server = None
+    live = tools.LiveReload()
+
+    def rebuild(paths):
+        '''Render changes and tell browsers which outputs were rebuilt.'''
+        stats = runner.stats
+        runner.on_changes(paths)
+        if runner.stats is not stats:  # ran
+            live.publish(runner.stats.written)
+
+    queue = tools.BuildQueue(rebuild, log=log)
+    on_change = queue.put  # render on a worker thread
+    if args.daemon:
+        from pageit import daemon
+        server = daemon.Daemon(runner, socket_path, config=args.config,
+                               env=envs[0], log=log)
+        on_change = server.on_change
+
+    watch_path = (args.watch and osp.isdir(args.path) and args.path) or None
+    with queue, tools.watch(watch_path, on_change, log) as watcher:
         runner.watcher = watcher  # to help pause the watcher during render
 
         # Wait for CTRL+C either in the server or in a dummy loop.
-        if args.serve:
-            tools.serve(args.path, args.serve, log)  # server loop
+        if server:
+            server.serve()  # control socket loop
+        elif args.serve:
+            tools.serve(runner.out, args.serve, log, queue, live,
+                        args.live)  # server loop
         elif args.watch:
             watcher.loop()  # dummy loop
 
@@ -612,8 +2791,11 @@ def render(args):  # pragma: no cover
 def main():  # pragma: no cover
     '''Console entry point.
 
-    Constructs and dispatches the argument parser.
+    Constructs the argument parser from :py:data:`ARGS` and runs
+    :py:func:`~pageit.render.render`.
     '''
+    from argh import ArghParser
+
     parser = ArghParser(prog='pageit', description=pageit.__doc__,
                         epilog=pageit.__epilog__)
     parser.add_argument('--version', action='version',
@@ -623,8 +2805,9 @@ def main():  # pragma: no cover
     parser.add_argument('-q', '--quiet', dest='verbosity',
                         action='store_const', const=0,
                         help='suppress logging messages')
-    parser.set_default_command(render)
-    parser.dispatch()
+    for names, kwds in ARGS:
+        parser.add_argument(*names, **kwds)
+    render(parser.parse_args())
 
 if '__main__' == __name__:  # pragma: no cover
     main()
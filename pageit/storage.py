@@ -0,0 +1,828 @@
+#!/usr/bin/python
+# coding: utf-8
+
+'''Where templates are read from and outputs are written to.
+
+:py:class:`~pageit.render.Pageit` finds templates, scans their
+dependencies, checks whether outputs are stale, and writes outputs through a
+storage object. :py:class:`~pageit.storage.DiskStorage` (the default) uses
+the local disk; :py:class:`~pageit.storage.MemoryStorage` keeps everything
+in memory, e.g. to preview unsaved drafts or to benchmark rendering without
+disk I/O. :py:class:`~pageit.storage.ArchiveStorage` reads a zip or tar
+archive in place (without extracting it) and can write a new archive, and
+:py:class:`~pageit.storage.MountStorage` combines storages, e.g. to render
+templates from an archive into a directory (see
+:py:func:`~pageit.storage.open_storage`).
+
+Paths are absolute paths of the local file system in every case (a memory
+storage simply has no files behind them; the files of an archive are below
+the path of the archive itself). Cached fragments are always kept on the
+local disk.
+
+.. versionadded:: 0.3.0
+'''
+
+# Native
+from os import path as osp
+import collections
+import errno
+import io
+import mmap
+import os
+import tarfile
+import tempfile
+import threading
+import time
+import zipfile
+
+# Package
+try:
+    from pageit import tools
+except ImportError:  # pragma: no cover
+    from . import tools
+
+# extensions of the archives that can be rendered from (or into)
+ARCHIVE_EXTS = ('.zip', '.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2')
+
+# tar modes by extension of the archive to write
+TAR_MODES = (('.gz', 'w:gz'), ('.tgz', 'w:gz'), ('.bz2', 'w:bz2'),
+             ('.tbz2', 'w:bz2'))
+
+
+class DiskStorage(object):
+    '''Files on the local disk.
+
+    Attributes:
+        local (bool): True because paths are real files; streaming output,
+            compressed copies, and compiled module caches need real files
+
+    Example:
+        >>> storage = DiskStorage()
+        >>> storage.isfile('setup.py') and not storage.isdir('setup.py')
+        True
+    '''
+
+    local = True
+
+    def walk(self, top):
+        '''Generates the directories below a directory (see
+        :py:func:`os.walk`).
+
+        Args:
+            top (str): directory to walk
+
+        Yields:
+            tuple: path of the directory, names of its subdirectories (which
+            may be modified in place to skip them), and names of its files
+        '''
+        return os.walk(top)
+
+    def isfile(self, path):
+        '''Returns True if a file exists.'''
+        return osp.isfile(path)
+
+    def isdir(self, path):
+        '''Returns True if a directory exists.'''
+        return osp.isdir(path)
+
+    def getmtime(self, path):
+        '''Returns the modification time of a file.'''
+        return osp.getmtime(path)
+
+    def getsize(self, path):
+        '''Returns the size of a file in bytes.'''
+        return osp.getsize(path)
+
+    def listdir(self, path):
+        '''Returns the names of the entries in a directory.'''
+        return os.listdir(path)
+
+    def read(self, path):
+        '''Returns the content of a file.
+
+        Args:
+            path (str): file to read
+
+        Returns:
+            str: content (bytes)
+        '''
+        with open(path, 'rb') as stream:
+            return stream.read()
+
+    def write(self, path, data):
+        '''Writes a file, creating missing parent directories.
+
+        Args:
+            path (str): file to write
+            data (str): content (bytes)
+
+        Returns:
+            str: ``path``
+        '''
+        tools.makedirs(osp.dirname(path))
+        with open(path, 'wb') as stream:
+            stream.write(data)
+        return path
+
+    def makedirs(self, path):
+        '''Creates a directory and its missing parents.'''
+        tools.makedirs(path)
+
+    def remove(self, path):
+        '''Removes a file.'''
+        os.remove(path)
+
+    def rmdir(self, path):
+        '''Removes an empty directory.'''
+        os.rmdir(path)
+
+    def touch(self, path, mtime=None):
+        '''Sets the modification time of a file (default: now).'''
+        os.utime(path, None if mtime is None else (mtime, mtime))
+
+    def outdated(self, src, dest):
+        '''Returns True if a copy of a file is missing or out of date (see
+        :py:func:`~pageit.tools.outdated`).'''
+        return tools.outdated(src, dest)
+
+    def link(self, src, dest):
+        '''Links (or copies) a file to a new path (see
+        :py:func:`~pageit.tools.link`).'''
+        return tools.link(src, dest)
+
+    def flush(self):
+        '''Saves pending changes; files on disk are written immediately.
+
+        Returns:
+            bool: False
+        '''
+        return False
+
+
+class MemoryStorage(object):
+    '''Files kept in memory.
+
+    Args:
+        files (dict, optional): initial content (bytes or unicode, which is
+            encoded as UTF-8) keyed by path; relative paths are relative to
+            the current directory
+
+    Attributes:
+        files (dict): content and modification time keyed by absolute path
+
+    Example:
+        >>> storage = MemoryStorage({'site/index.html.mako': u'Hi'})
+        >>> [(osp.relpath(src), files) for src, _, files
+        ...  in storage.walk('site')]
+        [('site', ['index.html.mako'])]
+        >>> _ = storage.write(osp.abspath('site/out/index.html'), 'Hi')
+        >>> storage.isdir(osp.abspath('site/out'))
+        True
+        >>> storage.read(osp.abspath('site/out/index.html'))
+        'Hi'
+        >>> storage.remove(osp.abspath('site/out/index.html'))
+        >>> storage.isdir(osp.abspath('site/out'))
+        False
+    '''
+
+    local = False
+
+    def __init__(self, files=None):
+        '''Construct a storage.'''
+        self.files = {}  # path => (content, mtime)
+        self.dirs = set([])  # directories created explicitly
+        self._parents = collections.Counter()  # path => files and dirs below
+        self._mtimes = {}  # directory => when an entry was added or removed
+        self.lock = threading.RLock()
+        for path, content in (files or {}).items():
+            self.write(path, content)
+
+    def _count(self, path, step, mtime=None):
+        '''Adds to the number of entries below each parent of a path and
+        updates the modification time of its directory (default: now).'''
+        parent = osp.dirname(path)
+        self._mtimes[parent] = time.time() if mtime is None else \
+            max(mtime, self._mtimes.get(parent, 0))
+        while parent != path:
+            self._parents[parent] += step
+            if self._parents[parent] <= 0:
+                del self._parents[parent]
+            path, parent = parent, osp.dirname(parent)
+
+    def _store(self, path, entry, added=None):
+        '''Sets the content and modification time of a file; ``added`` is
+        when a new file was added to its directory (default: now).'''
+        with self.lock:
+            if path not in self.files:
+                self._count(path, 1, added)
+            self.files[path] = entry
+
+    def _discard(self, path):
+        '''Forgets a file.'''
+        with self.lock:
+            if self.files.pop(path, None) is not None:
+                self._count(path, -1)
+
+    def _error(self, error, path):
+        '''Returns an error for a path like the ones :py:mod:`os` raises.'''
+        return OSError(error, os.strerror(error), path)
+
+    def _get(self, path):
+        '''Returns the content and modification time of a file.'''
+        try:
+            return self.files[osp.abspath(path)]
+        except KeyError:
+            raise self._error(errno.ENOENT, path)
+
+    def walk(self, top):
+        '''Generates the directories below a directory (see
+        :py:func:`os.walk`).
+
+        Args:
+            top (str): directory to walk
+
+        Yields:
+            tuple: path of the directory, names of its subdirectories (which
+            may be modified in place to skip them), and names of its files
+        '''
+        top = osp.abspath(top)
+        tree = collections.defaultdict(lambda: (set([]), set([])))
+        with self.lock:
+            paths = [(path, True) for path in self.files] + \
+                    [(path, False) for path in self.dirs]
+
+        for path, is_file in paths:
+            if not path.startswith(top + os.sep):
+                continue
+            if is_file:
+                tree[osp.dirname(path)][1].add(osp.basename(path))
+                path = osp.dirname(path)
+            while path != top:
+                tree[osp.dirname(path)][0].add(osp.basename(path))
+                path = osp.dirname(path)
+
+        if top not in tree and not self.isdir(top):
+            return
+
+        pending = [top]
+        while pending:
+            src = pending.pop()
+            dirs, files = tree[src]
+            dirs = sorted(dirs)
+            yield src, dirs, sorted(files)
+            pending.extend(osp.join(src, name) for name in reversed(dirs))
+
+    def isfile(self, path):
+        '''Returns True if a file exists.'''
+        return osp.abspath(path) in self.files
+
+    def isdir(self, path):
+        '''Returns True if a directory exists.'''
+        path = osp.abspath(path)
+        with self.lock:
+            return path in self.dirs or path in self._parents
+
+    def getmtime(self, path):
+        '''Returns the modification time of a file or directory (when an
+        entry was last added to or removed from it).'''
+        path = osp.abspath(path)
+        with self.lock:
+            if path not in self.files and self.isdir(path):
+                return self._mtimes.get(path, 0)
+        return self._get(path)[1]
+
+    def getsize(self, path):
+        '''Returns the size of a file in bytes.'''
+        return len(self._get(path)[0])
+
+    def listdir(self, path):
+        '''Returns the names of the entries in a directory.'''
+        path = osp.abspath(path)
+        if not self.isdir(path):
+            raise self._error(errno.ENOENT, path)
+
+        prefix = path.rstrip(os.sep) + os.sep
+        with self.lock:
+            items = list(self.files) + list(self.dirs)
+        return sorted(set(item[len(prefix):].split(os.sep)[0]
+                          for item in items if item.startswith(prefix)))
+
+    def read(self, path):
+        '''Returns the content of a file.
+
+        Args:
+            path (str): file to read
+
+        Returns:
+            str: content (bytes)
+        '''
+        return self._get(path)[0]
+
+    def write(self, path, data, mtime=None):
+        '''Writes a file.
+
+        Args:
+            path (str): file to write
+            data (str): content (bytes or unicode, which is encoded as UTF-8)
+            mtime (float, optional): modification time; default is now
+
+        Returns:
+            str: ``path``
+        '''
+        if isinstance(data, unicode):
+            data = data.encode('utf-8')
+        self._store(osp.abspath(path),
+                    (data, time.time() if mtime is None else mtime))
+        return path
+
+    def makedirs(self, path):
+        '''Creates a directory.'''
+        path = osp.abspath(path)
+        with self.lock:
+            if path not in self.dirs:
+                self.dirs.add(path)
+                self._count(path, 1)
+
+    def remove(self, path):
+        '''Removes a file.'''
+        with self.lock:
+            self._get(path)
+            self._discard(osp.abspath(path))
+
+    def rmdir(self, path):
+        '''Removes an empty directory.'''
+        path = osp.abspath(path)
+        with self.lock:
+            if self.listdir(path):
+                raise self._error(errno.ENOTEMPTY, path)
+            if path in self.dirs:
+                self.dirs.discard(path)
+                self._count(path, -1)
+
+    def touch(self, path, mtime=None):
+        '''Sets the modification time of a file (default: now).'''
+        with self.lock:
+            content, _ = self._get(path)
+            self._store(osp.abspath(path),
+                        (content, time.time() if mtime is None else mtime))
+
+    def outdated(self, src, dest):
+        '''Returns True if a copy of a file is missing or out of date.'''
+        if not self.isfile(dest):
+            return True
+        (src_data, src_mtime), (dest_data, dest_mtime) = \
+            self._get(src), self._get(dest)
+        return (len(src_data) != len(dest_data) or
+                int(src_mtime) > int(dest_mtime))
+
+    def link(self, src, dest):
+        '''Copies a file (and its modification time) to a new path.'''
+        content, mtime = self._get(src)
+        return self.write(dest, content, mtime)
+
+    def flush(self):
+        '''Saves pending changes; there are none in memory.
+
+        Returns:
+            bool: False
+        '''
+        return False
+
+
+def is_archive(path):
+    '''Returns True if a path names a zip or tar archive (by its extension).
+
+    Args:
+        path (str): path to check
+
+    Returns:
+        bool: True if the path names an archive
+
+    Examples:
+        >>> is_archive('site.tar.gz') and is_archive('SITE.ZIP')
+        True
+        >>> is_archive('test/example1')
+        False
+    '''
+    return path.lower().endswith(ARCHIVE_EXTS) and not osp.isdir(path)
+
+
+def find_archive(path):
+    '''Returns the archive that contains (or is) a path.
+
+    Args:
+        path (str): path that may be inside an archive, e.g.
+            ``site.zip/src`` for the ``src`` directory of ``site.zip``
+
+    Returns:
+        str: absolute path of the archive; None if the path is not in one
+
+    Examples:
+        >>> find_archive('build/site.zip/src') == osp.abspath('build/site.zip')
+        True
+        >>> find_archive('test/example1') is None
+        True
+    '''
+    path = osp.abspath(path)
+    while not osp.isdir(path):
+        if is_archive(path):
+            return path
+        parent = osp.dirname(path)
+        if parent == path:
+            break
+        path = parent
+    return None
+
+
+def open_storage(path, out=None):
+    '''Returns the storage for rendering a path into an output directory.
+
+    Either path may be (or be inside) an archive; an output path that does
+    not exist yet is written as a new archive if it has an archive extension.
+
+    Args:
+        path (str): rendered directory
+        out (str, optional): output directory
+
+    Returns:
+        MountStorage: archives mounted at their paths over the local disk; a
+        :py:class:`~pageit.storage.DiskStorage` if neither path is in an
+        archive
+
+    Examples:
+        >>> isinstance(open_storage('test/example1'), DiskStorage)
+        True
+        >>> storage = open_storage('test/example1', 'build.tgz')
+        >>> sorted(osp.basename(root) for root in storage.mounts)
+        ['build.tgz']
+    '''
+    mounts = {}
+    for item in [path, out]:
+        archive = item and find_archive(item)
+        if archive and archive not in mounts:
+            mounts[archive] = ArchiveStorage(archive)
+    return MountStorage(mounts) if mounts else DiskStorage()
+
+
+class ArchiveStorage(MemoryStorage):
+    '''Files in a zip or tar archive.
+
+    The archive is memory-mapped and read in place: nothing is extracted, and
+    only the members that are read are decompressed (compressed tar archives
+    cannot be read out of order, so their members are read into memory when
+    the archive is opened). Files that are written are kept in memory until
+    :py:meth:`~pageit.storage.ArchiveStorage.save` writes a new archive.
+
+    Args:
+        path (str): archive to read (or create); a zip file, or a tar file
+            that may be compressed with gzip or bzip2
+        root (str, optional): directory at which the members of the archive
+            are found; default is the path of the archive itself (so the
+            member ``index.html.mako`` of ``site.zip`` is at
+            ``site.zip/index.html.mako``)
+
+    Attributes:
+        dirty (bool): True if files were written, touched, or removed since
+            the archive was read
+
+    Example:
+        >>> import shutil, tempfile
+        >>> tmp = tempfile.mkdtemp()
+        >>> path = osp.join(tmp, 'site.zip')
+        >>> storage = ArchiveStorage(path)
+        >>> _ = storage.write(osp.join(path, 'src', 'a.txt'), 'Hi')
+        >>> storage.save()
+        True
+        >>> storage = ArchiveStorage(path)
+        >>> [(osp.relpath(src, path), files) for src, _, files
+        ...  in storage.walk(osp.join(path, 'src'))]
+        [('src', ['a.txt'])]
+        >>> storage.read(osp.join(path, 'src', 'a.txt'))
+        'Hi'
+        >>> storage.close()
+        >>> shutil.rmtree(tmp)
+    '''
+
+    def __init__(self, path, root=None):
+        '''Construct a storage for an archive.'''
+        MemoryStorage.__init__(self)
+        self.path = osp.abspath(path)
+        self.root = osp.abspath(root or path)
+        self.members = {}  # path => (member, size) of files not yet read
+        self.dirty = False
+        self._archive = self._map = self._stream = None
+        self.open()
+
+    def open(self):
+        '''Reads the list of members of the archive (if it exists).
+
+        Returns:
+            ArchiveStorage: for method chaining
+        '''
+        self.close()
+        if not osp.isfile(self.path) or not osp.getsize(self.path):
+            return self
+
+        self._stream = open(self.path, 'rb')
+        self._map = _MappedFile(mmap.mmap(self._stream.fileno(), 0,
+                                          access=mmap.ACCESS_READ))
+        with self.lock:
+            if zipfile.is_zipfile(self._map):
+                self._archive = zipfile.ZipFile(self._map)
+                for info in self._archive.infolist():
+                    if not info.filename.endswith('/'):
+                        mtime = time.mktime(info.date_time + (0, 0, -1))
+                        self._add(info.filename, info, info.file_size, mtime)
+            else:
+                self._map.seek(0)
+                self._archive = tarfile.open(fileobj=self._map)
+                compressed = self._archive.fileobj is not self._map
+                for info in self._archive:
+                    if info.isfile():
+                        self._add(info.name, info, info.size, info.mtime,
+                                  compressed)
+        return self
+
+    def close(self):
+        '''Releases the archive; files that were not read are forgotten.'''
+        with self.lock:
+            for path in self.members:
+                if self.files.get(path, ('',))[0] is None:
+                    self._discard(path)
+            self.members.clear()
+            for item in (self._archive, self._map, self._stream):
+                if item is not None:
+                    item.close()
+            self._archive = self._map = self._stream = None
+
+    def _add(self, name, info, size, mtime, load=False):
+        '''Adds a member of the archive.'''
+        path = osp.normpath(osp.join(self.root, *name.split('/')))
+        if not path.startswith(self.root + os.sep):  # outside the archive
+            return
+        self.members[path] = (info, size)
+        self._store(path, (self._read(info) if load else None, mtime), mtime)
+
+    def _read(self, info):
+        '''Returns the content of a member of the archive.'''
+        with self.lock:
+            if isinstance(self._archive, zipfile.ZipFile):
+                return self._archive.read(info)
+            return self._archive.extractfile(info).read()
+
+    def _get(self, path):
+        '''Returns the content and modification time of a file.'''
+        path = osp.abspath(path)
+        content, mtime = MemoryStorage._get(self, path)
+        if content is None:
+            content = self._read(self.members[path][0])
+        return content, mtime
+
+    def getsize(self, path):
+        '''Returns the size of a file in bytes.'''
+        path = osp.abspath(path)
+        with self.lock:
+            content, _ = MemoryStorage._get(self, path)
+            return self.members[path][1] if content is None else len(content)
+
+    def write(self, path, data, mtime=None):
+        '''Writes a file (in memory until the archive is saved).'''
+        MemoryStorage.write(self, path, data, mtime)
+        self.dirty = True
+        return path
+
+    def makedirs(self, path):
+        '''Creates a directory.'''
+        if not self.isdir(path):
+            MemoryStorage.makedirs(self, path)
+            self.dirty = True
+
+    def remove(self, path):
+        '''Removes a file.'''
+        path = osp.abspath(path)
+        with self.lock:
+            if path not in self.files:
+                raise self._error(errno.ENOENT, path)
+            self._discard(path)
+            self.dirty = True
+
+    def touch(self, path, mtime=None):
+        '''Sets the modification time of a file (default: now).'''
+        path = osp.abspath(path)
+        with self.lock:
+            content, _ = MemoryStorage._get(self, path)
+            self._store(path, (content, time.time() if mtime is None
+                               else mtime))
+            self.dirty = True
+
+    def save(self, path=None):
+        '''Writes the files below the root to an archive.
+
+        The archive is written to a temporary file that then replaces it.
+        Its type is chosen by its extension: ``.zip`` archives are
+        compressed with deflate, and tar archives with gzip (``.tar.gz``,
+        ``.tgz``), bzip2 (``.tar.bz2``, ``.tbz2``), or not at all.
+
+        Args:
+            path (str, optional): archive to write; by default, the archive
+                that was read is replaced if files were changed
+
+        Returns:
+            bool: True if the archive was written
+        '''
+        path = osp.abspath(path or self.path)
+        if path == self.path and not self.dirty:
+            return False
+
+        with self.lock:
+            names = sorted(item for item in self.files
+                           if item.startswith(self.root + os.sep))
+            fd, tmp = tempfile.mkstemp(prefix='.' + osp.basename(path) + '-',
+                                       dir=osp.dirname(path))
+            os.close(fd)
+            try:
+                self._save(tmp, path, names)
+                os.chmod(tmp, os.stat(path).st_mode & 0777
+                         if osp.isfile(path) else 0644)
+                if path == self.path:
+                    self.close()
+                os.rename(tmp, path)
+            except (IOError, OSError, tarfile.TarError, zipfile.BadZipfile):
+                os.remove(tmp)
+                raise
+
+            if path == self.path:
+                self.dirty = False
+                self.open()
+        return True
+
+    def _save(self, tmp, path, names):
+        '''Writes the archive to a temporary file.'''
+        if path.lower().endswith('.zip'):
+            with zipfile.ZipFile(tmp, 'w', zipfile.ZIP_DEFLATED) as archive:
+                for name in names:
+                    content, mtime = self._get(name)
+                    info = zipfile.ZipInfo(_member(self.root, name),
+                                           time.localtime(mtime)[:6])
+                    info.compress_type = zipfile.ZIP_DEFLATED
+                    info.external_attr = 0644 << 16
+                    archive.writestr(info, content)
+            return
+
+        mode = dict(TAR_MODES).get(osp.splitext(path.lower())[1], 'w')
+        with tarfile.open(tmp, mode) as archive:
+            for name in names:
+                content, mtime = self._get(name)
+                info = tarfile.TarInfo(_member(self.root, name))
+                info.size, info.mtime, info.mode = len(content), mtime, 0644
+                archive.addfile(info, io.BytesIO(content))
+
+    def flush(self):
+        '''Saves the archive if files were changed.
+
+        Returns:
+            bool: True if the archive was written
+        '''
+        return self.save()
+
+
+class _MappedFile(object):
+    '''File-like view of a memory-mapped file whose ``read()`` (like a
+    file's) reads to the end when no size is given.'''
+
+    def __init__(self, data):
+        '''Construct the view.'''
+        self.data = data
+
+    def read(self, size=-1):
+        '''Returns up to ``size`` bytes (default: the rest of the file).'''
+        if size is None or size < 0:
+            size = len(self.data) - self.data.tell()
+        return self.data.read(size)
+
+    def __getattr__(self, name):
+        '''Returns an attribute of the memory map.'''
+        return getattr(self.data, name)
+
+
+def _member(root, path):
+    '''Returns the name of the archive member for a path.'''
+    return osp.relpath(path, root).replace(os.sep, '/')
+
+
+class MountStorage(object):
+    '''Storages mounted at directories of the local disk.
+
+    Each path is handled by the storage mounted at its nearest parent (or the
+    default storage if there is none).
+
+    Args:
+        mounts (dict): storages keyed by the directory at which they are
+            mounted
+        default (DiskStorage, optional): storage for the other paths;
+            default is the local disk
+
+    Example:
+        >>> storage = MountStorage({'site': MemoryStorage({'site/a': 'Hi'})})
+        >>> storage.isfile('site/a') and storage.isfile('setup.py')
+        True
+        >>> _ = storage.link(osp.abspath('site/a'), osp.abspath('site/b'))
+        >>> storage.read('site/b')
+        'Hi'
+    '''
+
+    def __init__(self, mounts, default=None):
+        '''Construct a storage from its mounts.'''
+        self.mounts = dict((osp.abspath(path), storage)
+                           for path, storage in mounts.items())
+        self.default = default or DiskStorage()
+        self.local = all(storage.local for storage in
+                         self.mounts.values() + [self.default])
+
+    def route(self, path):
+        '''Returns the storage that handles a path.'''
+        path = osp.abspath(path)
+        while True:
+            if path in self.mounts:
+                return self.mounts[path]
+            parent = osp.dirname(path)
+            if parent == path:
+                return self.default
+            path = parent
+
+    def walk(self, top):
+        '''Generates the directories below a directory (see
+        :py:func:`os.walk`).'''
+        return self.route(top).walk(top)
+
+    def isfile(self, path):
+        '''Returns True if a file exists.'''
+        return self.route(path).isfile(path)
+
+    def isdir(self, path):
+        '''Returns True if a directory exists.'''
+        return self.route(path).isdir(path)
+
+    def getmtime(self, path):
+        '''Returns the modification time of a file.'''
+        return self.route(path).getmtime(path)
+
+    def getsize(self, path):
+        '''Returns the size of a file in bytes.'''
+        return self.route(path).getsize(path)
+
+    def listdir(self, path):
+        '''Returns the names of the entries in a directory.'''
+        return self.route(path).listdir(path)
+
+    def read(self, path):
+        '''Returns the content of a file.'''
+        return self.route(path).read(path)
+
+    def write(self, path, data):
+        '''Writes a file.'''
+        return self.route(path).write(path, data)
+
+    def makedirs(self, path):
+        '''Creates a directory and its missing parents.'''
+        self.route(path).makedirs(path)
+
+    def remove(self, path):
+        '''Removes a file.'''
+        self.route(path).remove(path)
+
+    def rmdir(self, path):
+        '''Removes an empty directory.'''
+        self.route(path).rmdir(path)
+
+    def touch(self, path, mtime=None):
+        '''Sets the modification time of a file (default: now).'''
+        self.route(path).touch(path, mtime)
+
+    def outdated(self, src, dest):
+        '''Returns True if a copy of a file is missing or out of date.'''
+        source, target = self.route(src), self.route(dest)
+        if source is target:
+            return source.outdated(src, dest)
+        if not target.isfile(dest):
+            return True
+        return (source.getsize(src) != target.getsize(dest) or
+                int(source.getmtime(src)) > int(target.getmtime(dest)))
+
+    def link(self, src, dest):
+        '''Links (or copies) a file (and its modification time) to a new
+        path.'''
+        source, target = self.route(src), self.route(dest)
+        if source is target:
+            return source.link(src, dest)
+        target.write(dest, source.read(src))
+        target.touch(dest, source.getmtime(src))
+        return dest
+
+    def flush(self):
+        '''Saves pending changes of every mounted storage.
+
+        Returns:
+            bool: True if any storage saved changes
+        '''
+        return any([storage.flush() for storage in self.mounts.values()])
@@ -1,21 +1,29 @@
 #!/usr/bin/python
 # coding: utf-8
 
-'''Tools for changing, serving, and watching paths.'''
+'''Tools for changing, serving, and watching paths.
+
+The HTTP server and watchdog_ modules are only imported when serving or
+watching starts.
+
+.. _watchdog: http://pythonhosted.org/watchdog/
+'''
 
 # Native
 from contextlib import contextmanager
 from os import path as osp
-from SimpleHTTPServer import SimpleHTTPRequestHandler
-from SocketServer import TCPServer
+import errno
+import gzip
+import json
 import logging
 import os
+import Queue
+import re
+import shutil
+import sys
+import threading
 import time
 
-# 3rd Party
-from watchdog.events import FileSystemEventHandler
-from watchdog.observers import Observer
-
 # Package
 try:
     from pageit.namespace import Namespace
@@ -24,7 +32,11 @@ except ImportError:  # pragma: no cover
 
 DEFAULT = Namespace(
     log=logging.getLogger('com.metaist.pageit.tools'),
-    port=80
+    port=80,
+    delay=0.05,  # seconds to wait for related changes before building
+    hold=30,  # seconds to hold a request while pages are rebuilt
+    ping=15,  # seconds between keep-alive messages to live-reload clients
+    events='/__pageit__/events'  # URL of the live-reload event stream
 )
 
 MSG_PRE = '%-9s '
@@ -35,9 +47,31 @@ MSG = Namespace(
     T_WATCH=MSG_PRE + '%s',
 
     CHANGE=MSG_PRE + 'change in <%s>',
-    PATH_ERR=MSG_PRE + 'cannot find <%s>'
+    PATH_ERR=MSG_PRE + 'cannot find <%s>',
+    BUILD_ERR=MSG_PRE + 'build failed',
+    HOLD_ERR=MSG_PRE + 'serving <%s> before the build finished'
 )
 
+# sentinel that stops a BuildQueue's worker
+_STOP = object()
+
+# client for the live-reload event stream; reloads when its page (or an asset
+# that any page might use) was rebuilt
+LIVE_SCRIPT = '''<script>(function () {
+  var source = new EventSource('%s');
+  source.onmessage = function (event) {
+    var paths = JSON.parse(event.data), here = location.pathname;
+    if ('/' === here.slice(-1)) { here += 'index.html'; }
+    for (var i = 0; i < paths.length; i++) {
+      if (paths[i] === here || !/\\.html?$/.test(paths[i])) {
+        source.close();
+        location.reload();
+        return;
+      }
+    }
+  };
+}());</script>''' % DEFAULT.events
+
 
 @contextmanager
 def pushd(path):
@@ -61,23 +95,521 @@ def pushd(path):
     os.chdir(oldpath)
 
 
-def serve(path, port=DEFAULT.port, log=None):  # pragma: no cover
+def outdated(src, dest):
+    '''Returns True if a copy of a file is missing or out of date.
+
+    A copy is up to date if it is a hard link to the file or if it has the
+    same size and is at least as new.
+
+    Args:
+        src (str): path to the original file
+        dest (str): path to the copy
+
+    Returns:
+        bool: True if ``dest`` needs to be updated
+
+    Examples:
+        >>> outdated('setup.py', 'fake.py')
+        True
+        >>> outdated('setup.py', 'setup.py')
+        False
+
+    .. versionadded:: 0.3.0
+    '''
+    if not osp.isfile(dest):
+        return True
+
+    src_stat, dest_stat = os.stat(src), os.stat(dest)
+    if (src_stat.st_dev, src_stat.st_ino) == (dest_stat.st_dev,
+                                              dest_stat.st_ino):
+        return False  # same file
+    return (src_stat.st_size != dest_stat.st_size or
+            int(src_stat.st_mtime) > int(dest_stat.st_mtime))
+
+
+def makedirs(path):
+    '''Create a directory and its missing parents.
+
+    Unlike :py:func:`os.makedirs`, a directory that already exists (e.g.
+    because another render worker just created it) is not an error.
+
+    Args:
+        path (str): directory to create
+
+    Returns:
+        str: ``path``
+
+    Examples:
+        >>> makedirs('test') == 'test'
+        True
+
+    .. versionadded:: 0.3.0
+    '''
+    try:
+        os.makedirs(path)
+    except OSError as ex:
+        if ex.errno != errno.EEXIST or not osp.isdir(path):
+            raise
+    return path
+
+
+def link(src, dest):
+    '''Hard-link a file to a new path, copying it if linking fails.
+
+    An existing file at ``dest`` is replaced. Missing parent directories are
+    created.
+
+    Args:
+        src (str): path to the original file
+        dest (str): path to the link or copy
+
+    Returns:
+        str: ``dest``
+
+    .. versionadded:: 0.3.0
+    '''
+    if osp.isfile(dest):
+        os.remove(dest)
+    else:
+        makedirs(osp.dirname(dest))
+
+    try:
+        os.link(src, dest)
+    except (AttributeError, OSError):  # no hard links (e.g. across devices)
+        shutil.copy2(src, dest)
+    return dest
+
+
+class BuildQueue(object):
+    '''Runs builds on a background thread in response to changes.
+
+    Changed paths are queued with :py:meth:`~pageit.tools.BuildQueue.put`
+    (e.g. by a :py:class:`~pageit.tools.Watcher`) and passed in batches to the
+    callback on a single worker thread, so a burst of changes results in one
+    build and the watcher is never blocked by rendering.
+    :py:meth:`~pageit.tools.BuildQueue.wait` blocks until all queued changes
+    have been built.
+
+    Args:
+        callback (callable): function to run with a list of changed paths
+        delay (float, optional): seconds to wait for related changes before
+            building
+        log (logging.Logger, optional): logger to use
+
+    Example:
+        >>> builds = []
+        >>> with BuildQueue(builds.append) as queue:
+        ...     queue.put('a.mako').put('b.mako').wait()
+        True
+        >>> sorted(path for batch in builds for path in batch)
+        ['a.mako', 'b.mako']
+
+    .. versionadded:: 0.3.0
+    '''
+
+    _context = '[BUILD]'
+
+    def __init__(self, callback, delay=DEFAULT.delay, log=None):
+        '''Construct an idle build queue.'''
+        self.callback = callback
+        self.delay = delay
+        self.log = log or DEFAULT.log
+        self.queue = Queue.Queue()
+        self.idle = threading.Event()
+        self.idle.set()
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def __enter__(self):
+        '''Enter a context.
+
+        Returns:
+            BuildQueue: this queue
+        '''
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        '''Exit a context.'''
+        self.stop()
+
+    def put(self, path=None):
+        '''Queue a change.
+
+        Args:
+            path (str): path that changed
+
+        Returns:
+            BuildQueue: for method chaining
+        '''
+        with self.lock:
+            self.idle.clear()
+            self.queue.put(path)
+        return self
+
+    def wait(self, timeout=None):
+        '''Wait until all queued changes have been built.
+
+        Args:
+            timeout (float, optional): maximum number of seconds to wait
+
+        Returns:
+            bool: True if there are no pending changes
+        '''
+        return self.idle.wait(timeout)
+
+    def start(self):
+        '''Start the worker thread.
+
+        Returns:
+            BuildQueue: for method chaining
+        '''
+        if self.thread:  # already started
+            return self
+
+        self.thread = threading.Thread(target=self._work, name='pageit-build')
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        '''Build any queued changes and stop the worker thread.
+
+        Returns:
+            BuildQueue: for method chaining
+        '''
+        if not self.thread:  # already stopped
+            return self
+
+        self.queue.put(_STOP)
+        self.thread.join()
+        self.thread = None
+        return self
+
+    def _work(self):
+        '''Build batches of changes until stopped.'''
+        stop = False
+        while not stop:
+            paths = [self.queue.get()]
+            if paths[0] is not _STOP:
+                time.sleep(self.delay)  # let related changes arrive
+
+            while True:
+                try:
+                    paths.append(self.queue.get_nowait())
+                except Queue.Empty:
+                    break
+
+            stop = _STOP in paths
+            paths = [path for path in paths if path is not _STOP]
+            if paths:
+                try:
+                    self.callback(paths)
+                except Exception:  # pylint: disable=W0703
+                    self.log.exception(MSG.BUILD_ERR, self._context)
+
+            with self.lock:
+                if self.queue.empty():
+                    self.idle.set()
+
+
+def memory_usage():
+    '''Returns how much memory this process is using.
+
+    On Linux, this is the current resident set size; elsewhere, it is the
+    peak resident set size.
+
+    Returns:
+        float: megabytes; None if it cannot be measured
+
+    Example:
+        >>> memory_usage() > 0
+        True
+
+    .. versionadded:: 0.3.0
+    '''
+    try:
+        with open('/proc/self/statm') as stream:
+            pages = int(stream.read().split()[1])
+        return pages * os.sysconf('SC_PAGE_SIZE') / 1048576.0
+    except (IOError, OSError, ValueError, IndexError):
+        pass
+
+    try:
+        import resource
+    except ImportError:  # pragma: no cover
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1048576.0 if 'darwin' == sys.platform else 1024.0)
+
+
+def gzip_file(path, dest=None, level=9):
+    '''Write a gzip-compressed copy of a file.
+
+    The copy is reproducible (no timestamp in its header) and is given the
+    same modification time as the original so that
+    :py:func:`~pageit.tools.compressed` can tell whether it is up to date.
+
+    Args:
+        path (str): path to the file
+        dest (str, optional): path to the compressed copy; default is
+            ``path`` with ``.gz`` appended
+        level (int, optional): compression level; default is 9
+
+    Returns:
+        str: path to the compressed copy
+
+    .. versionadded:: 0.3.0
+    '''
+    dest = dest or path + '.gz'
+    with open(path, 'rb') as stream:
+        content = stream.read()
+    with open(dest, 'wb') as raw:
+        with gzip.GzipFile(filename='', mode='wb', compresslevel=level,
+                           fileobj=raw, mtime=0) as out:
+            out.write(content)
+
+    mtime = osp.getmtime(path)
+    os.utime(dest, (mtime, mtime))
+    return dest
+
+
+def compressed(path):
+    '''Returns the up-to-date gzip-compressed copy of a file, if any.
+
+    Args:
+        path (str): path to the file
+
+    Returns:
+        str: path to the compressed copy; None if it is missing or older than
+        the file
+
+    Example:
+        >>> compressed('setup.py') is None
+        True
+
+    .. versionadded:: 0.3.0
+    '''
+    dest = path + '.gz'
+    if osp.isfile(path) and osp.isfile(dest) and \
+            int(osp.getmtime(dest)) >= int(osp.getmtime(path)):
+        return dest
+    return None
+
+
+def inject_script(html, script=LIVE_SCRIPT):
+    '''Insert a script at the end of an HTML document's body.
+
+    Args:
+        html (str): HTML document
+        script (str, optional): script tag to insert; default is the
+            live-reload client
+
+    Returns:
+        str: HTML with the script inserted before ``</body>`` or, if there is
+        no closing body tag, at the end
+
+    Examples:
+        >>> inject_script('<body>Hi</body>', '<script></script>')
+        '<body>Hi<script></script></body>'
+        >>> inject_script('Hi', '<script></script>')
+        'Hi<script></script>'
+
+    .. versionadded:: 0.3.0
+    '''
+    matches = list(re.finditer(r'</body\s*>', html, re.IGNORECASE))
+    if not matches:
+        return html + script
+    pos = matches[-1].start()
+    return html[:pos] + script + html[pos:]
+
+
+class LiveReload(object):
+    '''Pushes the names of rebuilt outputs to connected browsers.
+
+    Each connection to the preview server's event stream
+    :py:meth:`~pageit.tools.LiveReload.subscribe`\ s to receive the lists
+    passed to :py:meth:`~pageit.tools.LiveReload.publish`.
+
+    Example:
+        >>> live = LiveReload()
+        >>> client = live.subscribe()
+        >>> _ = live.publish(['index.html', 'css/site.css'])
+        >>> client.get_nowait()
+        ['/index.html', '/css/site.css']
+        >>> _ = live.unsubscribe(client).publish(['index.html'])
+        >>> client.empty()
+        True
+
+    .. versionadded:: 0.3.0
+    '''
+
+    def __init__(self):
+        '''Construct a channel without subscribers.'''
+        self.clients = []
+        self.lock = threading.Lock()
+
+    def subscribe(self):
+        '''Add a subscriber.
+
+        Returns:
+            Queue.Queue: queue that receives lists of URL paths
+        '''
+        client = Queue.Queue()
+        with self.lock:
+            self.clients.append(client)
+        return client
+
+    def unsubscribe(self, client):
+        '''Remove a subscriber.
+
+        Args:
+            client (Queue.Queue): queue returned by
+                :py:meth:`~pageit.tools.LiveReload.subscribe`
+
+        Returns:
+            LiveReload: for method chaining
+        '''
+        with self.lock:
+            if client in self.clients:
+                self.clients.remove(client)
+        return self
+
+    def publish(self, names):
+        '''Send the names of rebuilt outputs to all subscribers.
+
+        Args:
+            names (list): output paths relative to the served directory
+
+        Returns:
+            LiveReload: for method chaining
+        '''
+        if not names:
+            return self
+
+        paths = ['/' + name.replace(os.sep, '/').lstrip('/') for name in names]
+        with self.lock:
+            for client in self.clients:
+                client.put(paths)
+        return self
+
+
+# pylint: disable=R0913
+def serve(path, port=DEFAULT.port, log=None, queue=None, live=None,
+          inject=False):  # pragma: no cover
     '''Serve a path on a given port.
 
     This function will change the working directory to the path and host it on
     the port specified. If `path` is not supplied, it returns immediately.
 
+    Requests are handled on separate threads. If a build queue is given,
+    requests are held until its pending changes have been built so that
+    pages are never served mid-render.
+
+    If a live-reload channel is given, browsers can listen for rebuilt
+    outputs as server-sent events at ``/__pageit__/events``. With ``inject``,
+    a script that reloads the page when it (or a non-HTML asset) is rebuilt
+    is added to every HTML page served.
+
+    Files with an up-to-date ``.gz`` copy (see
+    :py:func:`~pageit.tools.gzip_file`) are served compressed to clients
+    that accept gzip.
+
     Args:
         path (str): path to host
         port (int, optional): port on which to host; default is 80.
         log (logging.Logger, optional):  logger to use
+        queue (BuildQueue, optional): builds to wait for before responding
+        live (LiveReload, optional): channel for rebuilt outputs
+        inject (bool, optional): add the live-reload script to HTML pages
+
+    .. versionchanged:: 0.3.0
+       Added threaded request handling, pre-compressed files, and the
+       ``queue``, ``live``, and ``inject`` arguments.
     '''
+    from SimpleHTTPServer import SimpleHTTPRequestHandler
+    from SocketServer import ThreadingMixIn, TCPServer
+    from StringIO import StringIO
+
     _context = '[SERVE]'
     assert osp.isdir(path), MSG.PATH_ERR % (_context, path)
 
     log = log or DEFAULT.log
+
+    class Handler(SimpleHTTPRequestHandler):
+        '''Holds requests while pages are being rebuilt and streams
+        live-reload events.'''
+
+        def do_GET(self):
+            '''Serve a file or the live-reload event stream.'''
+            if live and DEFAULT.events == self.path.split('?')[0]:
+                self.send_events()
+            else:
+                SimpleHTTPRequestHandler.do_GET(self)
+
+        def send_events(self):
+            '''Stream rebuilt outputs until the browser disconnects.'''
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.send_header('Cache-Control', 'no-cache')
+            self.end_headers()
+
+            client = live.subscribe()
+            try:
+                while True:
+                    try:
+                        paths = client.get(timeout=DEFAULT.ping)
+                        self.wfile.write('data: %s\n\n' % json.dumps(paths))
+                    except Queue.Empty:
+                        self.wfile.write(': ping\n\n')  # keep-alive comment
+                    self.wfile.flush()
+            except (IOError, OSError):  # browser went away
+                pass
+            finally:
+                live.unsubscribe(client)
+
+        def send_head(self):
+            '''Wait for pending builds, then send headers for a page, its
+            live-reload version, or its compressed copy.'''
+            if queue and not queue.wait(DEFAULT.hold):
+                log.warning(MSG.HOLD_ERR, _context, self.path)
+
+            page = self.translate_path(self.path)
+            if osp.isdir(page) and self.path.split('?')[0].endswith('/'):
+                page = osp.join(page, 'index.html')
+            if live and inject and osp.isfile(page) and \
+                    page.endswith(('.html', '.htm')):
+                with open(page, 'rb') as stream:
+                    content = inject_script(stream.read())
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/html')
+                self.send_header('Content-Length', str(len(content)))
+                self.send_header('Cache-Control', 'no-cache')
+                self.end_headers()
+                return StringIO(content)
+
+            packed = compressed(page)
+            if packed and 'gzip' in self.headers.get('Accept-Encoding', ''):
+                stream = open(packed, 'rb')
+                self.send_response(200)
+                self.send_header('Content-Type', self.guess_type(page))
+                self.send_header('Content-Encoding', 'gzip')
+                self.send_header('Content-Length',
+                                 str(os.fstat(stream.fileno()).st_size))
+                self.send_header('Vary', 'Accept-Encoding')
+                self.send_header('Last-Modified', self.date_time_string(
+                    int(osp.getmtime(page))))
+                self.end_headers()
+                return stream
+
+            return SimpleHTTPRequestHandler.send_head(self)
+
+    class Server(ThreadingMixIn, TCPServer):
+        '''Handles each request on its own thread.'''
+        allow_reuse_address = True
+        daemon_threads = True
+
     with pushd(path):
-        httpd = TCPServer(('', int(port)), SimpleHTTPRequestHandler)
+        httpd = Server(('', int(port)), Handler)
         log.info(MSG.T_SERVE, _context, path, port)
         try:
             httpd.serve_forever()
@@ -112,13 +644,17 @@ def watch(path=None, callback=None, log=None):  # pragma: no cover
     watcher.stop()
 
 
-class Watcher(FileSystemEventHandler):
+class Watcher(object):
     '''Handler for file changes.
 
     Args:
         path (str): path to watch
         callback (callable): function to run when files change
         log (logging.Logger, optional): logger to use
+
+    .. versionchanged:: 0.3.0
+       No longer a subclass of ``watchdog.events.FileSystemEventHandler`` so
+       that watchdog is only imported when the watcher starts.
     '''
 
     _context = '[WATCH]'
@@ -145,6 +681,23 @@ class Watcher(FileSystemEventHandler):
         '''Exit a context.'''
         self.stop()
 
+    def dispatch(self, event):
+        '''Dispatch a watchdog event to the appropriate method.
+
+        Only modifications are handled.
+
+        Args:
+            event (object): watchdog event object
+
+        Returns:
+            Watcher: for method chaining
+
+        .. versionadded:: 0.3.0
+        '''
+        if 'modified' == event.event_type:
+            self.on_modified(event)
+        return self
+
     def on_modified(self, event=None):
         '''Handle a file modification.
 
@@ -169,6 +722,7 @@ class Watcher(FileSystemEventHandler):
         if self.observer:  # already started
             return self
 
+        from watchdog.observers import Observer
         self.observer = Observer()
         if self.path:
             self._watch = self.observer.schedule(self, path=self.path,
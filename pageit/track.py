@@ -0,0 +1,238 @@
+#!/usr/bin/python
+# coding: utf-8
+
+'''Record what a template touches while it renders.
+
+Rendering code calls :py:func:`~pageit.track.record` whenever it reads
+something a page may depend on (e.g. a data file). Callers interested in
+those accesses wrap the render in :py:func:`~pageit.track.recording`.
+
+.. versionadded:: 0.3.0
+'''
+
+# Native
+from contextlib import contextmanager
+import collections
+import hashlib
+import json
+import threading
+
+_LOCAL = threading.local()
+
+
+def _stack():
+    '''Returns the recording stack for the current thread.
+
+    Returns:
+        list: active recordings, innermost last
+    '''
+    if not hasattr(_LOCAL, 'stack'):
+        _LOCAL.stack = []
+    return _LOCAL.stack
+
+
+@contextmanager
+def recording():
+    '''Record accesses for the duration of a context.
+
+    Recordings nest: an access is added to every active recording.
+
+    Yields:
+        collections.defaultdict: sets of accessed values keyed by kind
+
+    Examples:
+        >>> with recording() as outer:
+        ...     record('data', 'a.yml')
+        ...     with recording() as inner:
+        ...         record('data', 'b.yml')
+        >>> sorted(outer['data'])
+        ['a.yml', 'b.yml']
+        >>> sorted(inner['data'])
+        ['b.yml']
+
+        >>> record('data', 'c.yml')  # nothing is recording
+    '''
+    rec = collections.defaultdict(set)
+    stack = _stack()
+    stack.append(rec)
+    try:
+        yield rec
+    finally:  # by identity; recordings with the same accesses are equal
+        del stack[[id(item) for item in stack].index(id(rec))]
+
+
+def record(kind, value):
+    '''Add an access to all active recordings.
+
+    Args:
+        kind (str): kind of access (e.g. ``data``)
+        value: hashable value identifying what was accessed
+    '''
+    for rec in _stack():
+        rec[kind].add(value)
+
+
+def _plain(value):
+    '''Converts a value that JSON cannot encode into one that it can.
+
+    Args:
+        value: value to convert
+
+    Returns:
+        dict, list, or str: JSON-encodable representation of the value
+    '''
+    if isinstance(value, collections.Mapping):
+        return dict(value)
+    elif isinstance(value, (set, frozenset)):
+        return sorted(value)
+    return repr(value)
+
+
+def digest(value):
+    '''Returns a stable digest of a value.
+
+    Mappings (including namespaces) are compared by content, regardless of
+    their key order.
+
+    Args:
+        value: value to digest
+
+    Returns:
+        str: hex digest
+
+    Examples:
+        >>> from pageit.namespace import Namespace
+        >>> digest({'a': 1, 'b': [2]}) == digest(Namespace(b=[2], a=1))
+        True
+        >>> digest({'a': 1}) == digest({'a': 2})
+        False
+    '''
+    encoded = json.dumps(value, sort_keys=True, default=_plain)
+    return hashlib.md5(encoded.encode('utf-8')).hexdigest()
+
+
+class Tracked(object):
+    '''Proxy that records which top-level keys of a namespace are read.
+
+    Reads are recorded with :py:func:`~pageit.track.record`.
+
+    Args:
+        target (pageit.namespace.Namespace): namespace to wrap
+        kind (str, optional): kind of access to record; default is ``site``
+
+    Mapping methods record the keys they read rather than their own names:
+    ``get()`` records its key, and ``keys()``, ``values()``, ``items()``
+    (and other methods of the namespace) record every key.
+
+    Examples:
+        >>> from pageit.namespace import DeepNamespace
+        >>> site = Tracked(DeepNamespace(a=1, b={'c': 2}, d=3))
+        >>> with recording() as rec:
+        ...     site.a == 1 and site['b'].c == 2 and 'x' not in site
+        True
+        >>> sorted(rec['site'])
+        ['a', 'b', 'x']
+
+        >>> with recording() as rec:
+        ...     site.get('d'), site.get('y')
+        (3, None)
+        >>> sorted(rec['site'])
+        ['d', 'y']
+
+        >>> with recording() as rec:
+        ...     sorted(site.keys())
+        ['a', 'b', 'd']
+        >>> sorted(rec['site'])
+        ['a', 'b', 'd']
+    '''
+    __slots__ = ('_target', '_kind')
+
+    def __init__(self, target, kind='site'):
+        '''Construct a proxy.'''
+        self._target = target
+        self._kind = kind
+
+    def __getattr__(self, name):
+        '''Returns an attribute of the target, recording the read.
+
+        Methods of the target that are not keys (e.g. ``copy``) may read any
+        key, so every key is recorded.
+        '''
+        if name.startswith('__'):
+            raise AttributeError(name)
+        if name not in self._target and \
+                callable(getattr(type(self._target), name, None)):
+            self._record_all()
+        else:
+            record(self._kind, name)
+        return getattr(self._target, name)
+
+    def _record_all(self):
+        '''Records every key of the target.
+
+        Returns:
+            list: the keys
+        '''
+        keys = list(self._target.keys())
+        for key in keys:
+            record(self._kind, key)
+        return keys
+
+    def get(self, name, default=None):
+        '''Returns an item of the target (or a default), recording the
+        read.'''
+        record(self._kind, name)
+        return self._target.get(name, default)
+
+    def has_key(self, name):
+        '''Returns True if the target has the key, recording the read.'''
+        return name in self
+
+    def keys(self):
+        '''Returns the target's keys, recording them all.'''
+        return self._record_all()
+
+    def values(self):
+        '''Returns the target's values, recording every key.'''
+        return [self._target[key] for key in self._record_all()]
+
+    def items(self):
+        '''Returns the target's items, recording every key.'''
+        return [(key, self._target[key]) for key in self._record_all()]
+
+    def iterkeys(self):
+        '''Returns an iterator over the target's keys, recording them
+        all.'''
+        return iter(self.keys())
+
+    def itervalues(self):
+        '''Returns an iterator over the target's values, recording every
+        key.'''
+        return iter(self.values())
+
+    def iteritems(self):
+        '''Returns an iterator over the target's items, recording every
+        key.'''
+        return iter(self.items())
+
+    def __getitem__(self, name):
+        '''Returns an item of the target, recording the read.'''
+        record(self._kind, name)
+        return self._target[name]
+
+    def __contains__(self, name):
+        '''Returns True if the target has the key, recording the read.'''
+        record(self._kind, name)
+        return name in self._target
+
+    def __iter__(self):
+        '''Returns an iterator over the target's keys, recording them all.'''
+        return iter(self._record_all())
+
+    def __len__(self):
+        '''Returns the number of keys, recording them all.'''
+        return len(list(iter(self)))
+
+    def __repr__(self):
+        '''Returns a string representation of the target.'''
+        return repr(self._target)
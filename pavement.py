@@ -116,6 +116,18 @@ def _pylint():
     lint.Run(args, exit=False)
 
 
+@task
+def bench():
+    '''Time how long the command-line tool takes to start.'''
+    import subprocess
+    import timeit
+    runs = 10
+    cmd = [sys.executable, '-m', 'pageit.render', '--version']
+    elapsed = timeit.timeit(lambda: subprocess.check_output(
+        cmd, stderr=subprocess.STDOUT), number=runs)
+    print 'startup: %.3fs (average of %d runs)' % (elapsed / runs, runs)
+
+
 @task
 @needs(['sdist', 'upload'])
 def pypi():
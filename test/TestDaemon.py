@@ -0,0 +1,78 @@
+#!/usr/bin/python
+# coding: utf-8
+
+# Native
+from os import path as osp
+import inspect
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+# Package
+from pageit import daemon
+from pageit.render import Pageit
+
+CWD = osp.dirname(osp.abspath(inspect.getfile(inspect.currentframe())))
+
+
+class TestDaemon(unittest.TestCase):
+    path = osp.join(CWD, 'example1')
+
+    def setUp(self):
+        '''Start a daemon in a background thread.'''
+        self.tmp = tempfile.mkdtemp()
+        self.socket = osp.join(self.tmp, 'pageit.sock')
+        self.daemon = daemon.Daemon(Pageit(path=self.path), self.socket)
+        self.thread = threading.Thread(target=self.daemon.serve)
+        self.thread.start()
+        for _ in range(50):  # wait for the socket
+            if osp.exists(self.socket):
+                break
+            time.sleep(0.01)
+
+    def tearDown(self):
+        '''Stop the daemon.'''
+        daemon.send(self.socket, 'stop')
+        self.thread.join()
+        shutil.rmtree(self.tmp)
+
+    def test_commands(self):
+        '''Build, clean, and report status over the socket.'''
+        outfile = osp.join(self.path, 'index.html')
+
+        response = daemon.send(self.socket, 'build')
+        self.assertTrue(response['ok'])
+        self.assertTrue(osp.isfile(outfile))
+        self.assertTrue(response['stats']['total'] > 0)
+
+        response = daemon.send(self.socket, 'status')
+        self.assertEquals(1, response['builds'])
+        self.assertEquals(self.path, response['path'])
+
+        response = daemon.send(self.socket, 'clean')
+        self.assertTrue(response['ok'])
+        self.assertFalse(osp.isfile(outfile))
+
+        response = daemon.send(self.socket, 'fake')
+        self.assertFalse(response['ok'])
+
+    def test_changes(self):
+        '''Build a burst of file changes once on the build queue.'''
+        runs = []
+        self.daemon.runner.run = lambda: runs.append(1)
+        infile = osp.join(self.path, 'index.html.mako')
+        for _ in range(5):
+            self.daemon.on_change(infile)
+        self.assertTrue(self.daemon.queue.wait(5))
+        self.assertEquals(1, len(runs))
+
+    def test_error(self):
+        '''Reply to the client when a command fails.'''
+        def fail():
+            raise RuntimeError('broken')
+        self.daemon.runner.run = fail
+        response = daemon.send(self.socket, 'build')
+        self.assertFalse(response['ok'])
+        self.assertEquals('RuntimeError: broken', response['error'])
@@ -3,16 +3,22 @@
 
 # Native
 from os import path as osp
+import gzip
 import inspect
+import json
 import os
+import shutil
+import tempfile
+import time
 import unittest
 
 # 3rd Party
 from nose.plugins.skip import SkipTest, Skip
 
 # Package
+from pageit import tools
 from pageit.render import Pageit
-from pageit.namespace import Namespace
+from pageit.namespace import Namespace, DeepNamespace
 import pageit.render as module
 
 CWD = osp.dirname(osp.abspath(inspect.getfile(inspect.currentframe())))
@@ -79,3 +85,729 @@ class TestPageit(unittest.TestCase):
         self.pageit.mako(infile)
         self.assertFalse(osp.isfile(outfile),
                          'dry run should not generate files')
+
+    def test_data(self):
+        '''Read data files lazily and re-render when they change.'''
+        infile = osp.join(self.path, 'subdir', 'data-page.html.mako')
+        outfile = osp.join(self.path, 'subdir', 'data-page.html')
+        datafile = osp.join(self.path, 'data', 'links.yml')
+        name = osp.relpath(infile, self.path)
+
+        self.pageit.mako(infile)
+        self.assertTrue('home: /index.html' in open(outfile).read())
+        self.assertEquals([osp.join('data', 'links.yml')],
+                          self.pageit.manifest.get(name).data)
+
+        # data newer than output => stale
+        original = osp.getmtime(datafile)
+        mtime = int(osp.getmtime(outfile))
+        os.utime(datafile, (mtime + 10, mtime + 10))
+        self.assertTrue(self.pageit.data_mtime(name) > mtime)
+        os.utime(datafile, (original, original))
+
+        self.pageit.clean()
+        self.assertFalse(osp.isfile(outfile))
+        self.assertFalse(name in self.pageit.manifest)
+
+    def test_data_listing(self):
+        '''Re-render pages that list data files when a file is added.'''
+        path = tempfile.mkdtemp()
+        try:
+            data = osp.join(path, 'data')
+            os.makedirs(data)
+            with open(osp.join(data, 'a.yml'), 'w') as out:
+                out.write('x: 1')
+            with open(osp.join(path, 'list.html.mako'), 'w') as out:
+                out.write("${','.join(site.data)}")
+
+            runner = Pageit(path=path, site=DeepNamespace()).run()
+            outfile = osp.join(path, 'list.html')
+            with open(outfile) as stream:
+                self.assertEquals('a', stream.read())
+            self.assertEquals([], runner.run().stats.stale)
+
+            with open(osp.join(data, 'b.yml'), 'w') as out:
+                out.write('x: 2')
+            mtime = int(osp.getmtime(outfile)) + 10
+            os.utime(data, (mtime, mtime))
+            self.assertEquals(['list.html.mako'],
+                              [item.name for item in
+                               runner.run().stats.stale])
+            with open(outfile) as stream:
+                self.assertEquals('a,b', stream.read())
+        finally:
+            shutil.rmtree(path)
+
+    def test_site_changes(self):
+        '''Re-render only pages that read changed site keys.'''
+        self.pageit.run()
+        index = 'index.html.mako'
+        other = osp.join('subdir', 'test-page.html.mako')
+        self.assertEquals(['base_url'],
+                          sorted(self.pageit.manifest.get(index).site))
+        self.assertEquals([], self.pageit.site_changes(index))
+
+        site = Namespace(self.pageit.site, base_url='//example.com/')
+        runner = Pageit(path=self.path, site=site)
+        self.assertEquals(['base_url'], runner.site_changes(index))
+        self.assertEquals([], runner.site_changes(other))
+        runner.run()
+        self.assertEquals([], runner.site_changes(index))
+        runner.clean()
+
+    def test_site_get(self):
+        '''Record the keys read with mapping methods of site.'''
+        from pageit.storage import MemoryStorage
+        root = osp.join(tempfile.gettempdir(), 'pageit-site-get')
+        storage = MemoryStorage({
+            osp.join(root, 'get.html.mako'): u"${site.get('title')}",
+            osp.join(root, 'items.html.mako'):
+                u"${len(list(site.items()))}"
+        })
+        runner = Pageit(path=root, storage=storage,
+                        site=DeepNamespace(title='A', other='B')).run()
+        self.assertEquals(['title'], sorted(runner.manifest.get(
+            'get.html.mako').site))
+        self.assertEquals(['other', 'title'], sorted(runner.manifest.get(
+            'items.html.mako').site))
+
+        runner = Pageit(path=root, storage=storage,
+                        site=DeepNamespace(title='C', other='B'))
+        self.assertEquals(['title'], runner.site_changes('get.html.mako'))
+        self.assertEquals('site changed: title', runner.stale(
+            osp.join(root, 'get.html.mako')))
+        runner.run()
+        self.assertEquals('C', storage.read(osp.join(root, 'get.html')))
+
+    def test_stream(self):
+        '''Stream output to disk while rendering.'''
+        infile = osp.join(self.path, 'index.html.mako')
+        outfile = osp.join(self.path, 'index.html')
+        expected = self.pageit.mako(infile) and open(outfile).read()
+        self.pageit.clean()
+
+        runner = Pageit(path=self.path, stream=True)
+        runner.mako(infile)
+        self.assertEquals(expected, open(outfile).read())
+
+        # errors replace the partial output
+        infile = osp.join(self.path, 'subdir', 'syntax-exception.html.mako')
+        outfile = osp.join(self.path, 'subdir', 'syntax-exception.html')
+        runner.mako(infile)
+        self.assertTrue(osp.isfile(outfile))
+        self.assertEquals([], [name for name in os.listdir(osp.dirname(infile))
+                               if name.startswith(module.TMP_PREFIX)])
+        runner.clean()
+
+    def test_collection(self):
+        '''Generate one page per collection item.'''
+        infile = osp.join(self.path, 'subdir', 'tags.html.mako')
+        name = osp.relpath(infile, self.path)
+        outfiles = [osp.join(self.path, 'subdir', 'tag-mako.html'),
+                    osp.join(self.path, 'subdir', 'tag-python.html')]
+
+        self.pageit.run()
+        self.assertEquals(outfiles, self.pageit.outputs(infile))
+        self.assertEquals('python: Python (1)',
+                          open(outfiles[1]).read().strip())
+        self.assertEquals([osp.join('data', 'tags.yml')],
+                          self.pageit.manifest.get(name).data)
+
+        # outputs that are no longer generated are removed
+        site = DeepNamespace(data={'tags': {'mako': {'title': 'Mako'}}})
+        runner = Pageit(path=self.path, site=site)
+        runner.mako(infile)
+        self.assertEquals(outfiles[:1], runner.outputs(infile))
+        self.assertFalse(osp.isfile(outfiles[1]))
+
+        runner.clean()
+        self.assertFalse(osp.isfile(outfiles[0]))
+        self.pageit.clean()
+
+        # an empty collection is not rendered again
+        runner = Pageit(path=self.path, site=DeepNamespace(data={'tags': {}}))
+        runner.run()
+        self.assertEquals([], runner.outputs(infile))
+        self.assertEquals(None, runner.stale(infile))
+        self.assertFalse(name in [item.name for item
+                                  in runner.run().stats.stale])
+        runner.clean()
+
+    def test_dry_run_report(self):
+        '''Report stale templates and estimated time during a dry run.'''
+        layout = osp.join(self.path, 'layouts.mako', 'base.html')
+        outfile = osp.join(self.path, 'index.html')
+        original = osp.getmtime(layout)
+
+        self.pageit.run()
+        self.assertEquals([], Pageit(path=self.path).run().stats.stale)
+
+        mtime = int(osp.getmtime(outfile)) + 10
+        os.utime(layout, (mtime, mtime))
+        try:
+            before = osp.getmtime(outfile)
+            runner = Pageit(path=self.path, dry_run=True).run()
+            self.assertEquals(before, osp.getmtime(outfile))
+
+            reasons = dict((item.name, item.reason)
+                           for item in runner.stats.stale)
+            self.assertEquals('dependency changed <layouts.mako/base.html>',
+                              reasons['index.html.mako'])
+            self.assertTrue(runner.stats.estimate > 0)
+        finally:
+            os.utime(layout, (original, original))
+            self.pageit.clean()
+
+    def test_clean_orphans(self):
+        '''Clean outputs of deleted templates using the manifest.'''
+        orphan = osp.join(self.path, 'gone', 'deep', 'page.html')
+        os.makedirs(osp.dirname(orphan))
+        open(orphan, 'w').close()
+
+        runner = Pageit(path=self.path, jobs=4)
+        runner.run()
+        runner.manifest.set('gone.html.mako',
+                            outputs=[osp.relpath(orphan, self.path)])
+        count = len(runner.manifest.outputs())
+
+        runner.clean()
+        self.assertEquals(count, runner.stats.deleted)
+        self.assertEquals(2, runner.stats.pruned)
+        self.assertFalse(osp.isdir(osp.join(self.path, 'gone')))
+        self.assertFalse(osp.isfile(osp.join(self.path, 'index.html')))
+        self.assertEquals(0, len(runner.manifest))
+
+    def test_out(self):
+        '''Write outputs and static files into a separate directory.'''
+        out = tempfile.mkdtemp()
+        try:
+            runner = Pageit(path=self.path, out=out)
+            runner.run()
+            self.assertTrue(osp.isfile(osp.join(out, 'index.html')))
+            self.assertFalse(osp.isfile(osp.join(self.path, 'index.html')))
+
+            static = osp.join('subdir', 'local-include.html')
+            self.assertTrue(osp.isfile(osp.join(out, static)))
+            self.assertFalse(tools.outdated(osp.join(self.path, static),
+                                            osp.join(out, static)))
+            self.assertFalse(osp.exists(osp.join(out, 'pageit.yml')))
+            self.assertFalse(osp.exists(osp.join(out, 'data')))
+            self.assertFalse(osp.exists(osp.join(out, 'index.html.mako')))
+            self.assertIn('index.html', runner.stats.written)
+            self.assertIn(static, runner.stats.written)
+            rerun = Pageit(path=self.path, out=out).run()
+            self.assertEquals(0, rerun.stats.linked)
+            self.assertEquals([], rerun.stats.written)
+
+            runner.clean()
+            self.assertEquals([], os.listdir(out))
+        finally:
+            shutil.rmtree(out)
+
+    def test_out_static(self):
+        '''Do not pass data, configuration, or stale outputs through.'''
+        path, out = tempfile.mkdtemp(), tempfile.mkdtemp()
+        try:
+            os.makedirs(osp.join(path, 'data', 'sub'))
+            os.makedirs(osp.join(path, 'conf'))
+            files = {'data/sub/x.yml': 'a: 1',
+                     'conf/site.yml': 'default: {title: New}',
+                     'a.html.mako': '${site.title}', 'a.html': 'Old',
+                     'b.txt': 'b'}
+            for name, content in files.items():
+                with open(osp.join(path, name), 'w') as stream:
+                    stream.write(content)
+
+            config = osp.join(path, 'conf', 'site.yml')
+            runner = Pageit(path=path, out=out, config=config).run()
+            with open(osp.join(out, 'a.html')) as stream:
+                self.assertEquals('New', stream.read())
+            self.assertEquals(['a.html', 'b.txt'],
+                              sorted(runner.stats.written))
+            self.assertFalse(osp.exists(osp.join(out, 'data')))
+            self.assertFalse(osp.exists(osp.join(out, 'conf')))
+        finally:
+            shutil.rmtree(path)
+            shutil.rmtree(out)
+
+    def test_gzip(self):
+        '''Write compressed copies of outputs whose content changed.'''
+        out = tempfile.mkdtemp()
+        try:
+            runner = Pageit(path=self.path, out=out, gzip=True, jobs=2)
+            runner.run()
+            dest = osp.join(out, 'index.html')
+            with open(dest, 'rb') as stream:
+                expected = stream.read()
+            with gzip.open(dest + '.gz', 'rb') as stream:
+                self.assertEquals(expected, stream.read())
+            self.assertEquals(dest + '.gz', tools.compressed(dest))
+            self.assertIn(osp.join('subdir', 'tag-mako.html.gz'),
+                          runner.manifest.outputs())
+            self.assertTrue(runner.stats.compressed > 0)
+
+            rerun = Pageit(path=self.path, out=out, gzip=True,
+                           ignore_mtime=True).run()
+            self.assertIn('index.html', rerun.stats.written)
+            self.assertEquals(0, rerun.stats.compressed,
+                              'unchanged content should not be compressed')
+            self.assertEquals(dest + '.gz', tools.compressed(dest))
+
+            runner.clean()
+            self.assertEquals([], os.listdir(out))
+        finally:
+            shutil.rmtree(out)
+
+    def test_filters(self):
+        '''Run filters on rendered pages unless their content is unchanged.'''
+        out = tempfile.mkdtemp()
+        calls = []
+
+        def shout(text, page):
+            calls.append(page.output)
+            return text.upper()
+
+        try:
+            runner = Pageit(path=self.path, out=out, filters=['html', shout])
+            runner.run()
+            self.assertIn('index.html', calls)
+            self.assertTrue(runner.stats.saved['index.html'] > 0)
+            with open(osp.join(out, 'index.html')) as stream:
+                content = stream.read()
+            self.assertIn('<BASE>', content)
+            self.assertNotIn('\n\n', content)
+
+            del calls[:]
+            rerun = Pageit(path=self.path, out=out, filters=['html', shout],
+                           ignore_mtime=True).run()
+            self.assertEquals([], calls, 'unchanged pages skip the filters')
+            self.assertIn('index.html', rerun.stats.written)
+            with open(osp.join(out, 'index.html')) as stream:
+                self.assertEquals(content, stream.read())
+
+            Pageit(path=self.path, out=out, ignore_mtime=True).run()
+            with open(osp.join(out, 'index.html')) as stream:
+                self.assertIn('<base>', stream.read(),
+                              'changing the filters renders again')
+
+            del calls[:]
+            Pageit(path=self.path, out=out, filters=['html', shout],
+                   stream=True, ignore_mtime=True).run()
+            self.assertEquals([], calls, 'streamed pages are not filtered')
+            with open(osp.join(out, 'index.html')) as stream:
+                self.assertIn('<base>', stream.read())
+
+            runner.clean()
+        finally:
+            shutil.rmtree(out)
+
+    def test_fragments_set(self):
+        '''Cache values set by templates in the fragment cache.'''
+        path = tempfile.mkdtemp()
+        try:
+            with open(osp.join(path, 'a.html.mako'), 'w') as out:
+                out.write("<% local.cache.set('greeting', u'Hi') %>"
+                          "${local.cache.get('greeting')}")
+
+            runner = Pageit(path=path, site=DeepNamespace()).run()
+            self.assertEquals([], runner.stats.errors)
+            with open(osp.join(path, 'a.html')) as stream:
+                self.assertEquals('Hi', stream.read())
+            self.assertEquals(1, len(runner.fragments))
+        finally:
+            shutil.rmtree(path)
+
+    def test_fragments(self):
+        '''Render cached fragments once and reuse them across builds.'''
+        path = tempfile.mkdtemp()
+        try:
+            with open(osp.join(path, 'base.html'), 'w') as out:
+                out.write('<%def name="nav()" cached="True">${site.title}'
+                          '</%def>${nav()}|${next.body()}')
+            for name in ['a', 'b']:
+                with open(osp.join(path, name + '.html.mako'), 'w') as out:
+                    out.write('<%inherit file="base.html"/>' + name)
+
+            cache = osp.join(path, 'cache')
+            site = DeepNamespace(title='Home')
+            runner = Pageit(path=path, site=site, fragments=cache).run()
+            self.assertEquals((1, 1), (runner.stats.fragments.misses,
+                                       runner.stats.fragments.hits))
+            with open(osp.join(path, 'b.html')) as stream:
+                self.assertEquals('Home|b', stream.read())
+            self.assertEquals(['title'],
+                              runner.manifest.get('b.html.mako').site.keys(),
+                              'cached fragments keep their dependencies')
+
+            runner.args.ignore_mtime = True
+            self.assertEquals(0, runner.run().stats.fragments.misses)
+
+            runner.set_site(DeepNamespace(title='New'))
+            self.assertEquals(1, runner.run().stats.fragments.misses)
+            with open(osp.join(path, 'a.html')) as stream:
+                self.assertEquals('New|a', stream.read())
+
+            rerun = Pageit(path=path, site=DeepNamespace(title='New'),
+                           fragments=cache, ignore_mtime=True).run()
+            self.assertEquals((0, 2), (rerun.stats.fragments.misses,
+                                       rerun.stats.fragments.hits),
+                              'fragments are kept between builds')
+        finally:
+            shutil.rmtree(path)
+
+    def test_shared_errors(self):
+        '''Pages that fail because of the same layout share one error.'''
+        path = tempfile.mkdtemp()
+        try:
+            with open(osp.join(path, 'base.html'), 'w') as out:
+                out.write('% if True:\n${next.body()}\n')  # missing endif
+            for name in ['a', 'b', 'c']:
+                with open(osp.join(path, name + '.html.mako'), 'w') as out:
+                    out.write('<%inherit file="base.html"/>' + name)
+
+            runner = Pageit(path=path).run()
+            self.assertEquals(1, len(runner.stats.errors))
+            self.assertEquals(['a.html.mako', 'b.html.mako', 'c.html.mako'],
+                              sorted(runner.stats.errors[0].pages))
+            self.assertIn('base.html', runner.stats.errors[0].cause)
+
+            contents = set([])
+            for name in ['a', 'b', 'c']:
+                with open(osp.join(path, name + '.html')) as stream:
+                    contents.add(stream.read())
+            self.assertEquals(1, len(contents))
+            self.assertIn('SyntaxException', contents.pop())
+
+            runner = Pageit(path=path, noerr=True, ignore_mtime=True).run()
+            self.assertEquals(3, len(runner.stats.errors[0].pages))
+        finally:
+            shutil.rmtree(path)
+
+    def test_parsed_deps(self):
+        '''Find dependencies in tags the old line scan missed.'''
+        path = tempfile.mkdtemp()
+        try:
+            part = osp.join(path, 'part.html')
+            with open(part, 'w') as out:
+                out.write('part')
+            page = osp.join(path, 'page.html.mako')
+            with open(page, 'w') as out:
+                out.write("<%include\n    file='part.html'/>")
+
+            runner = Pageit(path=path).run()
+            self.assertEquals(set([part]), runner.mako_deps(page))
+            self.assertEquals(None, runner.stale(page))
+
+            future = osp.getmtime(osp.join(path, 'page.html')) + 10
+            os.utime(part, (future, future))
+            self.assertIn('dependency changed', runner.stale(page))
+        finally:
+            shutil.rmtree(path)
+
+    def test_loaded_templates(self):
+        '''Record templates loaded by computed names as dependencies.'''
+        path = tempfile.mkdtemp()
+        try:
+            part = osp.join(path, 'part-a.html')
+            with open(part, 'w') as out:
+                out.write('part')
+            page = osp.join(path, 'page.html.mako')
+            with open(page, 'w') as out:
+                out.write("<% name = 'part-' + 'a.html' %>"
+                          "<%include file='${name}'/>")
+
+            runner = Pageit(path=path).run()
+            self.assertEquals(set([]), runner.mako_deps(page))
+            self.assertEquals(['part-a.html'],
+                              runner.manifest.get('page.html.mako').templates)
+            self.assertEquals(None, runner.stale(page))
+
+            future = osp.getmtime(osp.join(path, 'page.html')) + 10
+            os.utime(part, (future, future))
+            self.assertIn('loaded template changed', runner.stale(page))
+        finally:
+            shutil.rmtree(path)
+
+    def test_changes(self):
+        '''Record which outputs changed since the previous build.'''
+        out = tempfile.mkdtemp()
+        try:
+            runner = Pageit(path=self.path, out=out).run()
+            changes = runner.stats.changes
+            self.assertIn('index.html', changes.added)
+            self.assertIn(osp.join('subdir', 'local-include.html'),
+                          changes.added)
+            self.assertEquals([], changes.changed + changes.removed)
+            with open(osp.join(out, '.pageit-changes.json')) as stream:
+                self.assertEquals(changes.added,
+                                  json.load(stream)['added'])
+
+            entry = runner.manifest.get('index.html.mako')
+            self.assertEquals(os.path.getsize(osp.join(out, 'index.html')),
+                              entry.sizes['index.html'])
+
+            runner.args.ignore_mtime = True
+            changes = runner.run().stats.changes
+            self.assertEquals([], changes.added + changes.changed +
+                              changes.removed, 'same content is unchanged')
+
+            runner.set_site(DeepNamespace(base_url='//example.com/'))
+            changes = runner.run().stats.changes
+            self.assertIn('index.html', changes.changed)
+            self.assertNotIn(osp.join('subdir', 'test-page.html'),
+                             changes.changed)
+
+            runner.clean()
+            self.assertEquals([], os.listdir(out))
+        finally:
+            shutil.rmtree(out)
+
+    def test_shard(self):
+        '''Build disjoint shards into one output and merge them.'''
+        out = tempfile.mkdtemp()
+        try:
+            shards = [Pageit(path=self.path, out=out, shard=(k, 3)).run()
+                      for k in (1, 2, 3)]
+            names = [set(runner.manifest) for runner in shards]
+            self.assertEquals(set(), names[0] & names[1] | names[1] & names[2]
+                              | names[0] & names[2])
+            total = Pageit(path=self.path, out=out, dry_run=True).run()
+            self.assertEquals(total.stats.total,
+                              sum(runner.stats.total for runner in shards))
+            self.assertTrue(osp.isfile(osp.join(out, 'index.html')))
+
+            runner = Pageit(path=self.path, out=out).merge()
+            self.assertEquals(3, runner.stats.shards)
+            self.assertEquals(names[0] | names[1] | names[2],
+                              set(runner.manifest))
+            self.assertIn('index.html', runner.stats.changes.added)
+            self.assertEquals(['.pageit-changes.json', '.pageit.jsonl'],
+                              sorted(name for name in os.listdir(out)
+                                     if name.startswith('.')))
+            self.assertEquals([], runner.run().stats.stale,
+                              'merged manifest is up to date')
+
+            # timings of the merged build balance the next sharded build
+            runner = Pageit(path=self.path, out=out, shard=(1, 3)).run()
+            self.assertEquals(3, runner.stats.shard.count)
+            self.assertEquals([], runner.stats.stale)
+            self.assertEquals(0, Pageit(path=self.path, out=out).merge()
+                              .stats.shards, 'incomplete shards')
+            runner.clean()
+        finally:
+            shutil.rmtree(out)
+
+    def test_schedule(self):
+        '''Render stale templates longest first on several workers.'''
+        out = tempfile.mkdtemp()
+        try:
+            runner = Pageit(path=self.path, out=out, jobs=3,
+                            ignore_mtime=True).run()
+            names = [item.name for item in runner.stats.stale]
+            self.assertEquals(sorted(names), runner.stats.schedule.order)
+            self.assertTrue(osp.isfile(osp.join(out, 'index.html')))
+
+            slow = 'subdir/test-page.html.mako'
+            entry = runner.manifest.get(slow)
+            runner.manifest.set(slow, **dict(entry, elapsed=10.0))
+            plan = runner.run().stats.schedule
+            self.assertEquals(slow, plan.order[0])
+            self.assertEquals([slow], plan.lanes[0], 'others fill in')
+            self.assertEquals(10.0, plan.estimate)
+            self.assertEquals(sorted(names),
+                              sorted(sum(plan.workers, [])))
+        finally:
+            shutil.rmtree(out)
+
+    def test_parallel_dirs(self):
+        '''Create output directories from several workers at once.'''
+        path = tempfile.mkdtemp()
+        try:
+            for index in range(20):
+                os.makedirs(osp.join(path, 'd%d' % index))
+                for name in ['a', 'b']:
+                    with open(osp.join(path, 'd%d' % index,
+                                       name + '.html.mako'), 'w') as out:
+                        out.write('${page.output}')
+
+            for _ in range(5):
+                out = tempfile.mkdtemp()
+                try:
+                    runner = Pageit(path=path, out=osp.join(out, 'site'),
+                                    jobs=8, site=DeepNamespace()).run()
+                    self.assertEquals([], runner.stats.errors)
+                    self.assertEquals(40, len(runner.stats.written))
+                    self.assertTrue(osp.isfile(osp.join(out, 'site', 'd13',
+                                                        'b.html')))
+                finally:
+                    shutil.rmtree(out)
+        finally:
+            shutil.rmtree(path)
+
+    def test_memory(self):
+        '''Bound compiled templates and release caches after renders.'''
+        out = tempfile.mkdtemp()
+        try:
+            runner = Pageit(path=self.path, out=out, max_templates=1,
+                            recycle=2, ignore_mtime=True).run()
+            memory = runner.stats.memory
+            self.assertEquals(len(runner.stats.stale) // 2, memory.recycled)
+            self.assertTrue(memory.templates <= 1)
+            self.assertTrue(memory.used > 0)
+            self.assertTrue(osp.isfile(osp.join(out, 'index.html')))
+
+            runner = Pageit(path=self.path, out=out, recycle=1, jobs=4,
+                            ignore_mtime=True).run()
+            self.assertTrue(runner.stats.memory.recycled > 0)
+            self.assertEquals(1, len(runner.stats.errors),
+                              'only the broken template fails')
+
+            runner = Pageit(path=self.path, out=out, memory=0.001,
+                            ignore_mtime=True).run()
+            self.assertEquals(1, runner.stats.memory.recycled,
+                              'a budget below the baseline recycles once')
+        finally:
+            shutil.rmtree(out)
+
+    def test_render_batch(self):
+        '''Render several templates in memory with overrides.'''
+        out = tempfile.mkdtemp()
+        try:
+            runner = Pageit(path=self.path, out=out, jobs=2)
+            results = runner.render_batch([
+                dict(template='subdir/test-page.html.mako',
+                     page=dict(dirname='override')),
+                'subdir/syntax-exception.html.mako',
+                dict(template='subdir/tags.html.mako',
+                     site=dict(data=dict(tags=dict(a=dict(title='A'),
+                                                   b=dict(title='B')))))
+            ])
+            self.assertEquals([], os.listdir(out), 'nothing written')
+            self.assertEquals(0, len(runner.manifest))
+
+            page, broken, tags = results
+            self.assertIn('dirname: override', page.content)
+            self.assertIn('output: subdir/test-page.html', page.content)
+            self.assertEquals(None, page.error)
+            self.assertTrue(page.elapsed >= 0)
+
+            self.assertTrue(broken.error)
+            self.assertEquals(None, broken.content)
+
+            self.assertEquals(['subdir/tag-a.html', 'subdir/tag-b.html'],
+                              [item.output for item in tags.pages])
+            self.assertEquals('a: A (0)', tags.content.strip())
+        finally:
+            shutil.rmtree(out)
+
+    def test_memory_storage(self):
+        '''Render templates kept in memory into memory.'''
+        from pageit.storage import MemoryStorage
+        root = osp.join(tempfile.gettempdir(), 'pageit-memory', 'site')
+        storage = MemoryStorage({
+            osp.join(root, 'base.mako', 'page.html'): u'<b>${next.body()}</b>',
+            osp.join(root, 'index.html.mako'):
+                u'<%inherit file="/base.mako/page.html"/>${page.path}',
+            osp.join(root, 'style.css'): u'b {}'
+        })
+        for path in storage.files:
+            storage.touch(path, 1000)
+
+        runner = Pageit(path=root, out=osp.join(root, 'out'),
+                        site=DeepNamespace(title='Memory'),
+                        storage=storage).run()
+        self.assertFalse(osp.exists(osp.dirname(root)), 'no files on disk')
+        self.assertEquals('<b>index.html.mako</b>',
+                          storage.read(osp.join(root, 'out', 'index.html')))
+        self.assertTrue(storage.isfile(osp.join(root, 'out', 'style.css')))
+        self.assertTrue(storage.isfile(osp.join(root, 'out', '.pageit.jsonl')))
+        self.assertEquals([], runner.run().stats.stale)
+
+        storage.write(osp.join(root, 'base.mako', 'page.html'),
+                      u'<i>${next.body()}</i>', mtime=time.time() + 10)
+        self.assertEquals(['index.html.mako'],
+                          [item.name for item in runner.run().stats.stale])
+        self.assertEquals('<i>index.html.mako</i>',
+                          storage.read(osp.join(root, 'out', 'index.html')))
+
+        runner.clean()
+        self.assertEquals([], storage.listdir(osp.join(root, 'out')))
+
+    def test_archive_storage(self):
+        '''Render templates from an archive into a directory or an archive.'''
+        import tarfile
+        import zipfile
+        from pageit.storage import open_storage
+        tmp = tempfile.mkdtemp()
+        try:
+            expected = osp.join(tmp, 'expected')
+            Pageit(path=self.path, out=expected).run()
+
+            source = osp.join(tmp, 'site.tgz')
+            with tarfile.open(source, 'w:gz') as archive:
+                archive.add(self.path, 'site')
+
+            path, out = osp.join(source, 'site'), osp.join(tmp, 'out')
+            storage = open_storage(path, out)
+            runner = Pageit(path=path, out=out, storage=storage).run()
+            self.assertEquals(['expected', 'out', 'site.tgz'],
+                              sorted(os.listdir(tmp)), 'not extracted')
+            for name in ['index.html', 'subdir/data-page.html']:
+                with open(osp.join(expected, name)) as stream:
+                    content = stream.read()
+                with open(osp.join(out, name)) as stream:
+                    self.assertEquals(content, stream.read(), name)
+            self.assertEquals([], runner.run().stats.stale)
+
+            source = osp.join(tmp, 'site.zip')
+            with zipfile.ZipFile(source, 'w') as archive:
+                for src, _, files in os.walk(self.path):
+                    for name in files:
+                        name = osp.relpath(osp.join(src, name), self.path)
+                        archive.write(osp.join(self.path, name), name)
+            out = osp.join(tmp, 'out.zip')
+            storage = open_storage(source, out)
+            Pageit(path=source, out=out, storage=storage).run()
+            with zipfile.ZipFile(out) as archive:
+                names = archive.namelist()
+                content = archive.read('subdir/index.html')
+            self.assertTrue('.pageit.jsonl' in names, names)
+            with open(osp.join(expected, 'subdir', 'index.html')) as stream:
+                self.assertEquals(stream.read(), content)
+
+            runner = Pageit(path=source, out=out,
+                            storage=open_storage(source, out)).run()
+            self.assertEquals([], runner.stats.stale)
+        finally:
+            shutil.rmtree(tmp)
+
+    def test_environments(self):
+        '''Render several environments in one pass.'''
+        from pageit.envs import Environments
+        tmp = tempfile.mkdtemp()
+        try:
+            expected = osp.join(tmp, 'expected')
+            Pageit(path=self.path, out=expected, site=module.create_site(
+                osp.join(self.path, 'pageit.yml'), 'test')).run()
+
+            envs = Environments(['default', 'test'], self.path, tmp)
+            stats = envs.run().stats
+            self.assertTrue(stats.envs.test.reused > 0)
+            self.assertEquals(len(stats.envs.default.stale),
+                              len(stats.envs.test.stale))
+            self.assertTrue(osp.join('test', 'index.html') in stats.written)
+            for name in ['index.html', 'subdir/data-page.html']:
+                with open(osp.join(expected, name)) as stream:
+                    content = stream.read()
+                with open(osp.join(tmp, 'test', name)) as stream:
+                    self.assertEquals(content, stream.read(), name)
+
+            lead = envs.runners[0]
+            self.assertTrue(all(runner.tmpl is lead.tmpl and
+                                runner._deps is lead._deps
+                                for runner in envs.runners))
+            stats = envs.run().stats
+            self.assertEquals([[], []], [stats.envs.default.stale,
+                                         stats.envs.test.stale])
+        finally:
+            shutil.rmtree(tmp)
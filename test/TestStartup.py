@@ -0,0 +1,45 @@
+#!/usr/bin/python
+# coding: utf-8
+
+# Native
+from os import path as osp
+import inspect
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+CWD = osp.dirname(osp.abspath(inspect.getfile(inspect.currentframe())))
+
+# modules that should only be imported when they are needed
+HEAVY = ['mako', 'yaml', 'watchdog', 'argh', 'SimpleHTTPServer',
+         'multiprocessing']
+
+
+class TestStartup(unittest.TestCase):
+    def test_lazy_imports(self):
+        '''Importing the renderer does not import heavy dependencies.'''
+        code = ('import sys, pageit.render; '
+                'print " ".join(sorted(set(sys.modules)))')
+        output = subprocess.check_output([sys.executable, '-c', code],
+                                         cwd=osp.dirname(CWD))
+        loaded = set(output.split())
+        for name in HEAVY:
+            self.assertNotIn(name, loaded)
+
+    def test_noop_run(self):
+        '''A run with nothing to render does not import mako.'''
+        out = tempfile.mkdtemp()
+        code = ('import sys; from pageit.render import Pageit; '
+                'runner = Pageit("test/example1", out=%r).run(); '
+                'print len(runner.stats.stale), "mako" in sys.modules' % out)
+        try:
+            subprocess.check_output([sys.executable, '-c', code],
+                                    cwd=osp.dirname(CWD),
+                                    stderr=subprocess.STDOUT)
+            output = subprocess.check_output([sys.executable, '-c', code],
+                                             cwd=osp.dirname(CWD))
+            self.assertEquals('0 False', output.strip().splitlines()[-1])
+        finally:
+            shutil.rmtree(out)
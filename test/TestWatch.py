@@ -64,3 +64,30 @@ class TestWatch(unittest.TestCase):
             time.sleep(0.75)
             self.assertEquals(2, self.count,
                               'should fire when observer is back on')
+
+    def test_build_queue(self):
+        '''Builds run on a worker thread and can be waited for.'''
+        builds = []
+
+        def build(paths):
+            time.sleep(0.2)
+            builds.append(paths)
+
+        with tools.BuildQueue(build, delay=0.1) as queue:
+            queue.put('a.mako').put('b.mako')
+            self.assertFalse(queue.wait(0), 'should be building')
+            self.assertTrue(queue.wait(5), 'should finish building')
+            self.assertEquals([['a.mako', 'b.mako']], builds,
+                              'should build related changes together')
+
+            queue.put('c.mako')
+        self.assertEquals(2, len(builds), 'should build before stopping')
+
+    def test_build_queue_error(self):
+        '''A failed build does not stop the queue.'''
+        def build(paths):
+            raise ValueError(paths)
+
+        with tools.BuildQueue(build, delay=0) as queue:
+            self.assertTrue(queue.put('a.mako').wait(5))
+            self.assertTrue(queue.put('b.mako').wait(5))
@@ -0,0 +1,2 @@
+home: ${site.data.links.home}
+subdir: ${site.data.links['subdir']}
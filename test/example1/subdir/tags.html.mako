@@ -0,0 +1,5 @@
+<%!
+    pageit_collection = 'data.tags'
+    pageit_output = 'tag-{key}.html'
+%>
+${page.key}: ${page.item.title} (${page.index})